@@ -1,46 +1,38 @@
-import boto3
+import io
 import os
-import tempfile
-import time
-import zipfile
 import numpy as np
-import pandas as pd
 from netCDF4 import Dataset
 from dotenv import load_dotenv
-import cdsapi
+
+from aggregation import PartialAggregate, aggregate_dataset, merge_all
+from crop_cube import build_cube
+from job_tracker import wait_for_result
+from manifest import Manifest
+from netcdf_pool import read_netcdf_parallel
+from s3_stream import get_s3_client
+from tracing import report_on_exit, stage
+from zip_loader import ZipDatasetLoader
 
 # Cargar variables de entorno
 if not os.getenv("GITHUB_ACTIONS"):
     load_dotenv()
 
-AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
-AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
-AWS_REGION = "us-east-1"
 BUCKET_NAME = "maize-climate-data-store"
-
-# Crear cliente S3
-s3_client = boto3.client(
-    's3',
-    aws_access_key_id=AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-    region_name=AWS_REGION
+S3_PREFIX = "crop_productivity_indicators/"
+MANIFEST_LOCATION = os.getenv(
+    "CROP_MANIFEST", f"s3://{BUCKET_NAME}/manifests/crop_productivity_indicators.json"
 )
+# Agregados parciales (mensuales) de cada ZIP procesado, combinables entre ejecuciones
+AGGREGATE_PREFIX = "processed/crop_productivity_indicators/"
+CROP_REGIONS = {'global': (-90.0, 90.0, -180.0, 180.0)}
 
-# Crear cliente CDS API
-client = cdsapi.Client()
+def wait_for_job_to_complete(client, dataset, request):
+    """Esperar hasta que el trabajo esté completo antes de intentar descargar.
 
-def wait_for_job_to_complete(client, request):
-    """Esperar hasta que el trabajo esté completo antes de intentar descargar."""
-    while True:
-        try:
-            client.retrieve(dataset, request)
-            break  # Salir del bucle si el trabajo está completo y listo para descargar
-        except Exception as e:
-            if "Result not ready, job is running" in str(e):
-                print("El trabajo aún está en curso, esperando 100 segundos antes de verificar nuevamente...")
-                time.sleep(100)  # Esperar 100 segundos antes de verificar nuevamente
-            else:
-                raise  # Lanzar cualquier otra excepción
+    El cliente debe crearse con cdsapi.Client(wait_until_complete=False); el
+    sondeo usa espera exponencial con jitter en lugar de un sleep fijo.
+    """
+    return wait_for_result(client, dataset, request)
 
 def upload_to_s3(temp_file_path, s3_client, bucket_name, s3_key):
     """Subir archivo a S3."""
@@ -50,47 +42,69 @@ def upload_to_s3(temp_file_path, s3_client, bucket_name, s3_key):
     else:
         print("El archivo temporal está vacío. No se recuperaron datos.")
 
-def download_and_extract_zip_from_s3(s3_prefix, extract_to='/tmp'):
-    """Descargar y extraer archivos ZIP desde S3."""
-    objects = s3_client.list_objects_v2(Bucket=BUCKET_NAME, Prefix=s3_prefix)
-    
-    if 'Contents' in objects:
-        for obj in objects['Contents']:
-            s3_key = obj['Key']
-            if s3_key.endswith('.zip'):
-                with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-                    s3_client.download_fileobj(BUCKET_NAME, s3_key, temp_file)
-                    temp_file_path = temp_file.name
-                
-                # Extraer el archivo ZIP
-                with zipfile.ZipFile(temp_file_path, 'r') as zip_ref:
-                    zip_ref.extractall(extract_to)
-                
-                print(f"Archivo {s3_key} descargado y extraído en {extract_to}")
-    else:
-        print(f"No se encontraron objetos en {s3_prefix}")
-
-def read_netcdf(file_path, variable_name):
-    """Leer archivos NetCDF y extraer datos específicos."""
-    data = []
-    
-    try:
-        with Dataset(file_path, 'r') as nc:
-            if variable_name in nc.variables:
-                var_data = nc.variables[variable_name][:]
-                data = var_data.flatten()
-            else:
-                print(f"Advertencia: '{variable_name}' no encontrado en {file_path}")
-    except FileNotFoundError:
-        print(f"Archivo {file_path} no encontrado.")
-    
-    return np.array(data)  # Retornar los datos leídos
-
-def process_files_for_year(year, variables):
-    """Descargar, extraer y procesar archivos NetCDF para un año específico."""
-    for var in variables:
-        s3_prefix = f'crop_productivity_indicators/{year}/{var}_year_{year}.zip'
-        download_and_extract_zip_from_s3(s3_prefix)
+def download_and_extract_zip_from_s3(s3_keys, loader):
+    """Descargar los ZIP en paralelo y abrir sus archivos NetCDF en memoria."""
+    datasets = loader.load(s3_keys)
+    if not datasets:
+        print(f"No se encontraron archivos NetCDF en {s3_keys}")
+    return datasets
+
+def read_netcdf(source, variable_name):
+    """Leer archivos NetCDF (ruta o Dataset abierto) y extraer datos específicos."""
+    if isinstance(source, str):
+        try:
+            with Dataset(source, 'r') as nc:
+                return read_netcdf(nc, variable_name)
+        except FileNotFoundError:
+            print(f"Archivo {source} no encontrado.")
+            return np.array([])
+
+    if variable_name in source.variables:
+        # ravel devuelve una vista y conserva la máscara de valores de relleno
+        return source.variables[variable_name][:].ravel()
+    print(f"Advertencia: '{variable_name}' no encontrado en {source.filepath()}")
+    return np.array([])
+
+def read_netcdf_files(file_paths, variable_name, max_workers=None):
+    """Leer la misma variable de muchos archivos en paralelo, en el orden dado.
+
+    Devuelve un SharedArrays (usar con 'with'): los arrays viven en memoria
+    compartida hasta que se cierra.
+    """
+    return read_netcdf_parallel(file_paths, variable_name, max_workers)
+
+def zip_keys_for_year(year, variables):
+    """Claves S3 de los ZIP de un año específico."""
+    return [f'crop_productivity_indicators/{year}/{var}_year_{year}.zip' for var in variables]
+
+def list_zip_etags(prefix=S3_PREFIX):
+    """ETag y tamaño de cada ZIP bajo un prefijo, en una sola pasada de listado."""
+    etags = {}
+    paginator = get_s3_client().get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=BUCKET_NAME, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            if obj['Key'].endswith('.zip'):
+                etags[obj['Key']] = {'etag': obj['ETag'].strip('"'), 'size': obj['Size']}
+    return etags
+
+def aggregate_key(s3_key):
+    """Clave S3 del agregado parcial de un ZIP."""
+    return AGGREGATE_PREFIX + os.path.basename(s3_key)[:-len('.zip')] + '.npz'
+
+def aggregate_year(cube, variable, year):
+    """Agregado parcial mensual de una variable del cubo en un año."""
+    return aggregate_dataset(cube[[variable]].sel(time=str(year)), variable, CROP_REGIONS)
+
+def save_aggregate(s3_client, aggregate, key):
+    """Guardar un agregado parcial en el bucket."""
+    buffer = io.BytesIO()
+    aggregate.save(buffer)
+    s3_client.put_object(Bucket=BUCKET_NAME, Key=key, Body=buffer.getvalue())
+
+def load_aggregate(s3_client, key):
+    """Leer un agregado parcial guardado con save_aggregate."""
+    body = s3_client.get_object(Bucket=BUCKET_NAME, Key=key)['Body'].read()
+    return PartialAggregate.load(io.BytesIO(body))
 
 def main():
     variables = [
@@ -99,45 +113,86 @@ def main():
         'total_weight_storage_organs'
     ]
     years = ["2019", "2020", "2021", "2022", "2023"]
+    report_on_exit('crop_run_report')
+    # El cliente S3 se crea aquí y no al importar el módulo
+    s3_client = get_s3_client()
+
+    # Procesar solo los ZIP nuevos o modificados desde la última ejecución
+    manifest = Manifest(MANIFEST_LOCATION, s3_client)
+    etags = list_zip_etags()
+    chunks = [
+        {'key': key, 'request_hash': etags[key]['etag']}
+        for year in years for key in zip_keys_for_year(year, variables) if key in etags
+    ]
+    # Un ZIP solo cuenta como procesado si su agregado parcial está guardado
+    s3_keys = [
+        chunk['key'] for chunk in chunks
+        if not manifest.is_done(chunk['key'], chunk['request_hash'], 'processed')
+        or 'aggregate' not in manifest.get(chunk['key'])
+    ]
+    print(f"{len(chunks) - len(s3_keys)} de {len(chunks)} archivos ZIP ya procesados")
 
-    # Procesar en lotes por año
-    for year in years:
-        process_files_for_year(year, variables)
-
-    # Verificar los archivos extraídos
-    extracted_files = os.listdir('/tmp')
-    print("Archivos extraídos en /tmp:")
-    print(extracted_files)
-
-    # Crear un DataFrame para almacenar los datos
-    all_data = pd.DataFrame()
-
-    for var in variables:
-        for year in years:
-            # Buscar archivos NetCDF específicos en el directorio temporal usando los nombres extraídos
-            file_prefix = f"Maize_{var}_C3S-glob-agric_{year}_1_{year}-"
-            matching_files = [f for f in extracted_files if f.startswith(file_prefix) and f.endswith('.nc')]
-
-            if matching_files:
-                for file in matching_files:
-                    full_path = os.path.join('/tmp', file)
-                    var_data = read_netcdf(full_path, var)
-                    if var_data.size > 0:
-                        if var not in all_data:
-                            all_data[var] = var_data
-                        else:
-                            all_data[var] = np.concatenate([all_data[var], var_data])
-                    else:
-                        print(f"No se encontraron datos para '{var}' en {full_path}")
-            else:
-                print(f"Archivo para '{var}' en el año {year} no encontrado en /tmp")
-
-    # Verificar si los datos se han cargado correctamente
-    if all_data.empty:
-        print("No se han cargado datos en el DataFrame.")
+    aggregates = {}
+    if not s3_keys:
+        print("No hay datos nuevos que procesar.")
     else:
-        print(all_data.head())
-        print(all_data.describe())
+        with ZipDatasetLoader(s3_client, BUCKET_NAME) as loader:
+            # Descargar todos los años pendientes a la vez
+            datasets = download_and_extract_zip_from_s3(s3_keys, loader)
+            print(f"Archivos NetCDF cargados: {len(datasets)}")
+
+            # Agrupar los archivos por variable, en el orden de los años
+            datasets_by_variable, sources_by_variable = {}, {}
+            for var in variables:
+                datasets_by_variable[var], sources_by_variable[var] = [], []
+                for year in years:
+                    s3_key = f'crop_productivity_indicators/{year}/{var}_year_{year}.zip'
+                    matching = [member for member in datasets if member[0] == s3_key]
+                    if s3_key in s3_keys and not matching:
+                        print(f"Archivo para '{var}' en el año {year} no encontrado en {s3_key}")
+                    datasets_by_variable[var].extend(datasets[member] for member in matching)
+                    sources_by_variable[var].extend(loader.buffers[member] for member in matching)
+
+            # Construir el cubo (variable, time, lat, lon) antes de cerrar los archivos;
+            # los datos se decodifican en paralelo a partir de los bytes de cada miembro
+            with stage('build_cube'):
+                cube = build_cube(datasets_by_variable, sources_by_variable)
+
+        # Verificar si los datos se han cargado correctamente
+        if not cube.data_vars:
+            print("No se han cargado datos en el cubo.")
+        else:
+            print(cube)
+
+        # Guardar el agregado de cada ZIP antes de marcarlo como procesado
+        loaded_keys = {key for key, _ in datasets}
+        with stage('save_aggregates'):
+            for var in cube.data_vars:
+                for year in years:
+                    s3_key = f'crop_productivity_indicators/{year}/{var}_year_{year}.zip'
+                    if s3_key not in s3_keys or s3_key not in loaded_keys:
+                        continue
+                    aggregates[s3_key] = aggregate_year(cube, var, year)
+                    save_aggregate(s3_client, aggregates[s3_key], aggregate_key(s3_key))
+                    manifest.record(s3_key, 'processed', etags[s3_key]['etag'], size=etags[s3_key]['size'],
+                                    variable=var, aggregate=aggregate_key(s3_key))
+        manifest.save()
+
+    # Combinar los agregados guardados en ejecuciones anteriores con los nuevos
+    by_variable = {}
+    for chunk in chunks:
+        entry = manifest.get(chunk['key'])
+        if chunk['key'] not in aggregates:
+            if not manifest.is_done(chunk['key'], chunk['request_hash'], 'processed') or 'aggregate' not in entry:
+                continue
+            aggregates[chunk['key']] = load_aggregate(s3_client, entry['aggregate'])
+        by_variable.setdefault(entry['variable'], []).append(aggregates[chunk['key']])
+
+    summaries = {var: merge_all(parts).to_frame() for var, parts in by_variable.items()}
+    for var, summary in summaries.items():
+        print(f"Resumen mensual de '{var}':")
+        print(summary)
+    return summaries
 
 if __name__ == "__main__":
     main()
@@ -1,46 +1,41 @@
+import argparse
+import itertools
 import os
-import boto3
-import tempfile
-import zipfile
 import xarray as xr
 import numpy as np
 import pandas as pd
 from dotenv import load_dotenv
 
+from output_sink import make_sink
+from s3_stream import get_s3_client
+from tracing import report_on_exit, stage
+from zip_loader import ZipDatasetLoader, open_xarray
+
 # Cargar variables de entorno
 if not os.getenv("GITHUB_ACTIONS"):
     load_dotenv()
 
-AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
-AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
-AWS_REGION = "us-east-1"
 BUCKET_NAME = "maize-climate-data-store"
+SENSOR = "c3s_glob_agric"
+
+# Tamaño de los bloques de dask en el modo perezoso y de los lotes de filas emitidos
+LAZY_CHUNKS = {'time': 1, 'lat': 720, 'lon': 720}
+BATCH_ROWS = 500_000
+
+def download_and_extract_zip_from_s3(s3_keys, loader):
+    """Descargar los ZIP en paralelo y abrir sus archivos NetCDF en memoria."""
+    return loader.load(s3_keys)
 
-# Crear cliente S3
-s3_client = boto3.client(
-    's3',
-    aws_access_key_id=AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-    region_name=AWS_REGION
-)
-
-def download_and_extract_zip_from_s3(s3_key, extract_to='/tmp'):
-    """Descargar y extraer un archivo ZIP desde S3."""
-    with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-        s3_client.download_fileobj(BUCKET_NAME, s3_key, temp_file)
-        temp_file_path = temp_file.name
-
-    # Extraer el archivo ZIP
-    with zipfile.ZipFile(temp_file_path, 'r') as zip_ref:
-        zip_ref.extractall(extract_to)
-    
-    print(f"Archivo {s3_key} descargado y extraído en {extract_to}")
-    return os.listdir(extract_to)
-
-def process_netcdf(file_path):
-    """Leer el archivo NetCDF, añadir una columna y eliminar filas con valores NaN."""
+def process_netcdf(file_path, nc=None):
+    """Leer el archivo NetCDF, añadir una columna y eliminar filas con valores NaN.
+
+    Si se pasa nc (un Dataset de netCDF4 ya abierto), file_path solo se usa como nombre.
+    """
     try:
-        ds = xr.open_dataset(file_path, engine='netcdf4')
+        if nc is not None:
+            ds = open_xarray(nc)
+        else:
+            ds = xr.open_dataset(file_path, engine='netcdf4')
         print(f"Datos del archivo {file_path}:")
         print(ds)
 
@@ -65,7 +60,69 @@ def process_netcdf(file_path):
         print(f"Error al procesar el archivo {file_path}: {e}")
         return None
 
-def main():
+def open_lazy(file_path, nc=None, chunks=LAZY_CHUNKS):
+    """Abrir el NetCDF como arrays de dask, sin cargar datos en memoria."""
+    ds = open_xarray(nc) if nc is not None else xr.open_dataset(file_path, engine='netcdf4', chunks={})
+    return ds.chunk({dim: size for dim, size in chunks.items() if dim in ds.dims})
+
+def iter_blocks(array):
+    """Recorrer los bloques de dask de un DataArray como diccionarios de slices."""
+    bounds = [np.cumsum((0,) + tuple(sizes)) for sizes in array.chunks]
+    for index in itertools.product(*[range(len(b) - 1) for b in bounds]):
+        yield {
+            dim: slice(int(b[i]), int(b[i + 1]))
+            for dim, b, i in zip(array.dims, bounds, index)
+        }
+
+def iter_valid_rows(ds, variables, batch_rows=BATCH_ROWS):
+    """Emitir en lotes solo las celdas sin NaN, cargando un bloque cada vez."""
+    reference = ds[variables[0]]
+    for block in iter_blocks(reference):
+        values = {var: ds[var].isel(block).values for var in variables}
+        mask = np.logical_and.reduce([pd.notnull(values[var]) for var in variables])
+        index = np.nonzero(mask)
+        if index[0].size == 0:
+            continue
+
+        columns = {}
+        for axis, dim in enumerate(reference.dims):
+            if dim in ds.coords:
+                coord = ds[dim].values[block[dim]]
+            else:
+                coord = np.arange(block[dim].start, block[dim].stop)
+            columns[dim] = coord[index[axis]]
+        for var in variables:
+            columns[var] = values[var][index]
+
+        df = pd.DataFrame(columns)
+        for start in range(0, len(df), batch_rows):
+            yield df.iloc[start:start + batch_rows]
+
+def process_netcdf_lazy(file_path, nc=None, variable='TWSO', chunks=LAZY_CHUNKS, batch_rows=BATCH_ROWS):
+    """Versión perezosa de process_netcdf con memoria acotada.
+
+    La media se calcula fuera de memoria con dask y las filas válidas se
+    devuelven en lotes de DataFrames, con las mismas columnas que el modo normal.
+    """
+    try:
+        ds = open_lazy(file_path, nc, chunks)
+        dims = ds[variable].dims
+        variables = [variable] + [
+            name for name in ds.data_vars if name != variable and ds[name].dims == dims
+        ]
+        mean = float(ds[variable].mean().compute())
+        print(f"Media de {variable} en {file_path}: {mean}")
+    except FileNotFoundError:
+        print(f"Archivo {file_path} no encontrado.")
+        return
+    except Exception as e:
+        print(f"Error al procesar el archivo {file_path}: {e}")
+        return
+
+    for batch in iter_valid_rows(ds, variables, batch_rows):
+        yield batch.assign(new_column=mean)
+
+def main(argv=None):
     # Ajustar los nombres de archivo ZIP y sus claves en S3
     zip_files = {
         "Crop Development stage": "crop_productivity_indicators/2019/crop_development_stage_year_2019.zip",
@@ -73,21 +130,55 @@ def main():
         "Total weight storage organs": "crop_productivity_indicators/2019/total_weight_storage_organs_year_2019.zip"
     }
 
-    # Procesar cada archivo ZIP
-    for key, s3_key in zip_files.items():
-        print(f"Procesando {key}...")
-        extracted_files = download_and_extract_zip_from_s3(s3_key)
-        
-        for file_name in extracted_files:
-            if file_name.endswith('.nc'):
-                full_path = os.path.join('/tmp', file_name)
-                df = process_netcdf(full_path)
-                
+    parser = argparse.ArgumentParser(description="Procesar los NetCDF de cultivos guardados en S3.")
+    parser.add_argument('--lazy', action='store_true',
+                        help="Procesar con dask por bloques y memoria acotada.")
+    parser.add_argument('--batch-rows', type=int, default=BATCH_ROWS,
+                        help="Filas por lote en el modo perezoso.")
+    parser.add_argument('--sink', choices=['parquet', 'zarr', 'csv'], default='parquet',
+                        help="Formato de salida (por defecto Parquet particionado).")
+    parser.add_argument('--output', default=None,
+                        help="Ruta de salida (por defecto /tmp/crop_indicators.<formato>, o /tmp para csv).")
+    parser.add_argument('--append', action='store_true',
+                        help="Añadir a las particiones existentes en lugar de reemplazarlas "
+                             "(una nueva ejecución duplicaría las filas).")
+    args = parser.parse_args(argv)
+
+    report_on_exit('s3_connection_ml_run_report')
+    output = args.output or ('/tmp' if args.sink == 'csv' else f'/tmp/crop_indicators.{args.sink}')
+
+    # Descargar todos los ZIP a la vez y procesar solo los NetCDF que contienen
+    with ZipDatasetLoader(get_s3_client(), BUCKET_NAME) as loader, \
+            make_sink(args.sink, output, append=args.append) as sink:
+        datasets = download_and_extract_zip_from_s3(list(zip_files.values()), loader)
+
+        for key, s3_key in zip_files.items():
+            print(f"Procesando {key}...")
+
+            for (zip_key, file_name), nc in datasets.items():
+                if zip_key != s3_key:
+                    continue
+                variable, year = s3_key.split('/')[-1][:-len('.zip')].rsplit('_year_', 1)
+                partition = {'year': year, 'variable': variable, 'sensor': SENSOR, 'source': file_name}
+
+                if args.lazy:
+                    rows = 0
+                    with stage('netcdf_process_lazy', chunk=file_name) as record:
+                        for batch in process_netcdf_lazy(file_name, nc, batch_rows=args.batch_rows):
+                            sink.write(batch, partition)
+                            rows += len(batch)
+                            record['bytes'] += int(batch.memory_usage(index=False).sum())
+                    print(f"{rows} filas procesadas de {file_name} guardadas en {output}")
+                    continue
+
+                with stage('netcdf_process', chunk=file_name):
+                    df = process_netcdf(file_name, nc)
+
                 if df is not None:
-                    # Guardar DataFrame procesado si es necesario
-                    output_csv_path = full_path.replace('.nc', '_processed.csv')
-                    df.to_csv(output_csv_path, index=False)
-                    print(f"Datos procesados guardados en {output_csv_path}")
+                    # Guardar DataFrame procesado
+                    with stage('sink_write', chunk=file_name, nbytes=int(df.memory_usage(index=False).sum())):
+                        sink.write(df, partition)
+                    print(f"Datos procesados de {file_name} guardados en {output}")
                 else:
                     print(f"No se pudieron procesar los datos del archivo {file_name}")
 
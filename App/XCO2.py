@@ -1,8 +1,11 @@
-import boto3
 import os
-import tempfile
 from dotenv import load_dotenv
-import cdsapi
+
+from cache import DownloadCache
+from manifest import Manifest
+from tracing import report_on_exit, stage
+from s3_stream import get_s3_client, stream_result_to_s3, upload_file_to_s3
+from sensors import DATASET, XCO2_VARIABLES, XCO2_YEARS, build_xco2_request, request_hash
 
 #Load environment variables (only needed if running locally with a .env file)
 if not os.getenv("GITHUB_ACTIONS"):
@@ -13,75 +16,98 @@ AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
 AWS_REGION = "us-east-1"
 BUCKET_NAME = "geltonas.tech"
 
-# Ensure AWS credentials and region are correctly set
-if not AWS_ACCESS_KEY_ID or not AWS_SECRET_ACCESS_KEY or not AWS_REGION:
-    raise ValueError("AWS credentials or region are not set properly.")
+# "stream" sends CDS responses straight to S3; "cache" keeps a local copy first
+TRANSFER_MODE = os.getenv("XCO2_TRANSFER", "stream")
 
-client = cdsapi.Client()
+# Record of the variable/year chunks already uploaded to the bucket
+MANIFEST_LOCATION = os.getenv("XCO2_MANIFEST", f"s3://{BUCKET_NAME}/manifests/xco2.json")
 
 # Define years to process
-years = [
-    '2002', '2003', '2004', '2005', '2006', '2007', '2008', '2009', 
-    '2010', '2011', '2012', '2013', '2014', '2015', '2016', '2017', 
-    '2018', '2019', '2020', '2021', '2022'
-]
-
-# Define the variables to retrieve
-variables = {
-    'mid_tropospheric_columns_of_atmospheric_carbon_dioxide': 'MidTropospheric_CO2',
-    'column_average_dry_air_mole_fraction_of_atmospheric_carbon_dioxide': 'XCO2'
-}
-
-sensor_and_algorithm_list = ['airs_nlis', 'iasi_metop_a_nlis', 
-                'iasi_metop_b_nlis', 'iasi_metop_c_nlis', 
-                'sciamachy_wfmd', 'sciamachy_besd', 
-                'tanso_fts_ocfp', 'tanso_fts_srmp', 
-                'tanso2_fts_srmp','merged_emma', 
-                'merged_obs4mips'
-            ]
-# Process each variable and year in batches
-for var, var_name in variables.items():
-        request = {
-            'processing_level': ['level_2', 'level_3'],
-            'variable': [var],
-            'sensor_and_algorithm': sensor_and_algorithm_list,
-            'year': [years],
-            'version': ['latest'],
-            'data_format': 'zip'
-        }
-
-        # Temporary File method
-        try:
-            with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-                temp_file_path = temp_file.name
+years = [str(year) for year in range(XCO2_YEARS[0], XCO2_YEARS[1] + 1)]
+
+def object_matches(s3_client, s3_key, remote):
+    """True when the recorded upload is still in the bucket with the same size."""
+    if remote['location'] != f"s3://{BUCKET_NAME}/{s3_key}":
+        return False
+    try:
+        head = s3_client.head_object(Bucket=BUCKET_NAME, Key=s3_key)
+    except Exception:
+        return False
+    return head['ContentLength'] == remote['size']
+
+def main():
+    # Ensure AWS credentials and region are correctly set
+    if not AWS_ACCESS_KEY_ID or not AWS_SECRET_ACCESS_KEY or not AWS_REGION:
+        raise ValueError("AWS credentials or region are not set properly.")
+
+    import cdsapi
+
+    report_on_exit('xco2_run_report')
+    client = cdsapi.Client()
+    cache = DownloadCache()
+    s3_client = get_s3_client()
+    manifest = Manifest(MANIFEST_LOCATION, s3_client)
+
+    # Process each variable and year in batches
+    for var, var_name in XCO2_VARIABLES.items():
+        for year in years:
+            request = build_xco2_request(var, year)
+            s3_key = f"{year}/{var_name}.zip"
+            chunk_key = f"xco2/{var_name}/{year}"
+            chunk_hash = request_hash(DATASET, request)
+
+            # Only new or changed variable/year chunks are requested again;
+            # the last year is still growing, so it is always refreshed
+            if year != years[-1] and manifest.is_done(chunk_key, chunk_hash):
+                print(f"{var_name} for {year} already in the manifest, skipping.")
+                continue
+
+            try:
                 print(f"Retrieving data for {var_name} in {year}...")
 
-                # Retrieve data and save it to the temporary file
-                response = client.retrieve("satellite-carbon-dioxide", request)
-                response.download(temp_file_path)
-                
-                # Check if file is empty
-                if os.path.getsize(temp_file_path) > 0:
-                    # Upload the temporary file to S3
-                    s3_client = boto3.client(
-                        's3',
-                        aws_access_key_id=AWS_ACCESS_KEY_ID,
-                        aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-                        region_name=AWS_REGION
-                    )
-
-                    s3_key = f"{year}/{var_name}.zip"
-                    s3_client.upload_file(temp_file_path, BUCKET_NAME, s3_key)
-                    print(f"File uploaded to S3 bucket {BUCKET_NAME} with key {s3_key}")
+                # Requests already streamed to the bucket or kept on disk are not
+                # downloaded again (mutable ones only until their cache entry expires)
+                if TRANSFER_MODE == 'cache':
+                    remote = None
+                    file_path, _ = cache.fetch(lambda: client, DATASET, request)
+                else:
+                    file_path, remote = cache.lookup(DATASET, request)
+                    if remote is not None and not object_matches(s3_client, s3_key, remote):
+                        print(f"{remote['location']} is no longer in the bucket, downloading again.")
+                        remote = None
+
+                if remote is not None:
+                    print(f"{var_name} for {year} already uploaded to {remote['location']}, skipping download.")
+                    stats = {'bytes': remote['size'], 'sha256': remote.get('sha256')}
+                elif file_path is not None:
+                    stats = {'bytes': os.path.getsize(file_path)}
+                    if stats['bytes'] > 0:
+                        stats = upload_file_to_s3(file_path, BUCKET_NAME, s3_key, s3_client)
                 else:
+                    # Stream the CDS response straight into the bucket
+                    with stage('cds_queue', chunk=chunk_key):
+                        response = client.retrieve(DATASET, request)
+                    stats = stream_result_to_s3(response, BUCKET_NAME, s3_key, s3_client)
+                    if stats['bytes'] == 0:
+                        s3_client.delete_object(Bucket=BUCKET_NAME, Key=s3_key)
+                    else:
+                        cache.record_remote(DATASET, request, f"s3://{BUCKET_NAME}/{s3_key}",
+                                            stats['bytes'], stats['sha256'])
+
+                if stats['bytes'] == 0:
                     print(f"No data retrieved for {var_name} in {year}. No folder created.")
+                manifest.record(chunk_key, 'fetched', chunk_hash, variable=var_name, year=year,
+                                s3_key=s3_key, size=stats['bytes'], sha256=stats.get('sha256'))
 
-        except Exception as e:
-            print(f"Error processing {var_name} for {year}: {e}")
+            except Exception as e:
+                print(f"Error processing {var_name} for {year}: {e}")
+                manifest.record(chunk_key, 'failed', chunk_hash, variable=var_name, year=year, error=str(e))
 
-        finally:
-            # Clean up the temporary file
-            try:
-                os.remove(temp_file_path)
-            except:
-                pass
+            # Save after every chunk so an interrupted run keeps its progress
+            manifest.save()
+
+    cache.report()
+    print(f"Manifest: {manifest.summary()}")
+
+if __name__ == "__main__":
+    main()
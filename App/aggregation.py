@@ -0,0 +1,318 @@
+"""Vectorized regional time-series aggregation for XCO2 soundings and gridded data.
+
+Values are binned into spatial regions (bounding boxes or precomputed cell
+masks, e.g. rasterized admin polygons) and time buckets (day/month/year).
+For each (region, bucket) group one pass over a file computes count, mean,
+the sum of squared deviations (for std) and a fixed-bin histogram (for
+quantiles). These partial aggregates merge exactly across files and
+workers with Chan's parallel formulas, so files can be aggregated
+independently and combined at the end.
+
+Histogram edges are per variable: EDGES holds the known ones, otherwise
+they are derived from a min/max pass over the data. Values outside the
+edges still count in count/mean/std but are tracked as underflow/overflow
+instead of being clipped into the end bins, and quantiles that fall there
+are NaN.
+"""
+import warnings
+
+import numpy as np
+import pandas as pd
+
+# (lat_min, lat_max, lon_min, lon_max)
+REGIONS = {
+    'costa_rica': (8.0, 11.3, -86.0, -82.5),
+}
+TIME_BUCKETS = {
+    'day': 'datetime64[D]',
+    'month': 'datetime64[M]',
+    'year': 'datetime64[Y]',
+}
+# Histogram edges used for quantiles; 0.1 ppm bins for XCO2
+XCO2_EDGES = np.linspace(350.0, 450.0, 1001)
+# Crop indicators: development stage (0-2) and biomass in kg/ha
+EDGES = {
+    'xco2': XCO2_EDGES,
+    'crop_development_stage': np.linspace(0.0, 2.5, 251),
+    'total_above_ground_production': np.linspace(0.0, 40000.0, 2001),
+    'total_weight_storage_organs': np.linspace(0.0, 25000.0, 1001),
+}
+DEFAULT_BINS = 1000
+MAX_REGIONS = 1024
+
+def range_edges(low, high, n_bins=DEFAULT_BINS):
+    """Histogram edges spanning [low, high] (a unit-wide range if they are equal)."""
+    if not (np.isfinite(low) and np.isfinite(high)):
+        raise ValueError("No finite values to derive histogram edges from")
+    if high <= low:
+        low, high = low - 0.5, high + 0.5
+    # Widen by half a bin so the maximum falls inside the last bin
+    return np.linspace(low, high + (high - low) / (2 * n_bins), n_bins + 1)
+
+def variable_edges(variable, values=None):
+    """Histogram edges of a variable: EDGES if known, else derived from the values' range."""
+    if variable in EDGES:
+        return EDGES[variable]
+    if values is None:
+        raise ValueError(f"No histogram edges for '{variable}'; pass edges or the values to derive them from")
+    values = np.asarray(values, dtype=float)
+    return range_edges(np.nanmin(values), np.nanmax(values))
+
+def bbox_region_ids(lat, lon, regions=REGIONS):
+    """Region index of every point (-1 outside all boxes; the first matching box wins)."""
+    lat, lon = np.asarray(lat), np.asarray(lon)
+    ids = np.full(lat.shape, -1, dtype=np.int32)
+    for index, (lat_min, lat_max, lon_min, lon_max) in enumerate(regions.values()):
+        inside = (ids < 0) & (lat >= lat_min) & (lat <= lat_max) & (lon >= lon_min) & (lon <= lon_max)
+        ids[inside] = index
+    return ids
+
+def point_in_polygon(lat, lon, polygon):
+    """Vectorized ray casting; polygon is a sequence of (lat, lon) vertices."""
+    lat, lon = np.asarray(lat), np.asarray(lon)
+    vertices = np.asarray(polygon, dtype=float)
+    inside = np.zeros(lat.shape, dtype=bool)
+    lat_j, lon_j = vertices[-1]
+    for lat_i, lon_i in vertices:
+        crosses = (lat_i > lat) != (lat_j > lat)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            lon_cross = (lon_j - lon_i) * (lat - lat_i) / (lat_j - lat_i) + lon_i
+        inside ^= crosses & (lon < lon_cross)
+        lat_j, lon_j = lat_i, lon_i
+    return inside
+
+def grid_region_mask(lats, lons, regions=REGIONS, polygons=None):
+    """Precompute the (lat, lon) region index mask of a regular grid.
+
+    regions are bounding boxes; polygons, if given, is {name: vertices} and
+    restricts each named region to the cells whose centre is inside it.
+    """
+    lat_grid, lon_grid = np.meshgrid(np.asarray(lats), np.asarray(lons), indexing='ij')
+    mask = bbox_region_ids(lat_grid, lon_grid, regions)
+    for index, name in enumerate(regions):
+        if polygons and name in polygons:
+            cells = mask == index
+            cells[cells] = point_in_polygon(lat_grid[cells], lon_grid[cells], polygons[name])
+            mask[(mask == index) & ~cells] = -1
+    return mask
+
+class PartialAggregate:
+    """Mergeable count/mean/std/histogram statistics per (region, time bucket)."""
+
+    def __init__(self, region_names, bucket='month', edges=None):
+        if edges is None:
+            raise ValueError("Histogram edges are required (see EDGES and variable_edges)")
+        if bucket not in TIME_BUCKETS:
+            raise ValueError(f"Unknown time bucket '{bucket}', expected one of {sorted(TIME_BUCKETS)}")
+        if len(region_names) > MAX_REGIONS:
+            raise ValueError(f"At most {MAX_REGIONS} regions are supported")
+        self.region_names = list(region_names)
+        self.bucket = bucket
+        self.edges = np.asarray(edges, dtype=float)
+        self.keys = np.empty(0, dtype=np.int64)
+        self.count = np.empty(0, dtype=np.int64)
+        self.mean = np.empty(0)
+        self.m2 = np.empty(0)
+        self.hist = np.empty((0, len(self.edges) - 1), dtype=np.int64)
+        self.underflow = np.empty(0, dtype=np.int64)
+        self.overflow = np.empty(0, dtype=np.int64)
+
+    def add(self, values, region_ids, times):
+        """Add one batch of values with their region index and timestamps."""
+        values = np.asarray(values, dtype=float).ravel()
+        region_ids = np.asarray(region_ids).ravel()
+        buckets = np.asarray(times).astype(TIME_BUCKETS[self.bucket]).astype(np.int64).ravel()
+        valid = np.isfinite(values) & (region_ids >= 0)
+        if not valid.any():
+            return self
+        values, region_ids, buckets = values[valid], region_ids[valid], buckets[valid]
+
+        keys, inverse = np.unique(buckets * MAX_REGIONS + region_ids, return_inverse=True)
+        count = np.bincount(inverse)
+        mean = np.bincount(inverse, weights=values) / count
+        m2 = np.bincount(inverse, weights=(values - mean[inverse]) ** 2)
+
+        n_bins = len(self.edges) - 1
+        below, above = values < self.edges[0], values > self.edges[-1]
+        inside = ~(below | above)
+        # The last edge is inclusive
+        bins = np.minimum(np.searchsorted(self.edges, values[inside], side='right') - 1, n_bins - 1)
+        hist = np.bincount(inverse[inside] * n_bins + bins,
+                           minlength=len(keys) * n_bins).reshape(len(keys), n_bins)
+        underflow = np.bincount(inverse[below], minlength=len(keys))
+        overflow = np.bincount(inverse[above], minlength=len(keys))
+        if not inside.all():
+            warnings.warn(f"{below.sum()} values below and {above.sum()} above the histogram edges "
+                          f"[{self.edges[0]:g}, {self.edges[-1]:g}]; quantiles falling there are NaN",
+                          stacklevel=2)
+
+        other = PartialAggregate(self.region_names, self.bucket, self.edges)
+        other.keys, other.count, other.mean, other.m2, other.hist = keys, count, mean, m2, hist
+        other.underflow, other.overflow = underflow, overflow
+        return self.merge(other)
+
+    def add_grid(self, data, times, region_mask):
+        """Add a (time, lat, lon) array using a precomputed (lat, lon) region mask."""
+        cells = np.nonzero(region_mask >= 0)
+        values = np.asarray(data)[:, cells[0], cells[1]]
+        region_ids = np.broadcast_to(region_mask[cells], values.shape)
+        times = np.broadcast_to(np.asarray(times)[:, None], values.shape)
+        return self.add(values, region_ids, times)
+
+    def add_points(self, values, lat, lon, times, regions=REGIONS):
+        """Add soundings located by latitude/longitude against bounding-box regions."""
+        return self.add(values, bbox_region_ids(lat, lon, regions), times)
+
+    def merge(self, other):
+        """Merge another partial aggregate into this one (in place) and return self."""
+        if other.bucket != self.bucket or not np.array_equal(other.edges, self.edges):
+            raise ValueError("Cannot merge aggregates with different buckets or histogram edges")
+        keys = np.union1d(self.keys, other.keys)
+        count_a, mean_a, m2_a, hist_a, under_a, over_a = self._expand(keys, self)
+        count_b, mean_b, m2_b, hist_b, under_b, over_b = self._expand(keys, other)
+
+        count = count_a + count_b
+        delta = mean_b - mean_a
+        self.mean = mean_a + delta * count_b / count
+        self.m2 = m2_a + m2_b + delta ** 2 * count_a * count_b / count
+        self.keys, self.count, self.hist = keys, count, hist_a + hist_b
+        self.underflow, self.overflow = under_a + under_b, over_a + over_b
+        return self
+
+    @staticmethod
+    def _expand(keys, aggregate):
+        """Statistics of an aggregate aligned on a superset of its keys (zeros elsewhere)."""
+        index = np.searchsorted(keys, aggregate.keys)
+        count = np.zeros(len(keys), dtype=np.int64)
+        mean, m2 = np.zeros(len(keys)), np.zeros(len(keys))
+        hist = np.zeros((len(keys), aggregate.hist.shape[1]), dtype=np.int64)
+        underflow, overflow = np.zeros(len(keys), dtype=np.int64), np.zeros(len(keys), dtype=np.int64)
+        count[index], mean[index], m2[index], hist[index] = (
+            aggregate.count, aggregate.mean, aggregate.m2, aggregate.hist
+        )
+        underflow[index], overflow[index] = aggregate.underflow, aggregate.overflow
+        return count, mean, m2, hist, underflow, overflow
+
+    def quantiles(self, qs):
+        """Approximate quantiles per group, interpolated within histogram bins.
+
+        Quantiles that fall among the underflow or overflow values are NaN.
+        """
+        cumulative = self.underflow[:, None] + np.cumsum(self.hist, axis=1)
+        result = np.full((len(self.keys), len(qs)), np.nan)
+        for column, q in enumerate(qs):
+            target = q * self.count
+            bins = np.minimum((cumulative < target[:, None]).sum(axis=1), self.hist.shape[1] - 1)
+            rows = np.arange(len(self.keys))
+            before = np.where(bins > 0, cumulative[rows, np.maximum(bins - 1, 0)], self.underflow)
+            in_bin = self.hist[rows, bins]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                fraction = np.where(in_bin > 0, (target - before) / in_bin, 0.0)
+            lower = self.edges[bins]
+            value = lower + np.clip(fraction, 0, 1) * (self.edges[bins + 1] - lower)
+            outside = ((self.underflow > 0) & (target <= self.underflow)) | (target > self.count - self.overflow)
+            result[:, column] = np.where(outside, np.nan, value)
+        return result
+
+    def to_frame(self, qs=(0.05, 0.25, 0.5, 0.75, 0.95)):
+        """Final statistics as a DataFrame with one row per (region, time bucket)."""
+        region_ids = self.keys % MAX_REGIONS
+        buckets = (self.keys - region_ids) // MAX_REGIONS
+        with np.errstate(divide='ignore', invalid='ignore'):
+            std = np.where(self.count > 1, np.sqrt(self.m2 / (self.count - 1)), np.nan)
+        frame = pd.DataFrame({
+            'region': np.asarray(self.region_names, dtype=object)[region_ids],
+            'time': buckets.astype(TIME_BUCKETS[self.bucket]).astype('datetime64[ns]'),
+            'count': self.count,
+            'mean': self.mean,
+            'std': std,
+            'underflow': self.underflow,
+            'overflow': self.overflow,
+        })
+        for column, q in zip(np.asarray(self.quantiles(qs)).T, qs):
+            frame[f"q{int(round(q * 100)):02d}"] = column
+        return frame.sort_values(['region', 'time']).reset_index(drop=True)
+
+    def save(self, path):
+        """Save the partial aggregate to an .npz file."""
+        np.savez(path, keys=self.keys, count=self.count, mean=self.mean, m2=self.m2, hist=self.hist,
+                 underflow=self.underflow, overflow=self.overflow, edges=self.edges, bucket=self.bucket, region_names=np.asarray(self.region_names))
+
+    @classmethod
+    def load(cls, path):
+        """Load a partial aggregate saved with save()."""
+        with np.load(path) as data:
+            aggregate = cls(list(data['region_names']), str(data['bucket']), data['edges'])
+            aggregate.keys, aggregate.count = data['keys'], data['count']
+            aggregate.mean, aggregate.m2, aggregate.hist = data['mean'], data['m2'], data['hist']
+            aggregate.underflow, aggregate.overflow = data['underflow'], data['overflow']
+        return aggregate
+
+def merge_all(aggregates):
+    """Merge a sequence of partial aggregates (e.g. one per file or worker)."""
+    aggregates = list(aggregates)
+    result = PartialAggregate(aggregates[0].region_names, aggregates[0].bucket, aggregates[0].edges)
+    for aggregate in aggregates:
+        result.merge(aggregate)
+    return result
+
+def aggregate_dataset(ds, variable, regions=REGIONS, bucket='month', edges=None, polygons=None):
+    """Aggregate one xarray dataset, gridded (time, lat, lon) or level-2 soundings.
+
+    Without edges the variable's EDGES entry is used. Edges are never derived
+    from one dataset, since partials of different files only merge when they
+    share edges; pass edges spanning all of them (see aggregate_files).
+    """
+    values = ds[variable]
+    if edges is None:
+        if variable not in EDGES:
+            raise ValueError(f"No histogram edges for '{variable}'; pass edges shared by every "
+                             f"dataset that will be merged, e.g. range_edges(low, high)")
+        edges = EDGES[variable]
+    aggregate = PartialAggregate(list(regions), bucket, edges)
+    lat_name = 'lat' if 'lat' in ds.variables else 'latitude'
+    lon_name = 'lon' if 'lon' in ds.variables else 'longitude'
+
+    if values.dims[-2:] == (lat_name, lon_name):
+        mask = grid_region_mask(ds[lat_name].values, ds[lon_name].values, regions, polygons)
+        data = values.values.reshape((-1,) + mask.shape)
+        times = ds['time'].values if 'time' in values.dims else np.zeros(len(data), dtype='datetime64[ns]')
+        return aggregate.add_grid(data, times, mask)
+
+    return aggregate.add_points(values.values, ds[lat_name].values, ds[lon_name].values,
+                                ds['time'].values, regions)
+
+def _aggregate_path(path, variable, regions, bucket, edges, polygons):
+    import xarray as xr
+
+    with xr.open_dataset(path) as ds:
+        return aggregate_dataset(ds, variable, regions, bucket, edges, polygons)
+
+def _value_range(path, variable):
+    import xarray as xr
+
+    with xr.open_dataset(path) as ds:
+        values = ds[variable]
+        return float(values.min()), float(values.max())
+
+def aggregate_files(paths, variable, regions=REGIONS, bucket='month', edges=None,
+                    polygons=None, max_workers=None):
+    """Aggregate NetCDF files in a process pool and merge the partial results.
+
+    Without edges the variable's EDGES entry is used; for other variables a
+    first pass reads the min/max of every file so all partials share edges.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        if edges is None:
+            if variable in EDGES:
+                edges = EDGES[variable]
+            else:
+                lows, highs = zip(*pool.map(_value_range, paths, [variable] * len(paths)))
+                edges = range_edges(np.nanmin(lows), np.nanmax(highs))
+        partials = pool.map(
+            _aggregate_path, paths,
+            *[[arg] * len(paths) for arg in (variable, regions, bucket, edges, polygons)]
+        )
+        return merge_all(partials)
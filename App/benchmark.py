@@ -0,0 +1,281 @@
+"""Offline benchmark of the pipeline stages with synthetic data.
+
+Synthetic crop indicator ZIPs are put in a moto S3 bucket, CDS is replaced
+by fakes.FakeCDSClient serving ZIPs of synthetic XCO2 level-2 files, which
+go through the same upload to the bucket and ZIP loading as real
+deliveries, so no credentials or network are needed. Each stage
+runs --repeat times and the timings are written to a JSON report that can
+be compared with the report of another commit:
+
+    python benchmark.py --output bench_new.json --compare bench_old.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+
+SCALES = {
+    'small': {'resolution': 2.0, 'dekads': 3, 'years': ['2019'], 'sounding_days': 3,
+              'soundings': 20_000, 'cds_chunks': 6, 'cds_latency': 0.2, 'cds_rate': 50e6,
+              'forecast_series': 1_000, 'forecast_months': 120},
+    'medium': {'resolution': 0.5, 'dekads': 12, 'years': ['2019', '2020'], 'sounding_days': 10,
+               'soundings': 100_000, 'cds_chunks': 12, 'cds_latency': 1.0, 'cds_rate': 50e6,
+               'forecast_series': 5_000, 'forecast_months': 120},
+}
+CROP_VARIABLES = ['total_weight_storage_organs', 'total_above_ground_production']
+BUCKET_NAME = "maize-climate-data-store"
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def timed(stages, name, repeat, fn):
+    """Run fn repeat times with its output silenced and record the timings."""
+    runs = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = fn()
+        runs.append(time.perf_counter() - started)
+    stages[name] = {'runs': runs, 'min': min(runs), 'median': statistics.median(runs)}
+    print(f"{name:<36}{stages[name]['median']:>10.3f}s (min {stages[name]['min']:.3f}s)")
+    return result
+
+def bench_cds(stages, config, repeat, workdir):
+    import boto3
+    from moto import mock_aws
+
+    import main
+    import synthetic
+    from chunking import plan_chunks
+    from fakes import FakeCDSClient
+    from sensors import request_hash
+    from sounding_store import consolidate_by_sensor
+    from zip_loader import ZipDatasetLoader
+
+    sensor = 'iasi_metop_b_nlis'
+    chunks = plan_chunks(sensor)[:config['cds_chunks']]
+    jobs = main.jobs_from_chunks(chunks, os.path.join(workdir, 'cds'))
+    # One ZIP of daily sounding files per chunk, served for its request
+    payloads = {
+        chunk['request_hash']: synthetic.sounding_zip(sensor, f"{chunk['year']}-{chunk['month'] or '01'}-01",
+                                                      config['sounding_days'], config['soundings'], workdir)
+        for chunk in chunks
+    }
+
+    def factory():
+        return FakeCDSClient(lambda dataset, request: payloads[request_hash(dataset, request)],
+                             latency=config['cds_latency'], transfer_rate=config['cds_rate'])
+
+    results = timed(stages, 'cds_fetch_scheduler', repeat,
+                    lambda: main.schedule_jobs(jobs, max_downloads=2, client_factory=factory))
+
+    with mock_aws():
+        s3_client = boto3.client('s3', region_name='us-east-1')
+        s3_client.create_bucket(Bucket=BUCKET_NAME)
+        timed(stages, 'cds_upload_results', repeat,
+              lambda: main.upload_results(chunks, results, BUCKET_NAME, s3_client))
+        failed = [stats['name'] for stats in results if 'error' in stats]
+        if failed:
+            raise RuntimeError(f"Fetch or upload failed for {failed}")
+
+        def consolidate():
+            with ZipDatasetLoader(s3_client, BUCKET_NAME) as loader:
+                datasets = loader.load([chunk['s3_key'] for chunk in chunks])
+                return consolidate_by_sensor(list(datasets.values()), os.path.join(workdir, 'store'))
+
+        timed(stages, 'cds_consolidate_from_s3', repeat, consolidate)
+
+def bench_crop(stages, config, repeat, workdir):
+    import boto3
+    from moto import mock_aws
+
+    import synthetic
+
+    with mock_aws():
+        s3_client = boto3.client('s3', region_name='us-east-1')
+        s3_client.create_bucket(Bucket=BUCKET_NAME)
+        keys = []
+        for year in config['years']:
+            for variable in CROP_VARIABLES:
+                key = f'crop_productivity_indicators/{year}/{variable}_year_{year}.zip'
+                body = synthetic.crop_year_zip(variable, year, config['dekads'], config['resolution'], workdir)
+                s3_client.put_object(Bucket=BUCKET_NAME, Key=key, Body=body)
+                keys.append(key)
+
+        import Crop_productivity_indicators_Job1 as crop_job
+        import S3ConnectionML
+        from crop_cube import build_cube
+        from zip_loader import ZipDatasetLoader
+
+        def load():
+            with ZipDatasetLoader(s3_client, BUCKET_NAME) as loader:
+                return len(crop_job.download_and_extract_zip_from_s3(keys, loader))
+
+        timed(stages, 'download_and_extract_zip_from_s3', repeat, load)
+
+        def cube(parallel):
+            with ZipDatasetLoader(s3_client, BUCKET_NAME) as loader:
+                datasets = loader.load(keys)
+                members = {variable: [member for member in datasets if variable in member[0]]
+                           for variable in CROP_VARIABLES}
+                by_variable = {variable: [datasets[member] for member in group]
+                               for variable, group in members.items()}
+                sources = {variable: [loader.buffers[member] for member in group]
+                           for variable, group in members.items()} if parallel else None
+                return build_cube(by_variable, sources).sizes
+
+        timed(stages, 'build_cube', repeat, lambda: cube(False))
+        timed(stages, 'build_cube_pool', repeat, lambda: cube(True))
+
+        # The decoding stages read plain files, extracted once outside the timings
+        extract_dir = os.path.join(workdir, 'crop')
+        os.makedirs(extract_dir, exist_ok=True)
+        for key in keys:
+            body = s3_client.get_object(Bucket=BUCKET_NAME, Key=key)['Body'].read()
+            with zipfile.ZipFile(io.BytesIO(body)) as zip_ref:
+                zip_ref.extractall(extract_dir)
+    paths = sorted(os.path.join(extract_dir, name) for name in os.listdir(extract_dir)
+                   if 'total_weight_storage_organs' in name)
+
+    timed(stages, 'read_netcdf', repeat,
+          lambda: sum(crop_job.read_netcdf(path, 'TWSO').size for path in paths))
+
+    def parallel():
+        with crop_job.read_netcdf_files(paths, 'TWSO') as arrays:
+            return sum(array.size for array in arrays)
+
+    timed(stages, 'read_netcdf_parallel', repeat, parallel)
+    timed(stages, 'process_netcdf', repeat,
+          lambda: sum(len(S3ConnectionML.process_netcdf(path)) for path in paths))
+    timed(stages, 'process_netcdf_lazy', repeat,
+          lambda: sum(len(batch) for path in paths for batch in S3ConnectionML.process_netcdf_lazy(path)))
+
+def bench_aggregation(stages, config, repeat, workdir):
+    import synthetic
+    from aggregation import aggregate_files
+
+    paths = synthetic.sounding_files(os.path.join(workdir, 'xco2'), 'iasi_metop_b_nlis', '2019-01-01',
+                                     config['sounding_days'], config['soundings'])
+    timed(stages, 'aggregation', repeat,
+          lambda: len(aggregate_files(paths, 'xco2', bucket='day').to_frame()))
+
+def bench_forecast(stages, config, repeat, workdir):
+    """Batched harmonic fit against the per-series lstsq loop it replaces."""
+    import numpy as np
+
+    from forecasting import HarmonicFit, fit_series
+
+    rng = np.random.default_rng(0)
+    n_series, n_months = config['forecast_series'], config['forecast_months']
+    times = np.arange('2014-01', np.datetime64('2014-01') + n_months, dtype='datetime64[M]').astype('datetime64[D]')
+    seasonal = 3 * np.sin(2 * np.pi * np.arange(n_months) / 12)
+    Y = 400 + 0.2 * np.arange(n_months) + seasonal + rng.normal(0, 1.0, (n_series, n_months))
+    Y[rng.random(Y.shape) < 0.1] = np.nan
+    ids = np.arange(n_series).astype(str)
+
+    def lstsq_loop():
+        X = HarmonicFit(ids[:1], times[0]).design(times)
+        coef = np.empty((n_series, X.shape[1]))
+        for row, y in enumerate(Y):
+            observed = np.isfinite(y)
+            coef[row] = np.linalg.lstsq(X[observed], y[observed], rcond=None)[0]
+        return coef
+
+    timed(stages, 'forecast_fit_batched', repeat, lambda: fit_series(ids, times, Y).coef)
+    timed(stages, 'forecast_fit_lstsq_loop', repeat, lstsq_loop)
+
+def bench_startup(stages, config, repeat, workdir):
+    """Cold start of the CLI subcommands that must not load the heavy libraries."""
+    cli = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cli.py')
+    manifest = os.path.join(workdir, 'manifest.json')
+    for name, argv in (('startup_plan', ['plan']), ('startup_report', ['report', '--manifest', manifest])):
+        timed(stages, name, repeat,
+              lambda: subprocess.run([sys.executable, cli] + argv, check=True, stdout=subprocess.DEVNULL))
+
+def compare(old, new, threshold):
+    """Print the change of every stage and return the names of the regressions."""
+    regressions = []
+    print(f"{'stage':<36}{'old_s':>10}{'new_s':>10}{'change':>10}")
+    for name, stage in new['stages'].items():
+        if name not in old['stages']:
+            print(f"{name:<36}{'-':>10}{stage['median']:>10.3f}{'new':>10}")
+            continue
+        before = old['stages'][name]['median']
+        change = (stage['median'] - before) / before if before else 0.0
+        flag = '  REGRESSION' if change > threshold else ''
+        print(f"{name:<36}{before:>10.3f}{stage['median']:>10.3f}{change:>+10.0%}{flag}")
+        if change > threshold:
+            regressions.append(name)
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline offline with synthetic data.")
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--stages', nargs='+', choices=['startup', 'cds', 'crop', 'aggregation', 'forecast'],
+                        default=['startup', 'cds', 'crop', 'aggregation', 'forecast'])
+    parser.add_argument('--output', default=None, help="Report path (default: bench_<commit>.json).")
+    parser.add_argument('--compare', default=None, help="Previous report to compare against.")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="Relative slowdown of the median reported as a regression.")
+    args = parser.parse_args(argv)
+
+    # Never pick up real credentials or buckets
+    os.environ.update({'AWS_ACCESS_KEY_ID': 'testing', 'AWS_SECRET_ACCESS_KEY': 'testing',
+                       'GITHUB_ACTIONS': 'true'})
+    config = SCALES[args.scale]
+    commit = git_commit()
+    stages = {}
+    workdir = tempfile.mkdtemp(prefix='bench_')
+    try:
+        if 'startup' in args.stages:
+            bench_startup(stages, config, args.repeat, workdir)
+        if 'cds' in args.stages:
+            bench_cds(stages, config, args.repeat, workdir)
+        if 'crop' in args.stages:
+            bench_crop(stages, config, args.repeat, workdir)
+        if 'aggregation' in args.stages:
+            bench_aggregation(stages, config, args.repeat, workdir)
+        if 'forecast' in args.stages:
+            bench_forecast(stages, config, args.repeat, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'commit': commit,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'scale': args.scale,
+        'config': config,
+        'repeat': args.repeat,
+        'stages': stages,
+    }
+    output = args.output or f"bench_{commit}.json"
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), report, args.threshold)
+        if regressions:
+            raise SystemExit(f"Regressions in {', '.join(regressions)}")
+
+if __name__ == "__main__":
+    main()
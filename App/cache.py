@@ -0,0 +1,292 @@
+"""On-disk cache of CDS downloads keyed by the hash of the normalized request.
+
+Finished files are stored as <root>/<hh>/<hash>.zip next to a <hash>.json
+record with their size and sha256. Interrupted downloads are kept as
+<hash>.part and resumed with an HTTP Range request on the next run when CDS
+hands back the same result location. The cache is bounded in size and
+evicts the least recently used entries first.
+
+Hits are checked against the recorded sha256, and resumed ZIP downloads are
+tested before they are kept. Requests whose data can still change (periods
+that are not over yet, see sensors.request_is_mutable) expire after
+CDS_CACHE_MUTABLE_TTL_H hours, so they are fetched again.
+
+Jobs that stream results straight to S3 keep no local copy; they record the
+object location instead (<hash>.remote.json), and lookup() returns it so a
+rerun does not download the same request from CDS again.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+import zipfile
+
+from sensors import request_hash, request_is_mutable
+from tracing import stage
+
+DEFAULT_CACHE_DIR = os.getenv(
+    "CDS_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "time_series_cr", "cds")
+)
+DEFAULT_MAX_BYTES = int(float(os.getenv("CDS_CACHE_MAX_GB", "20")) * 1e9)
+MUTABLE_TTL_S = float(os.getenv("CDS_CACHE_MUTABLE_TTL_H", "24")) * 3600
+CHUNK_SIZE = 1024 * 1024
+
+def file_sha256(path):
+    """sha256 of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _zip_is_valid(path):
+    """CRC check of every member; non-ZIP results are accepted as they are."""
+    with open(path, 'rb') as f:
+        if f.read(4) != b'PK\x03\x04':
+            return True
+    try:
+        with zipfile.ZipFile(path) as zip_ref:
+            return zip_ref.testzip() is None
+    except zipfile.BadZipFile:
+        return False
+
+class DownloadCache:
+    """Size-bounded LRU cache of CDS results, safe to share between threads."""
+
+    def __init__(self, root=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, mutable_ttl_s=MUTABLE_TTL_S):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.mutable_ttl_s = mutable_ttl_s
+        self.hits = 0
+        self.misses = 0
+        self.resumed = 0
+        self.evicted = 0
+        self.lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _paths(self, key):
+        folder = os.path.join(self.root, key[:2])
+        base = os.path.join(folder, key)
+        return folder, base + '.zip', base + '.json', base + '.part'
+
+    def _read_meta(self, meta_path):
+        try:
+            with open(meta_path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write_meta(self, meta_path, meta):
+        tmp_path = meta_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, meta_path)
+
+    def get(self, dataset, request, verify=True):
+        """Return the cached file of a request, or None when missing, expired or corrupt.
+
+        The size is always checked; with verify (the default) the sha256 too.
+        """
+        key = request_hash(dataset, request)
+        _, data_path, meta_path, _ = self._paths(key)
+        meta = self._read_meta(meta_path)
+        intact = meta is not None and self._is_fresh(request, meta) and self._is_intact(data_path, meta, verify)
+        with self.lock:
+            if not intact:
+                self.misses += 1
+                return None
+            self.hits += 1
+        # The metadata mtime is the last-use time for LRU eviction
+        os.utime(meta_path)
+        return data_path
+
+    def _is_fresh(self, request, meta):
+        """Entries of requests that can still change expire after mutable_ttl_s."""
+        if not request_is_mutable(request):
+            return True
+        return time.time() - meta.get('stored_at', 0) < self.mutable_ttl_s
+
+    def _is_intact(self, data_path, meta, verify):
+        try:
+            if os.path.getsize(data_path) != meta['size']:
+                return False
+        except OSError:
+            return False
+        return not verify or file_sha256(data_path) == meta['sha256']
+
+    def record_remote(self, dataset, request, location, size, sha256=None):
+        """Remember that the result of a request is stored at location (e.g. s3://bucket/key)."""
+        folder, data_path, _, _ = self._paths(request_hash(dataset, request))
+        os.makedirs(folder, exist_ok=True)
+        self._write_meta(data_path[:-len('.zip')] + '.remote.json', {
+            'dataset': dataset,
+            'request': request,
+            'location': location,
+            'size': size,
+            'sha256': sha256,
+            'stored_at': time.time(),
+        })
+
+    def lookup(self, dataset, request):
+        """Return (path, remote) for a request, counting one hit or miss.
+
+        path is the local file (or None); remote is the record written by
+        record_remote (or None). Expired records are ignored like expired files.
+        """
+        _, data_path, _, _ = self._paths(request_hash(dataset, request))
+        remote = self._read_meta(data_path[:-len('.zip')] + '.remote.json')
+        if remote is not None and not self._is_fresh(request, remote):
+            remote = None
+        if remote is not None:
+            with self.lock:
+                self.hits += 1
+            return None, remote
+        return self.get(dataset, request), None
+
+    def fetch(self, client_factory, dataset, request, download_slots=None, lookup=True):
+        """Return the cached file of a request, retrieving it from CDS on a miss.
+
+        client_factory is only called on a miss, so hits never touch CDS.
+        lookup=False skips the cache lookup (and its hit/miss count), for
+        retries of a request that already missed.
+
+        Returns (path, stats) where stats has queue_s, transfer_s, bytes and cached.
+        """
+        path = self.get(dataset, request) if lookup else None
+        if path is not None:
+            return path, {'queue_s': 0.0, 'slot_wait_s': 0.0, 'transfer_s': 0.0,
+                          'bytes': os.path.getsize(path), 'cached': True}
+
+        client = client_factory()
+        key = request_hash(dataset, request)
+        submitted = time.monotonic()
+        with stage('cds_queue', chunk=key[:12]):
+            result = client.retrieve(dataset, request)
+        ready = time.monotonic()
+
+        if download_slots is None:
+            download_slots = threading.BoundedSemaphore(1)
+        with download_slots:
+            started = time.monotonic()
+            with stage('cds_transfer', chunk=key[:12]) as record:
+                path = self.store(dataset, request, result)
+                record['bytes'] = os.path.getsize(path)
+            finished = time.monotonic()
+
+        return path, {'queue_s': ready - submitted, 'slot_wait_s': started - ready,
+                      'transfer_s': finished - started,
+                      'bytes': os.path.getsize(path), 'cached': False}
+
+    def store(self, dataset, request, result):
+        """Download a CDS result into the cache, resuming a previous partial file."""
+        key = request_hash(dataset, request)
+        folder, data_path, meta_path, part_path = self._paths(key)
+        os.makedirs(folder, exist_ok=True)
+
+        resumed = self._download(result, part_path)
+        if resumed and not _zip_is_valid(part_path):
+            # Do not keep a spliced file; the next attempt starts from scratch
+            self._remove(part_path)
+            self._remove(part_path + '.json')
+            raise IOError(f"Resumed download of {key[:12]} is not a valid ZIP file")
+        os.replace(part_path, data_path)
+        self._remove(part_path + '.json')
+        self._write_meta(meta_path, {
+            'dataset': dataset,
+            'request': request,
+            'size': os.path.getsize(data_path),
+            'sha256': file_sha256(data_path),
+            'stored_at': time.time(),
+        })
+        self.evict(keep=key)
+        return data_path
+
+    def _download(self, result, part_path):
+        """Download into part_path; returns True when an earlier partial file was resumed."""
+        location = getattr(result, 'location', None)
+        total = getattr(result, 'content_length', None)
+        if not location or not total:
+            # Results without a plain URL (e.g. test fakes) are downloaded as is
+            result.download(part_path)
+            return False
+
+        # A partial file can only be resumed against the same result file
+        part_meta_path = part_path + '.json'
+        part_meta = self._read_meta(part_meta_path)
+        if part_meta != {'location': location, 'size': total}:
+            self._remove(part_path)
+            self._write_meta(part_meta_path, {'location': location, 'size': total})
+
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        if offset >= total:
+            return True
+        if offset:
+            with self.lock:
+                self.resumed += 1
+            print(f"Resuming {location} at byte {offset} of {total}")
+
+        session = getattr(result, 'session', None)
+        if session is None:
+            import requests
+            session = requests
+        headers = {'Range': f'bytes={offset}-'} if offset else {}
+        with session.get(location, headers=headers, stream=True, timeout=60) as response:
+            response.raise_for_status()
+            # 200 means the server ignored the Range header: start again
+            mode = 'ab' if response.status_code == 206 else 'wb'
+            with open(part_path, mode) as f:
+                for block in response.iter_content(CHUNK_SIZE):
+                    f.write(block)
+
+        if os.path.getsize(part_path) != total:
+            raise IOError(f"Incomplete download of {location}: "
+                          f"{os.path.getsize(part_path)} of {total} bytes")
+        return mode == 'ab'
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def entries(self):
+        """List (last_used, size, key) for every finished entry."""
+        entries = []
+        for folder in os.listdir(self.root):
+            folder_path = os.path.join(self.root, folder)
+            if not os.path.isdir(folder_path):
+                continue
+            for name in os.listdir(folder_path):
+                if not name.endswith('.zip'):
+                    continue
+                key = name[:-4]
+                _, data_path, meta_path, _ = self._paths(key)
+                try:
+                    entries.append((os.path.getmtime(meta_path), os.path.getsize(data_path), key))
+                except OSError:
+                    continue
+        return entries
+
+    def evict(self, keep=None):
+        """Remove the least recently used entries until the cache fits max_bytes."""
+        with self.lock:
+            entries = sorted(self.entries())
+            total = sum(size for _, size, _ in entries)
+            for _, size, key in entries:
+                if total <= self.max_bytes:
+                    break
+                if key == keep:
+                    continue
+                _, data_path, meta_path, _ = self._paths(key)
+                self._remove(data_path)
+                self._remove(meta_path)
+                total -= size
+                self.evicted += 1
+
+    def report(self):
+        """Print the hit/miss counters of the run."""
+        total = self.hits + self.misses
+        rate = 100.0 * self.hits / total if total else 0.0
+        print(f"Download cache: {self.hits} hits, {self.misses} misses ({rate:.0f}% hit rate), "
+              f"{self.resumed} resumed, {self.evicted} evicted")
@@ -0,0 +1,97 @@
+"""Split sensor requests into chunks small enough to download independently.
+
+Each chunk covers one year, one month or a block of days of a sensor and has
+a deterministic key, so chunks can be downloaded in parallel, retried on
+their own and skipped when they are already in the bucket.
+"""
+import calendar
+
+from sensors import (
+    DATASET, DAYS, MONTHS, SENSORS,
+    build_request, estimate_bytes, request_hash, sensor_years,
+)
+
+S3_PREFIX = "satellite_carbon_dioxide"
+DEFAULT_BUDGET_BYTES = 2_000_000_000
+
+def chunk_key(name, year, month=None, days=None):
+    """Deterministic key of a chunk, e.g. airs_nlis/v3.0/2003-01."""
+    key = f"{name}/v{SENSORS[name]['version']}/{year}"
+    if month is not None:
+        key += f"-{month}"
+    if days is not None:
+        key += f"-d{days[0]}-{days[-1]}"
+    return key
+
+def make_chunk(name, year, month=None, days=None):
+    """Build a chunk dict for a sensor year, month or block of days."""
+    request = build_request(
+        name,
+        years=[year],
+        months=[month] if month is not None else None,
+        days=days,
+    )
+    key = chunk_key(name, year, month, days)
+    return {
+        'key': key,
+        'sensor': name,
+        'year': year,
+        'month': month,
+        'dataset': DATASET,
+        'request': request,
+        'request_hash': request_hash(DATASET, request),
+        'est_bytes': estimate_bytes(name, request),
+        's3_key': f"{S3_PREFIX}/{key}.zip",
+    }
+
+def split_days(name, year, month, budget_bytes):
+    """Split a month into blocks of consecutive days that fit in the budget."""
+    month_days = calendar.monthrange(int(year), int(month))[1]
+    per_block = max(1, budget_bytes // SENSORS[name]['bytes_per_day'])
+    days = DAYS[:month_days]
+    return [days[start:start + per_block] for start in range(0, month_days, per_block)]
+
+def plan_chunks(name, budget_bytes=DEFAULT_BUDGET_BYTES, years=None):
+    """Plan the chunks of a sensor: whole years when they fit the budget, else months or days."""
+    chunks = []
+    for year in [str(year) for year in years] if years else sensor_years(name):
+        chunk = make_chunk(name, year)
+        if chunk['est_bytes'] <= budget_bytes:
+            chunks.append(chunk)
+            continue
+
+        for month in MONTHS:
+            chunk = make_chunk(name, year, month)
+            if chunk['est_bytes'] <= budget_bytes:
+                chunks.append(chunk)
+                continue
+
+            for days in split_days(name, year, month, budget_bytes):
+                chunks.append(make_chunk(name, year, month, days))
+    return chunks
+
+def plan_all_chunks(names=None, budget_bytes=DEFAULT_BUDGET_BYTES):
+    """Plan the chunks of several sensors (all registered sensors by default)."""
+    chunks = []
+    for name in names or SENSORS:
+        chunks.extend(plan_chunks(name, budget_bytes))
+    return chunks
+
+def existing_s3_keys(s3_client, bucket_name, prefix=S3_PREFIX):
+    """Return the set of object keys already stored under a prefix."""
+    keys = set()
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            if obj.get('Size', 0) > 0:
+                keys.add(obj['Key'])
+    return keys
+
+def pending_chunks(chunks, s3_client, bucket_name, prefix=S3_PREFIX):
+    """Drop the chunks whose object is already present in the bucket.
+
+    main.py uploads each fetched chunk to its s3_key (--upload-to), which is
+    what this checks.
+    """
+    existing = existing_s3_keys(s3_client, bucket_name, prefix)
+    return [chunk for chunk in chunks if chunk['s3_key'] not in existing]
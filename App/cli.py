@@ -0,0 +1,121 @@
+"""Single entry point for the pipeline jobs.
+
+    python cli.py plan [--chunk-budget-mb N] [--manifest LOC] [--pending-in BUCKET]
+    python cli.py fetch sensors|xco2 [job arguments]
+    python cli.py process crop-cube|crop-table|consolidate|merge|forecast [job arguments]
+    python cli.py report [--manifest LOC ...] [--run-report PATH] [--cache]
+
+Only the standard library and the planning modules are imported up front.
+The job modules, with boto3, cdsapi, netCDF4, xarray and pandas, are imported
+when their subcommand runs, and S3/CDS clients are created on first use
+(S3 through the pooled s3_stream.get_s3_client), so `plan` and `report`
+on a local manifest start without loading any of them.
+"""
+import argparse
+import importlib
+
+from chunking import DEFAULT_BUDGET_BYTES
+
+# Subcommand target -> (module, function, accepts argv)
+TARGETS = {
+    'fetch': {
+        'sensors': ('main', 'main', True),
+        'xco2': ('XCO2', 'main', False),
+    },
+    'process': {
+        'crop-cube': ('Crop_productivity_indicators_Job1', 'main', False),
+        'crop-table': ('S3ConnectionML', 'main', True),
+        'consolidate': ('sounding_store', 'main', True),
+        'merge': ('merge_sensors', 'main', True),
+        'forecast': ('forecasting', 'main', True),
+    },
+}
+
+def run_target(command, target, argv):
+    """Import the job module of a target and run its main."""
+    module_name, function_name, accepts_argv = TARGETS[command][target]
+    if argv and not accepts_argv:
+        raise SystemExit(f"{command} {target} takes no arguments, got {argv}")
+    function = getattr(importlib.import_module(module_name), function_name)
+    return function(argv) if accepts_argv else function()
+
+def plan(args):
+    """Print the planned requests and chunks; no client is created unless asked to check S3."""
+    from chunking import pending_chunks, plan_all_chunks
+    from sensors import SENSORS, plan_requests, print_plan
+
+    sensors = args.sensors or list(SENSORS)
+    print_plan(plan_requests(sensors))
+    chunks = plan_all_chunks(sensors, args.chunk_budget_mb * 1_000_000)
+    print(f"{len(chunks)} chunks of at most {args.chunk_budget_mb} MB")
+    if args.pending_in:
+        from s3_stream import get_s3_client
+
+        chunks = pending_chunks(chunks, get_s3_client(), args.pending_in)
+        print(f"{len(chunks)} chunks not yet in {args.pending_in}")
+    if args.manifest:
+        from manifest import Manifest
+
+        chunks = Manifest(args.manifest).delta(chunks)
+        print(f"{len(chunks)} chunks new or changed according to {args.manifest}")
+    if args.verbose:
+        for chunk in chunks:
+            print(f"  {chunk['key']:<48}{chunk['est_bytes'] / 1e6:>10.0f} MB")
+
+def report(args):
+    """Print manifest status counts, a saved run report and the cache contents."""
+    if args.manifest:
+        from manifest import Manifest
+
+        for location in args.manifest:
+            print(f"{location}: {Manifest(location).summary()}")
+    if args.run_report:
+        import json
+
+        from tracing import format_summary
+
+        with open(args.run_report) as f:
+            run = json.load(f)
+        print(format_summary(run['summary']))
+        print(f"Peak RSS: {run['peak_rss_mb']:.0f} MB")
+    if args.cache:
+        from cache import DEFAULT_CACHE_DIR, DownloadCache
+
+        entries = DownloadCache(args.cache_dir or DEFAULT_CACHE_DIR).entries()
+        print(f"Download cache: {len(entries)} entries, {sum(size for _, size, _ in entries) / 1e9:.2f} GB")
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Satellite CO2 and crop indicator pipeline.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    plan_parser = commands.add_parser('plan', help="List the planned CDS requests and chunks.")
+    plan_parser.add_argument('--sensors', nargs='+', default=None)
+    plan_parser.add_argument('--chunk-budget-mb', type=int, default=DEFAULT_BUDGET_BYTES // 1_000_000)
+    plan_parser.add_argument('--manifest', default=None,
+                             help="Only count chunks new or changed against this manifest.")
+    plan_parser.add_argument('--pending-in', default=None, metavar='BUCKET',
+                             help="Only count chunks not yet stored in this bucket.")
+    plan_parser.add_argument('-v', '--verbose', action='store_true', help="List every chunk.")
+    plan_parser.set_defaults(handler=plan)
+
+    for command, help_text in (('fetch', "Download from CDS."), ('process', "Process downloaded data.")):
+        target_parser = commands.add_parser(command, help=help_text)
+        target_parser.add_argument('target', choices=sorted(TARGETS[command]))
+        target_parser.add_argument('argv', nargs=argparse.REMAINDER,
+                                   help="Arguments passed on to the job (see its --help).")
+        target_parser.set_defaults(handler=lambda args: run_target(args.command, args.target, args.argv))
+
+    report_parser = commands.add_parser('report', help="Show manifests, run reports and the cache.")
+    report_parser.add_argument('--manifest', nargs='+', default=None, help="Local path or s3://bucket/key")
+    report_parser.add_argument('--run-report', default=None, help="JSON written by tracing.write_report")
+    report_parser.add_argument('--cache', action='store_true', help="Summarize the download cache.")
+    report_parser.add_argument('--cache-dir', default=None)
+    report_parser.set_defaults(handler=report)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.handler(args)
+
+if __name__ == "__main__":
+    main()
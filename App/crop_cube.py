@@ -0,0 +1,155 @@
+"""Assemble crop indicator NetCDF files into one (variable, time, lat, lon) cube.
+
+Shapes and coordinates are read from the NetCDF metadata first, one typed
+array per variable is preallocated for the whole time axis, and each file is
+written into its slice in place, instead of growing flattened columns with
+repeated np.concatenate. When the raw sources of the files (paths or NetCDF
+bytes) are given, the data is decoded in a process pool
+(netcdf_pool.read_netcdf_parallel); otherwise it is read file by file from
+the open datasets.
+"""
+import os
+import re
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+from netCDF4 import num2date
+
+from netcdf_pool import read_netcdf_parallel
+
+# Short names used inside the C3S crop productivity files
+VARIABLE_CODES = {
+    'crop_development_stage': 'DVS',
+    'total_above_ground_production': 'TAGP',
+    'total_weight_storage_organs': 'TWSO',
+}
+LAT_NAMES = ('lat', 'latitude')
+LON_NAMES = ('lon', 'longitude')
+# Date in the file name, e.g. ..._2019_1_2019-01-10_dek_... or ..._20190110_...
+FILE_DATE = re.compile(r'(?<!\d)(\d{4})-?(\d{2})-?(\d{2})(?!\d)')
+
+def find_name(nc, candidates):
+    """Return the first of the candidate names present in a dataset."""
+    for name in candidates:
+        if name in nc.variables:
+            return name
+    return None
+
+def date_from_name(name):
+    """Date in a file name as datetime64[ns]; raises ValueError when there is none."""
+    for match in FILE_DATE.finditer(os.path.basename(name)):
+        try:
+            return np.array([np.datetime64('-'.join(match.groups()), 'D')], dtype='datetime64[ns]')
+        except ValueError:
+            continue
+    raise ValueError(f"{name} has no time axis and no date in its name")
+
+def decode_times(nc):
+    """Time values of a file as datetime64[ns], taken from its name when it has no time axis."""
+    if 'time' not in nc.variables:
+        return date_from_name(nc.filepath())
+    time_var = nc.variables['time']
+    dates = num2date(
+        time_var[:], time_var.units, getattr(time_var, 'calendar', 'standard'),
+        only_use_cftime_datetimes=False, only_use_python_datetimes=True,
+    )
+    return np.array(dates, dtype='datetime64[ns]').reshape(-1)
+
+def scan_files(datasets, variable, sources=None):
+    """Read only the metadata of every file: variable name, times and grid."""
+    entries = []
+    for nc, source in zip(datasets, sources or [None] * len(datasets)):
+        name = variable if variable in nc.variables else VARIABLE_CODES.get(variable)
+        if name not in nc.variables:
+            print(f"Advertencia: '{variable}' no encontrado en {nc.filepath()}")
+            continue
+        lat_name, lon_name = find_name(nc, LAT_NAMES), find_name(nc, LON_NAMES)
+        entries.append({
+            'nc': nc,
+            'source': source,
+            'name': name,
+            'times': decode_times(nc),
+            'lat': nc.variables[lat_name][:].data if lat_name else None,
+            'lon': nc.variables[lon_name][:].data if lon_name else None,
+            'shape': nc.variables[name].shape,
+            'dtype': nc.variables[name].dtype,
+        })
+    return entries
+
+def read_entries(entries, dtype, max_workers=None):
+    """Yield (entry, data) for every file, decoding in a process pool when the sources are known.
+
+    With a single CPU the pool only adds overhead, so the files are read in turn.
+    """
+    workers = max_workers or os.cpu_count() or 1
+    if workers > 1 and len(entries) > 1 and all(entry['source'] is not None for entry in entries):
+        with read_netcdf_parallel([entry['source'] for entry in entries],
+                                  [entry['name'] for entry in entries], max_workers) as arrays:
+            for entry, data in zip(entries, arrays):
+                yield entry, np.ma.filled(np.ma.asarray(data, dtype=dtype), np.nan)
+        return
+    for entry in entries:
+        data = entry['nc'].variables[entry['name']][:]
+        yield entry, np.ma.filled(np.ma.asarray(data, dtype=dtype), np.nan)
+
+def build_variable(datasets, variable, sources=None, max_workers=None):
+    """Build the (time, lat, lon) DataArray of one variable from its files.
+
+    sources, if given, holds the path or NetCDF bytes of each dataset so the
+    data can be decoded in parallel.
+    """
+    entries = scan_files(datasets, variable, sources)
+    if not entries:
+        return None
+
+    lat, lon = entries[0]['lat'], entries[0]['lon']
+    grid_shape = entries[0]['shape'][-2:]
+    usable = []
+    for entry in entries:
+        if entry['shape'][-2:] != grid_shape:
+            print(f"Advertencia: malla distinta en {entry['nc'].filepath()}, archivo omitido")
+            continue
+        usable.append(entry)
+
+    times = np.unique(np.concatenate([entry['times'] for entry in usable]))
+    dtype = np.result_type(*[entry['dtype'] for entry in usable], np.float32)
+    cube = np.full((len(times),) + tuple(grid_shape), np.nan, dtype=dtype)
+
+    for entry, data in read_entries(usable, dtype, max_workers):
+        data = data.reshape((len(entry['times']),) + tuple(grid_shape))
+        cube[np.searchsorted(times, entry['times'])] = data
+
+    coords = {'time': times}
+    if lat is not None and len(lat) == grid_shape[0]:
+        coords['lat'] = lat
+    if lon is not None and len(lon) == grid_shape[1]:
+        coords['lon'] = lon
+    return xr.DataArray(cube, dims=('time', 'lat', 'lon'), coords=coords, name=variable)
+
+def build_cube(datasets_by_variable, sources_by_variable=None, max_workers=None):
+    """Build an xarray Dataset with one (time, lat, lon) array per variable.
+
+    cube.to_array('variable') gives the (variable, time, lat, lon) array.
+    """
+    arrays = {}
+    for variable, datasets in datasets_by_variable.items():
+        sources = sources_by_variable.get(variable) if sources_by_variable else None
+        array = build_variable(datasets, variable, sources, max_workers)
+        if array is not None:
+            arrays[variable] = array
+    return xr.Dataset(arrays)
+
+def describe_cube(cube, qs=(0.25, 0.5, 0.75)):
+    """count/mean/std/min/quantiles/max of every variable, like DataFrame.describe().
+
+    Computed with xarray reductions on the cube arrays, without building the
+    dense (time, lat, lon) table.
+    """
+    stats = {}
+    for variable, array in cube.data_vars.items():
+        values = array.quantile(list(qs), skipna=True).values
+        stats[variable] = [int(array.count()), float(array.mean()), float(array.std(ddof=1)),
+                           float(array.min())] + [float(value) for value in values] + [float(array.max())]
+    index = ['count', 'mean', 'std', 'min'] + [f"{q:.0%}" for q in qs] + ['max']
+    return pd.DataFrame(stats, index=index)
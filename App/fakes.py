@@ -0,0 +1,55 @@
+"""Local stand-ins for cdsapi.Client, for offline runs and benchmarks.
+
+FakeCDSClient mimics both cdsapi modes: retrieve() blocks for the queue
+latency and returns a ready result, or with wait_until_complete=False
+returns at once and reports 'queued'/'running' until the latency has
+passed. Downloads write the configured payload at a bounded rate.
+"""
+import threading
+import time
+
+class FakeResult:
+    """Result of a FakeCDSClient request."""
+
+    def __init__(self, payload, ready_at, transfer_rate):
+        self.payload = payload
+        self.ready_at = ready_at
+        self.transfer_rate = transfer_rate
+        self.content_length = len(payload)
+        self.reply = {'state': 'queued'}
+
+    def update(self):
+        self.reply['state'] = 'completed' if time.monotonic() >= self.ready_at else 'running'
+
+    def download(self, target):
+        if self.transfer_rate:
+            time.sleep(len(self.payload) / self.transfer_rate)
+        with open(target, 'wb') as f:
+            f.write(self.payload)
+        return target
+
+class FakeCDSClient:
+    """cdsapi.Client look-alike with configurable queue latency and transfer rate.
+
+    payload is the bytes returned for every request, or a callable
+    payload(dataset, request) -> bytes.
+    """
+
+    def __init__(self, payload=b'PK\x05\x06' + b'\0' * 18, latency=0.0, transfer_rate=None,
+                 wait_until_complete=True):
+        self.payload = payload
+        self.latency = latency
+        self.transfer_rate = transfer_rate
+        self.wait_until_complete = wait_until_complete
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def retrieve(self, dataset, request):
+        with self.lock:
+            self.requests.append((dataset, request))
+        payload = self.payload(dataset, request) if callable(self.payload) else self.payload
+        result = FakeResult(payload, time.monotonic() + self.latency, self.transfer_rate)
+        if self.wait_until_complete:
+            time.sleep(self.latency)
+            result.update()
+        return result
@@ -0,0 +1,356 @@
+"""Trend + seasonal models fitted to many time series at once.
+
+Every series (a region of the aggregated XCO2 table, a cell of the merged
+grid or of the crop cube) gets the same harmonic regression
+
+    y(t) = b0 + b1 t + sum_k [a_k cos(2 pi k t / P) + c_k sin(2 pi k t / P)]
+
+with t in years from a fixed origin, plus an AR(1) term on the residuals.
+The series are stacked into a (series, time) matrix on a regular time grid
+(NaN where missing), and the weighted normal equations of all of them are
+built as one matrix product over all series and solved in one batched
+np.linalg.solve call.
+
+The fit keeps its sufficient statistics (X'WX, X'Wy, y'Wy and the lag-1
+cross products for the AR coefficient). They only grow by sums, so a new
+month of data updates a cached fit without revisiting the past, and the
+coefficients are solved again from the updated sums. Only closed steps go
+into the sums: the last open_steps steps (by default the current, possibly
+partial month) are kept as data and replaced by the next update, so their
+revisions are picked up. fit_cached also keeps a digest of the closed
+steps and refits from scratch when older data was revised.
+
+Rolling-origin backtests refit at several cut-off dates and score the
+forecasts of the following steps; the origins run in a process pool.
+
+    python forecasting.py xco2_regions.csv --key region --value mean --cache /tmp/xco2_fit.npz --backtest 12
+"""
+import argparse
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_HARMONICS = 2
+PERIOD_DAYS = 365.25
+DEFAULT_FREQ = 'MS'
+RIDGE = 1e-8
+MAX_PHI = 0.99
+# Trailing steps kept out of the cached sums because they may still be revised
+OPEN_STEPS = 1
+STAT_NAMES = ('xtwx', 'xtwy', 'ytwy', 'n', 'lag_xx', 'lag_xy', 'lag_yy')
+
+def series_matrix(df, key='region', value='mean', time='time', freq=DEFAULT_FREQ):
+    """Pivot a long table into (series ids, times, Y) on a regular time grid.
+
+    key may be one column or a list (e.g. ['lat', 'lon']); values falling
+    in the same period are averaged and missing periods are NaN.
+    """
+    keys = [key] if isinstance(key, str) else list(key)
+    table = df.assign(**{time: pd.to_datetime(df[time])}).pivot_table(
+        index=keys, columns=time, values=value, aggfunc='mean')
+    table = table.T.resample(freq).mean().T
+    ids = ['/'.join(map(str, row)) if isinstance(row, tuple) else str(row) for row in table.index]
+    return np.array(ids), table.columns.values.astype('datetime64[D]'), table.to_numpy(dtype=float)
+
+def cube_matrix(data_array, freq=DEFAULT_FREQ):
+    """(series ids, times, Y) of a (time, lat, lon) DataArray, one series per non-empty cell."""
+    data_array = data_array.resample(time=freq).mean()
+    values = data_array.values.reshape(data_array.sizes['time'], -1).T
+    lat, lon = np.meshgrid(data_array['lat'].values, data_array['lon'].values, indexing='ij')
+    keep = np.isfinite(values).any(axis=1)
+    ids = np.char.add(np.char.add(lat.ravel()[keep].astype(str), '/'), lon.ravel()[keep].astype(str))
+    return ids, data_array['time'].values.astype('datetime64[D]'), values[keep]
+
+def weighted_gram(A, W, B):
+    """sum_t W[s, t] A[t]' B[t] for every series s, as one (series, p*p) matrix product."""
+    outer = (A[:, :, None] * B[:, None, :]).reshape(len(A), -1)
+    return (W @ outer).reshape(len(W), A.shape[1], B.shape[1])
+
+def quadratic(beta, M):
+    """beta[s]' M[s] beta[s] for every series s."""
+    return np.einsum('sp,spq,sq->s', beta, M, beta, optimize=True)
+
+class HarmonicFit:
+    """Per-series harmonic regression with AR(1) residuals, updatable in place."""
+
+    def __init__(self, series_ids, origin, freq=DEFAULT_FREQ, n_harmonics=DEFAULT_HARMONICS,
+                 period_days=PERIOD_DAYS, open_steps=OPEN_STEPS):
+        self.series_ids = np.asarray(series_ids)
+        self.origin = np.datetime64(origin, 'D')
+        self.freq = freq
+        self.n_harmonics = n_harmonics
+        self.period_days = period_days
+        self.open_steps = open_steps
+        s, p = len(self.series_ids), 2 + 2 * n_harmonics
+        # Sums over the closed steps
+        self.xtwx = np.zeros((s, p, p))
+        self.xtwy = np.zeros((s, p))
+        self.ytwy = np.zeros(s)
+        self.n = np.zeros(s)
+        # Lag-1 sums over pairs of consecutive observed steps
+        self.lag_xx = np.zeros((s, p, p))
+        self.lag_xy = np.zeros((s, p))
+        self.lag_yy = np.zeros(s)
+        # Last closed step, and the open steps after it
+        self.last_time = None
+        self.last_y = np.full(s, np.nan)
+        self.open_times = np.empty(0, dtype='datetime64[D]')
+        self.open_Y = np.empty((s, 0))
+        self.digest = ''
+        self.coef = np.full((s, p), np.nan)
+        self.phi = np.zeros(s)
+        self.sigma = np.full(s, np.nan)
+        self.count = np.zeros(s)
+
+    def design(self, times):
+        """(time, parameter) design matrix: intercept, trend and harmonics."""
+        days = (np.asarray(times, dtype='datetime64[D]') - self.origin).astype(float)
+        columns = [np.ones_like(days), days / PERIOD_DAYS]
+        for k in range(1, self.n_harmonics + 1):
+            angle = 2 * np.pi * k * days / self.period_days
+            columns += [np.cos(angle), np.sin(angle)]
+        return np.stack(columns, axis=1)
+
+    def sums(self, Y, times):
+        """Sufficient statistics of the columns of Y (series, time) following the last closed step."""
+        X = self.design(times)
+        W = np.isfinite(Y).astype(float)
+        Y0 = np.nan_to_num(Y)
+        sums = {
+            'xtwx': weighted_gram(X, W, X),
+            'xtwy': (W * Y0) @ X,
+            'ytwy': (W * Y0 ** 2).sum(axis=1),
+            'n': W.sum(axis=1),
+        }
+
+        # Lag pairs, including the one with the last closed step when it is one step back
+        if self.last_time is not None and times[0] == self.step_after(self.last_time):
+            X = np.vstack([self.design([self.last_time]), X])
+            W = np.hstack([np.isfinite(self.last_y)[:, None].astype(float), W])
+            Y0 = np.hstack([np.nan_to_num(self.last_y)[:, None], Y0])
+        pair = W[:, 1:] * W[:, :-1]
+        sums['lag_xx'] = weighted_gram(X[1:], pair, X[:-1])
+        sums['lag_xy'] = (pair * Y0[:, 1:]) @ X[:-1] + (pair * Y0[:, :-1]) @ X[1:]
+        sums['lag_yy'] = (pair * Y0[:, 1:] * Y0[:, :-1]).sum(axis=1)
+        return sums
+
+    def update(self, Y, times):
+        """Add the columns of Y (series, time) after the last closed step and refit.
+
+        The last open_steps columns stay open: they are used in the fit but
+        not added to the sums, and the next update replaces them.
+        """
+        times = np.asarray(times, dtype='datetime64[D]')
+        if self.last_time is not None:
+            new = times > self.last_time
+            Y, times = Y[:, new], times[new]
+        if len(times) == 0:
+            return self
+
+        closed = max(len(times) - self.open_steps, 0)
+        if closed:
+            for name, value in self.sums(Y[:, :closed], times[:closed]).items():
+                setattr(self, name, getattr(self, name) + value)
+            self.last_time = times[closed - 1]
+            self.last_y = Y[:, closed - 1].copy()
+        self.open_times, self.open_Y = times[closed:], Y[:, closed:].copy()
+        return self.solve()
+
+    def solve(self):
+        """Solve the normal equations of every series from the accumulated sums."""
+        total = {name: getattr(self, name) for name in STAT_NAMES}
+        if len(self.open_times):
+            total = {name: value + total[name] for name, value in self.sums(self.open_Y, self.open_times).items()}
+        xtwx, xtwy, n = total['xtwx'], total['xtwy'], total['n']
+
+        p = xtwx.shape[1]
+        enough = n > p
+        # A ridge relative to each diagonal keeps near-singular series solvable;
+        # series with too few points get an identity system and NaN coefficients
+        diagonal = np.einsum('spp->sp', xtwx)
+        system = xtwx + RIDGE * diagonal[:, :, None] * np.eye(p)
+        system[~enough] = np.eye(p)
+        coef = np.linalg.solve(system, xtwy[..., None])[..., 0]
+        self.coef = np.where(enough[:, None], coef, np.nan)
+
+        beta = np.nan_to_num(self.coef)
+        rss = total['ytwy'] - 2 * (beta * xtwy).sum(axis=1) + quadratic(beta, xtwx)
+        lag = total['lag_yy'] - (beta * total['lag_xy']).sum(axis=1) + quadratic(beta, total['lag_xx'])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.phi = np.where(enough & (rss > 0), np.clip(lag / rss, -MAX_PHI, MAX_PHI), 0.0)
+            self.sigma = np.where(enough, np.sqrt(np.maximum(rss, 0) / (n - p)), np.nan)
+        self.count = n
+        return self
+
+    @property
+    def end_time(self):
+        """Time of the last step in the fit, open or closed."""
+        return self.open_times[-1] if len(self.open_times) else self.last_time
+
+    @property
+    def end_y(self):
+        return self.open_Y[:, -1] if len(self.open_times) else self.last_y
+
+    def step_after(self, time):
+        return pd.date_range(pd.Timestamp(time), periods=2, freq=self.freq)[1:].values.astype('datetime64[D]')[0]
+
+    def forecast_times(self, horizon):
+        start = pd.Timestamp(self.end_time)
+        return pd.date_range(start, periods=horizon + 1, freq=self.freq)[1:].values.astype('datetime64[D]')
+
+    def forecast(self, horizon):
+        """(times, Y) of the next horizon steps: the model plus the decaying last residual."""
+        times = self.forecast_times(horizon)
+        trend = self.coef @ self.design(times).T
+        last_residual = np.nan_to_num(self.end_y - self.coef @ self.design([self.end_time])[0])
+        decay = self.phi[:, None] ** np.arange(1, horizon + 1)[None, :]
+        return times, trend + last_residual[:, None] * decay
+
+    def to_frame(self):
+        """Fitted parameters, one row per series."""
+        names = ['intercept', 'trend_per_year'] + [
+            f"{kind}{k}" for k in range(1, self.n_harmonics + 1) for kind in ('cos', 'sin')
+        ]
+        frame = pd.DataFrame(self.coef, columns=names)
+        frame.insert(0, 'series', self.series_ids)
+        frame['amplitude1'] = np.hypot(frame['cos1'], frame['sin1']) if self.n_harmonics else np.nan
+        frame['phi'], frame['sigma'], frame['n'] = self.phi, self.sigma, self.count.astype(int)
+        return frame
+
+    def save(self, path):
+        """Save the sufficient statistics and parameters to an .npz file."""
+        np.savez(path, series_ids=self.series_ids, origin=self.origin, freq=self.freq,
+                 n_harmonics=self.n_harmonics, period_days=self.period_days, open_steps=self.open_steps,
+                 last_time=np.datetime64('NaT', 'D') if self.last_time is None else self.last_time,
+                 last_y=self.last_y, open_times=self.open_times, open_Y=self.open_Y, digest=self.digest,
+                 **{name: getattr(self, name) for name in STAT_NAMES})
+
+    @classmethod
+    def load(cls, path):
+        """Load a fit saved with save(); the coefficients are solved again."""
+        with np.load(path) as data:
+            fit = cls(data['series_ids'], data['origin'], str(data['freq']), int(data['n_harmonics']),
+                      float(data['period_days']), int(data['open_steps']))
+            for name in STAT_NAMES + ('last_y', 'open_times', 'open_Y'):
+                setattr(fit, name, data[name])
+            fit.digest = str(data['digest'])
+            last_time = data['last_time'][()]
+            fit.last_time = None if np.isnat(last_time) else last_time
+        return fit.solve()
+
+def fit_series(series_ids, times, Y, freq=DEFAULT_FREQ, n_harmonics=DEFAULT_HARMONICS):
+    """Fit every row of Y from scratch."""
+    return HarmonicFit(series_ids, times[0], freq, n_harmonics).update(Y, times)
+
+def closed_digest(times, Y, last_time):
+    """Digest of the steps up to last_time, to detect revisions of the cached data."""
+    if last_time is None:
+        return ''
+    closed = np.asarray(times, dtype='datetime64[D]') <= last_time
+    digest = hashlib.sha256(np.ascontiguousarray(np.asarray(times, dtype='datetime64[D]')[closed]).tobytes())
+    digest.update(np.ascontiguousarray(Y[:, closed], dtype=float).tobytes())
+    return digest.hexdigest()
+
+def fit_cached(path, series_ids, times, Y, freq=DEFAULT_FREQ, n_harmonics=DEFAULT_HARMONICS):
+    """Update the fit cached at path with the new columns of Y.
+
+    The fit is redone from scratch if the series changed or a closed step
+    was revised; revisions of the open steps are picked up by the update.
+    """
+    fit = None
+    if os.path.exists(path):
+        fit = HarmonicFit.load(path)
+        if not (np.array_equal(fit.series_ids, series_ids) and fit.freq == freq
+                and fit.n_harmonics == n_harmonics):
+            print(f"Cached fit {path} does not match the series, refitting.")
+            fit = None
+        elif fit.digest != closed_digest(times, Y, fit.last_time):
+            print(f"Data up to {fit.last_time} was revised since {path} was cached, refitting.")
+            fit = None
+    if fit is None:
+        fit = fit_series(series_ids, times, Y, freq, n_harmonics)
+    else:
+        fit.update(Y, times)
+    fit.digest = closed_digest(times, Y, fit.last_time)
+    fit.save(path)
+    return fit
+
+_backtest_data = {}
+
+def _init_backtest(series_ids, times, Y, freq, n_harmonics):
+    _backtest_data.update(series_ids=series_ids, times=times, Y=Y, freq=freq, n_harmonics=n_harmonics)
+
+def _backtest_origin(origin, horizon):
+    """Worker: fit on the steps before origin and score the next horizon steps."""
+    data = _backtest_data
+    fit = fit_series(data['series_ids'], data['times'][:origin], data['Y'][:, :origin],
+                     data['freq'], data['n_harmonics'])
+    _, predicted = fit.forecast(horizon)
+    actual = data['Y'][:, origin:origin + horizon]
+    error = predicted[:, :actual.shape[1]] - actual
+    n = np.isfinite(error).sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return pd.DataFrame({
+            'origin': data['times'][origin],
+            'horizon': np.arange(1, actual.shape[1] + 1),
+            'n': n,
+            'mae': np.nansum(np.abs(error), axis=0) / n,
+            'rmse': np.sqrt(np.nansum(error ** 2, axis=0) / n),
+        })
+
+def backtest(series_ids, times, Y, n_origins=12, horizon=3, min_train=24, freq=DEFAULT_FREQ,
+             n_harmonics=DEFAULT_HARMONICS, max_workers=None):
+    """Rolling-origin backtest over the last n_origins cut-offs, one origin per worker task.
+
+    Returns the errors per origin and horizon step, pooled over all series.
+    """
+    last = len(times) - 1
+    origins = [origin for origin in range(last - n_origins + 1, last + 1) if origin >= min_train]
+    if not origins:
+        raise ValueError(f"Need more than {min_train} time steps for a backtest")
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_backtest,
+                             initargs=(series_ids, times, Y, freq, n_harmonics)) as pool:
+        frames = list(pool.map(_backtest_origin, origins, [horizon] * len(origins)))
+    return pd.concat(frames, ignore_index=True)
+
+def read_table(path):
+    return pd.read_parquet(path) if path.endswith('.parquet') else pd.read_csv(path)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fit trend + seasonal models to aggregated time series.")
+    parser.add_argument('input', help="CSV or Parquet long table (e.g. aggregation or merge_sensors output)")
+    parser.add_argument('--key', nargs='+', default=['region'], help="Columns identifying a series")
+    parser.add_argument('--value', default='mean')
+    parser.add_argument('--time', default='time')
+    parser.add_argument('--freq', default=DEFAULT_FREQ, help="Regular time step (pandas frequency)")
+    parser.add_argument('--harmonics', type=int, default=DEFAULT_HARMONICS)
+    parser.add_argument('--cache', help="npz with the fit to update incrementally")
+    parser.add_argument('--horizon', type=int, default=3)
+    parser.add_argument('--backtest', type=int, default=0, help="Number of rolling origins (0 = none)")
+    parser.add_argument('--max-workers', type=int)
+    parser.add_argument('--output', default='/tmp/forecast')
+    args = parser.parse_args(argv)
+
+    series_ids, times, Y = series_matrix(read_table(args.input), args.key, args.value, args.time, args.freq)
+    if args.cache:
+        fit = fit_cached(args.cache, series_ids, times, Y, args.freq, args.harmonics)
+    else:
+        fit = fit_series(series_ids, times, Y, args.freq, args.harmonics)
+
+    fit.to_frame().to_csv(f"{args.output}_parameters.csv", index=False)
+    forecast_times, predicted = fit.forecast(args.horizon)
+    pd.DataFrame(predicted, index=series_ids, columns=forecast_times).rename_axis('series').to_csv(
+        f"{args.output}_forecast.csv")
+    print(f"Fitted {len(series_ids)} series up to {fit.end_time}")
+
+    if args.backtest:
+        scores = backtest(series_ids, times, Y, args.backtest, args.horizon, freq=args.freq,
+                          n_harmonics=args.harmonics, max_workers=args.max_workers)
+        scores.to_csv(f"{args.output}_backtest.csv", index=False)
+        print(scores.groupby('horizon')[['mae', 'rmse']].mean())
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,21 @@
-import cdsapi
+import os
 
-def download_data():
-    dataset = "satellite-carbon-dioxide"
-    client = cdsapi.Client()
+from sensors import DATASET, build_request
+from tracing import stage
 
-    request = {
-        'processing_level': 'level_2',
-        'variable': 'mid_tropospheric_columns_of_atmospheric_carbon_dioxide',
-        'sensor_and_algorithm': 'airs_nlis',
-        'year': ['2003', '2004', '2005', '2006', '2007'],
-        'month': ['01', '02', '03', '04', '05', '06', '07', '08', '09', '10', '11', '12'],
-        'day': ['01', '02', '03', '04', '05', '06', '07', '08', '09', '10', '11', '12', '13', '14', '15', '16', '17', '18', '19', '20', '21', '22', '23', '24', '25', '26', '27', '28', '29', '30', '31'],
-        'version': '3.0'
-    }
+sensor = "airs_nlis"
+dataset = DATASET
+target = "job_airs.zip"
+request = build_request(sensor)
 
-    client.retrieve(dataset, request).download()
+def download_data(client=None):
+    if client is None:
+        import cdsapi
+        client = cdsapi.Client()
+
+    with stage('cds_queue', chunk=sensor):
+        result = client.retrieve(dataset, request)
+    with stage('cds_transfer', chunk=sensor) as record:
+        result.download(target)
+        record['bytes'] = os.path.getsize(target)
     print("Downloaded AIRS data")
@@ -1,18 +1,21 @@
-import cdsapi
+import os
 
-def download_data():
-    dataset = "satellite-carbon-dioxide"
-    client = cdsapi.Client()
+from sensors import DATASET, build_request
+from tracing import stage
 
-    request = {
-        'processing_level': 'level_2',
-        'variable': 'mid_tropospheric_columns_of_atmospheric_carbon_dioxide',
-        'sensor_and_algorithm': 'tanso2_fts_srfp',
-        'year': ['2019', '2020', '2021', '2022'],
-        'month': ['01', '02', '03', '04', '05', '06', '07', '08', '09', '10', '11', '12'],
-        'day': ['01', '02', '03', '04', '05', '06', '07', '08', '09', '10', '11', '12', '13', '14', '15', '16', '17', '18', '19', '20', '21', '22', '23', '24', '25', '26', '27', '28', '29', '30', '31'],
-        'version': '2.0.0'
-    }
+sensor = "tanso2_fts_srfp"
+dataset = DATASET
+target = "job_tanso2_fts_srfp.zip"
+request = build_request(sensor)
 
-    client.retrieve(dataset, request).download()
+def download_data(client=None):
+    if client is None:
+        import cdsapi
+        client = cdsapi.Client()
+
+    with stage('cds_queue', chunk=sensor):
+        result = client.retrieve(dataset, request)
+    with stage('cds_transfer', chunk=sensor) as record:
+        result.download(target)
+        record['bytes'] = os.path.getsize(target)
     print("Downloaded TANSO2-FTS data")
@@ -0,0 +1,158 @@
+"""Track many CDS jobs from one asyncio event loop.
+
+Requests are submitted without waiting (cdsapi.Client(wait_until_complete=False)),
+every job is polled with exponential backoff and jitter, and finished jobs are
+handed to a pool of download workers through a queue, so a slow job never
+holds up the others.
+"""
+import asyncio
+import os
+import random
+import time
+
+from tracing import stage
+
+DEFAULT_BASE_DELAY = 5.0
+DEFAULT_MAX_DELAY = 120.0
+# Jobs kept in the CDS queue at once; CDS limits the queued requests per user
+DEFAULT_MAX_ACTIVE = 4
+
+def async_client_factory():
+    """CDS client that returns from retrieve() as soon as the request is queued."""
+    import cdsapi
+    return cdsapi.Client(wait_until_complete=False)
+
+def backoff_delay(attempt, base_delay=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY, rng=random):
+    """Delay before poll number attempt: doubling, capped, with jitter in [cap/2, cap]."""
+    cap = min(max_delay, base_delay * 2 ** attempt)
+    return rng.uniform(cap / 2, cap)
+
+def job_state(result):
+    """Refresh a CDS result and return its state (queued, running, completed, failed)."""
+    result.update()
+    return result.reply.get('state')
+
+def download_result(job, result):
+    """Default download stage: write the result to the job target."""
+    target_dir = os.path.dirname(job['target'])
+    if target_dir:
+        os.makedirs(target_dir, exist_ok=True)
+    return result.download(job['target']) or job['target']
+
+async def wait_until_ready(job, result, base_delay=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY):
+    """Poll a submitted job without blocking the event loop until it completes."""
+    attempt = 0
+    while True:
+        state = await asyncio.to_thread(job_state, result)
+        if state == 'completed':
+            return
+        if state == 'failed':
+            error = result.reply.get('error', {})
+            raise RuntimeError(f"CDS job {job['name']} failed: {error.get('message', error)}")
+        await asyncio.sleep(backoff_delay(attempt, base_delay, max_delay))
+        attempt += 1
+
+async def submit_and_wait(job, client_factory, base_delay, max_delay):
+    """Submit one job and return its result once CDS has it ready."""
+    client = client_factory()
+    with stage('cds_queue', chunk=job['name']):
+        result = await asyncio.to_thread(client.retrieve, job['dataset'], job['request'])
+        await wait_until_ready(job, result, base_delay, max_delay)
+    return result
+
+async def download_worker(ready_queue, download):
+    """Download finished jobs as they arrive on the queue and hand the outcome back to the job."""
+    while True:
+        item = await ready_queue.get()
+        if item is None:
+            ready_queue.task_done()
+            return
+        job, result, done = item
+        started = time.monotonic()
+        try:
+            with stage('cds_transfer', chunk=job['name']) as record:
+                path = await asyncio.to_thread(download, job, result)
+                record['bytes'] = os.path.getsize(path) if os.path.exists(path) else 0
+        except Exception as e:
+            done.set_exception(e)
+        else:
+            done.set_result({
+                'target': path,
+                'started': started,
+                'transfer_s': time.monotonic() - started,
+                'bytes': os.path.getsize(path) if os.path.exists(path) else 0,
+            })
+        ready_queue.task_done()
+
+async def run_job(job, client_factory, ready_queue, active_slots, retries, base_delay, max_delay):
+    """Submit, wait for and download one job, retrying only this job when it fails.
+
+    active_slots caps the jobs sitting in the CDS queue; a job gives its slot
+    back once it is ready, before its download.
+    """
+    for attempt in range(retries + 1):
+        try:
+            async with active_slots:
+                submitted = time.monotonic()
+                result = await submit_and_wait(job, client_factory, base_delay, max_delay)
+            ready = time.monotonic()
+            done = asyncio.get_running_loop().create_future()
+            await ready_queue.put((job, result, done))
+            transfer = await done
+        except Exception as e:
+            if attempt == retries:
+                print(f"Job {job['name']} failed: {e}")
+                return {'name': job['name'], 'error': str(e)}
+            print(f"Job {job['name']} failed ({e}), retrying ({attempt + 1}/{retries})...")
+            continue
+
+        stats = {
+            'name': job['name'],
+            'target': transfer['target'],
+            'queue_s': ready - submitted,
+            'slot_wait_s': transfer['started'] - ready,
+            'transfer_s': transfer['transfer_s'],
+            'bytes': transfer['bytes'],
+        }
+        print(f"Job {job['name']} done: queue {stats['queue_s']:.1f}s, "
+              f"transfer {stats['transfer_s']:.1f}s, {stats['bytes']} bytes")
+        return stats
+
+async def track_jobs(jobs, client_factory=async_client_factory, download=download_result,
+                     max_downloads=2, max_active=DEFAULT_MAX_ACTIVE, retries=0,
+                     base_delay=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY):
+    """Submit all jobs, poll them concurrently and download each one as soon as it is ready.
+
+    max_active caps how many jobs sit in the CDS queue at once
+    and retries is the number of retries per job, as in main.schedule_jobs.
+    Returns one stats dict per job, in completion order.
+    """
+    ready_queue = asyncio.Queue()
+    active_slots = asyncio.Semaphore(max_active or DEFAULT_MAX_ACTIVE)
+    results = []
+    workers = [
+        asyncio.create_task(download_worker(ready_queue, download))
+        for _ in range(max_downloads)
+    ]
+
+    async def run(job):
+        results.append(await run_job(job, client_factory, ready_queue, active_slots, retries,
+                                     base_delay, max_delay))
+
+    await asyncio.gather(*(run(job) for job in jobs))
+    for _ in workers:
+        await ready_queue.put(None)
+    await asyncio.gather(*workers)
+    return results
+
+def run_jobs(jobs, **kwargs):
+    """Synchronous entry point for track_jobs."""
+    return asyncio.run(track_jobs(jobs, **kwargs))
+
+def wait_for_result(client, dataset, request, base_delay=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY):
+    """Submit one request with a non-waiting client and return its result once completed."""
+    async def submit():
+        result = await asyncio.to_thread(client.retrieve, dataset, request)
+        await wait_until_ready({'name': dataset}, result, base_delay, max_delay)
+        return result
+    return asyncio.run(submit())
@@ -1,19 +1,272 @@
+import argparse
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import job_iasi_metop_a
 import job_iasi_metop_b
 import job_iasi_metop_c
 import job_airs
 import job_tanso2_fts_srfp
+from cache import DEFAULT_CACHE_DIR, DEFAULT_MAX_BYTES, DownloadCache, file_sha256
+import job_tracker
+from chunking import DEFAULT_BUDGET_BYTES, pending_chunks, plan_all_chunks
+from manifest import Manifest
+from s3_stream import get_s3_client, upload_file_to_s3
+from sensors import plan_requests, print_plan
+from tracing import report_on_exit, stage
+
+JOB_MODULES = [
+    job_iasi_metop_a,
+    job_iasi_metop_b,
+    job_iasi_metop_c,
+    job_airs,
+    job_tanso2_fts_srfp,
+]
+
+def default_client_factory():
+    """Create one CDS client per thread (its HTTP session is not thread-safe)."""
+    import cdsapi
+    return cdsapi.Client()
+
+def jobs_from_chunks(chunks, download_dir='downloads'):
+    """Build one job per planned chunk, downloading to a file named after its key."""
+    return [
+        {
+            'name': chunk['key'],
+            'dataset': chunk['dataset'],
+            'request': chunk['request'],
+            'target': os.path.join(download_dir, chunk['key'].replace('/', '_') + '.zip'),
+        }
+        for chunk in chunks
+    ]
+
+def run_job(job, client_factory, download_slots, retries=0, cache=None):
+    """Run a job, retrying only this job when it fails."""
+    for attempt in range(retries + 1):
+        try:
+            if cache is not None:
+                # Only the first attempt looks the request up, so a retried job counts one miss
+                path, stats = cache.fetch(client_factory, job['dataset'], job['request'], download_slots,
+                                          lookup=attempt == 0)
+                return dict(stats, name=job['name'], target=path)
+            return fetch_job(job, client_factory, download_slots)
+        except Exception as e:
+            if attempt == retries:
+                raise
+            print(f"Job {job['name']} failed ({e}), retrying ({attempt + 1}/{retries})...")
+
+def fetch_job(job, client_factory, download_slots):
+    """Submit a job to CDS, wait for the result and download it."""
+    client = client_factory()
+    target_dir = os.path.dirname(job['target'])
+    if target_dir:
+        os.makedirs(target_dir, exist_ok=True)
+
+    submitted = time.monotonic()
+    with stage('cds_queue', chunk=job['name']):
+        result = client.retrieve(job['dataset'], job['request'])
+    ready = time.monotonic()
+
+    # Downloads are capped separately so the runner is not saturated
+    with download_slots:
+        started = time.monotonic()
+        with stage('cds_transfer', chunk=job['name']) as record:
+            path = result.download(job['target']) or job['target']
+            record['bytes'] = os.path.getsize(path) if os.path.exists(path) else 0
+        finished = time.monotonic()
+
+    return {
+        'name': job['name'],
+        'target': path,
+        'queue_s': ready - submitted,
+        'slot_wait_s': started - ready,
+        'transfer_s': finished - started,
+        'bytes': os.path.getsize(path) if os.path.exists(path) else 0,
+    }
+
+def schedule_jobs(jobs, max_active=job_tracker.DEFAULT_MAX_ACTIVE, max_downloads=2,
+                  client_factory=default_client_factory, retries=0, cache=None):
+    """Run the jobs in a bounded pool and download each one as soon as it is ready.
+
+    max_active caps how many jobs sit in the CDS queue at the same time and
+    max_downloads how many transfers run in parallel. With a DownloadCache,
+    requests already in the cache are served locally without contacting CDS.
+    """
+    if not jobs:
+        return []
+
+    max_active = min(max_active or job_tracker.DEFAULT_MAX_ACTIVE, len(jobs))
+    download_slots = threading.BoundedSemaphore(max_downloads)
+    results = []
+
+    with ThreadPoolExecutor(max_workers=max_active) as pool:
+        futures = {
+            pool.submit(run_job, job, client_factory, download_slots, retries, cache): job['name']
+            for job in jobs
+        }
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                stats = future.result()
+            except Exception as e:
+                stats = {'name': name, 'error': str(e)}
+                print(f"Job {name} failed: {e}")
+            else:
+                if stats.get('cached'):
+                    print(f"Job {name} served from cache: {stats['bytes']} bytes")
+                else:
+                    print(
+                        f"Job {name} done: queue {stats['queue_s']:.1f}s, "
+                        f"transfer {stats['transfer_s']:.1f}s, {stats['bytes']} bytes"
+                    )
+            results.append(stats)
+
+    return results
+
+def track_jobs_async(jobs, max_active=job_tracker.DEFAULT_MAX_ACTIVE, max_downloads=2, retries=0, cache=None,
+                     client_factory=job_tracker.async_client_factory):
+    """Like schedule_jobs, but polls every CDS job from one asyncio event loop."""
+    results = []
+    download = job_tracker.download_result
+    if cache is not None:
+        pending = []
+        for job in jobs:
+            path = cache.get(job['dataset'], job['request'])
+            if path is None:
+                pending.append(job)
+                continue
+            print(f"Job {job['name']} served from cache: {os.path.getsize(path)} bytes")
+            results.append({'name': job['name'], 'target': path, 'queue_s': 0.0, 'slot_wait_s': 0.0,
+                            'transfer_s': 0.0, 'bytes': os.path.getsize(path), 'cached': True})
+        jobs = pending
+
+        def download(job, result):
+            return cache.store(job['dataset'], job['request'], result)
+
+    results.extend(job_tracker.run_jobs(
+        jobs, client_factory=client_factory, download=download, max_downloads=max_downloads,
+        max_active=max_active, retries=retries,
+    ))
+    return results
+
+def record_results(manifest, chunks, results):
+    """Record the outcome of every chunk job in the manifest."""
+    by_key = {chunk['key']: chunk for chunk in chunks}
+    for stats in results:
+        chunk = by_key[stats['name']]
+        fields = {'sensor': chunk['sensor'], 'year': chunk['year'], 'month': chunk['month']}
+        if 'error' in stats:
+            manifest.record(chunk['key'], 'failed', chunk['request_hash'], error=stats['error'], **fields)
+        else:
+            manifest.record(chunk['key'], 'fetched', chunk['request_hash'], size=stats['bytes'],
+                            sha256=file_sha256(stats['target']), path=stats['target'], **fields)
+
+def upload_results(chunks, results, bucket_name, s3_client=None):
+    """Upload every fetched chunk to its s3_key, where pending_chunks looks for it."""
+    by_key = {chunk['key']: chunk for chunk in chunks}
+    for stats in results:
+        if 'error' in stats:
+            continue
+        try:
+            upload_file_to_s3(stats['target'], bucket_name, by_key[stats['name']]['s3_key'], s3_client)
+        except Exception as e:
+            stats['error'] = f"upload failed: {e}"
+            print(f"Upload of {stats['name']} failed: {e}")
+
+def print_report(results):
+    """Print a per-job summary at the end of the run."""
+    print(f"{'job':<40}{'queue_s':>10}{'transfer_s':>12}{'bytes':>14}")
+    for stats in sorted(results, key=lambda s: s['name']):
+        if 'error' in stats:
+            print(f"{stats['name']:<40}  FAILED: {stats['error']}")
+        else:
+            print(
+                f"{stats['name']:<40}{stats['queue_s']:>10.1f}"
+                f"{stats['transfer_s']:>12.1f}{stats['bytes']:>14}"
+            )
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Download the satellite CO2 jobs from CDS.")
+    parser.add_argument('--max-active', type=int, default=job_tracker.DEFAULT_MAX_ACTIVE,
+                        help="Maximum number of jobs queued in CDS at once.")
+    parser.add_argument('--max-downloads', type=int, default=2,
+                        help="Maximum number of concurrent downloads.")
+    parser.add_argument('--chunk-budget-mb', type=int, default=DEFAULT_BUDGET_BYTES // 1_000_000,
+                        help="Maximum estimated size of one chunk request.")
+    parser.add_argument('--skip-in-bucket', default=None, metavar='BUCKET',
+                        help="Skip the chunks already stored in this S3 bucket.")
+    parser.add_argument('--upload-to', default=None, metavar='BUCKET',
+                        help="Upload each fetched chunk to its key in this bucket "
+                             "(default: the --skip-in-bucket bucket).")
+    parser.add_argument('--download-dir', default='downloads',
+                        help="Directory where the chunk zips are written.")
+    parser.add_argument('--retries', type=int, default=2,
+                        help="Retries per chunk before giving up on it.")
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR,
+                        help="Directory of the download cache.")
+    parser.add_argument('--cache-max-gb', type=float, default=DEFAULT_MAX_BYTES / 1e9,
+                        help="Size limit of the download cache.")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Always download from CDS, bypassing the cache.")
+    parser.add_argument('--manifest', default=None,
+                        help="Manifest of fetched chunks, local path or s3://bucket/key "
+                             "(default: <download-dir>/manifest.json).")
+    parser.add_argument('--full', action='store_true',
+                        help="Ignore the manifest and fetch every planned chunk.")
+    parser.add_argument('--async-tracker', action='store_true',
+                        help="Submit without waiting and poll all jobs from one asyncio loop.")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="List the planned requests and their estimated sizes without contacting CDS.")
+    args = parser.parse_args(argv)
+
+    sensors = [module.sensor for module in JOB_MODULES]
+    chunks = plan_all_chunks(sensors, args.chunk_budget_mb * 1_000_000)
+    if args.skip_in_bucket:
+        planned = len(chunks)
+        chunks = pending_chunks(chunks, get_s3_client(), args.skip_in_bucket)
+        print(f"{planned - len(chunks)} of {planned} chunks already in {args.skip_in_bucket}")
+
+    manifest = Manifest(args.manifest or os.path.join(args.download_dir, 'manifest.json'))
+    if not args.full:
+        planned = len(chunks)
+        chunks = manifest.delta(chunks)
+        print(f"{planned - len(chunks)} of {planned} chunks already fetched according to the manifest")
+
+    if args.dry_run:
+        print_plan(plan_requests(sensors))
+        print(f"{len(chunks)} chunks to download")
+        return
 
-def main():
     print("Starting data retrieval process...")
-    
-    job_iasi_metop_a.download_data()
-    job_iasi_metop_b.download_data()
-    job_iasi_metop_c.download_data()
-    job_airs.download_data()
-    job_tanso2_fts_srfp.download_data()
-    
+    report_on_exit('main_run_report')
+
+    cache = None if args.no_cache else DownloadCache(args.cache_dir, int(args.cache_max_gb * 1e9))
+    jobs = jobs_from_chunks(chunks, args.download_dir)
+    if args.async_tracker:
+        results = track_jobs_async(jobs, max_active=args.max_active, max_downloads=args.max_downloads,
+                                   retries=args.retries, cache=cache)
+    else:
+        results = schedule_jobs(
+            jobs,
+            max_active=args.max_active,
+            max_downloads=args.max_downloads,
+            retries=args.retries,
+            cache=cache,
+        )
+    upload_bucket = args.upload_to or args.skip_in_bucket
+    if upload_bucket:
+        upload_results(chunks, results, upload_bucket, get_s3_client())
+    record_results(manifest, chunks, results)
+    manifest.save()
+    print_report(results)
+    if cache is not None:
+        cache.report()
+
     print("Data retrieval process completed.")
+    if any('error' in stats for stats in results):
+        raise SystemExit(1)
 
 if __name__ == "__main__":
     main()
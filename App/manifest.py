@@ -0,0 +1,98 @@
+"""Persistent manifest of the chunks already fetched or processed.
+
+The manifest is one JSON document, stored locally or in a bucket
+(s3://bucket/key), that maps each chunk key (e.g. sensor/version/year) to
+its request hash, size, checksum and status. A run computes the delta
+against it and only fetches or processes the chunks that are new, changed
+or failed.
+"""
+import json
+import os
+import threading
+import time
+
+# A chunk at a later status has also gone through the earlier ones
+STATUSES = ('failed', 'fetched', 'processed')
+
+class Manifest:
+    """Chunk manifest backed by a local JSON file or an S3 object."""
+
+    def __init__(self, location, s3_client=None):
+        self.location = location
+        self.s3_client = s3_client
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.load()
+
+    def _s3_location(self):
+        bucket_name, _, key = self.location[len('s3://'):].partition('/')
+        if self.s3_client is None:
+            from s3_stream import get_s3_client
+            self.s3_client = get_s3_client()
+        return bucket_name, key
+
+    def load(self):
+        """Read the manifest; a missing manifest is an empty one."""
+        if self.location.startswith('s3://'):
+            bucket_name, key = self._s3_location()
+            try:
+                body = self.s3_client.get_object(Bucket=bucket_name, Key=key)['Body'].read()
+            except self.s3_client.exceptions.NoSuchKey:
+                body = b'{}'
+            self.entries = json.loads(body)
+        elif os.path.exists(self.location):
+            with open(self.location) as f:
+                self.entries = json.load(f)
+        return self
+
+    def save(self):
+        """Write the manifest back, atomically for local files."""
+        with self.lock:
+            body = json.dumps(self.entries, indent=1, sort_keys=True)
+        if self.location.startswith('s3://'):
+            bucket_name, key = self._s3_location()
+            self.s3_client.put_object(Bucket=bucket_name, Key=key, Body=body.encode(),
+                                      ContentType='application/json')
+            return
+        folder = os.path.dirname(self.location)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        tmp_path = self.location + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(body)
+        os.replace(tmp_path, self.location)
+
+    def get(self, key):
+        with self.lock:
+            return self.entries.get(key)
+
+    def record(self, key, status, request_hash, **fields):
+        """Record the status of a chunk with its request hash, size, checksum, etc."""
+        if status not in STATUSES:
+            raise ValueError(f"Unknown status '{status}', expected one of {STATUSES}")
+        with self.lock:
+            entry = self.entries.setdefault(key, {})
+            if entry.get('request_hash') != request_hash:
+                entry.clear()
+            entry.update(fields, status=status, request_hash=request_hash, updated_at=time.time())
+
+    def is_done(self, key, request_hash, status='fetched'):
+        """True when a chunk reached status with the same request hash."""
+        entry = self.get(key)
+        return (
+            entry is not None
+            and entry.get('request_hash') == request_hash
+            and STATUSES.index(entry.get('status', 'failed')) >= STATUSES.index(status)
+        )
+
+    def delta(self, chunks, status='fetched'):
+        """Return the chunks (dicts with key and request_hash) that still need work."""
+        return [chunk for chunk in chunks if not self.is_done(chunk['key'], chunk['request_hash'], status)]
+
+    def summary(self):
+        """Count the chunks per status."""
+        counts = dict.fromkeys(STATUSES, 0)
+        with self.lock:
+            for entry in self.entries.values():
+                counts[entry.get('status', 'failed')] += 1
+        return counts
@@ -0,0 +1,349 @@
+"""Merge and harmonize the level-2 XCO2 products of several sensors.
+
+Input is a directory of per-sensor sounding stores (see sounding_store.py).
+Everything runs one day at a time on memory-mapped slices, so memory is
+bounded by one day of soundings whatever the length of the record.
+
+1. Collocation: for every pair of sensors, each sounding of the first is
+   matched with the soundings of the second within max_km and max_hours.
+   The second sensor is bucketed into latitude bands of max_km height and
+   longitude cells at least max_km wide, then sorted by the composite key
+   (cell, time); the candidates of a sounding are the time windows of its
+   3x3 neighbour cells, found with searchsorted. Only candidate pairs are
+   expanded (in blocks of max_pairs) and filtered by great-circle distance.
+   The differences with the mean of the matches are accumulated per pair
+   and year as mergeable PartialAggregate statistics.
+2. Biases: per-sensor offsets relative to a reference sensor are solved by
+   weighted least squares from the mean pair differences, so sensors that
+   never overlap the reference are linked through a third one. Sensors with
+   no chain of pairs to the reference keep a zero offset.
+3. Harmonization: bias-corrected soundings are averaged onto a common
+   cell_deg grid per day, weighting sensors by inverse variance, and
+   written through an output sink as one long time series.
+
+    python merge_sensors.py store/ --output /tmp/xco2_merged.parquet --reference TANSO-FTS-OCFP
+"""
+import argparse
+import collections
+import itertools
+import os
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from aggregation import MAX_REGIONS, PartialAggregate
+from output_sink import make_sink
+from sounding_store import INDEX_FILE, SECONDS_PER_DAY, SoundingStore
+from tracing import stage
+
+DEFAULT_CELL_DEG = 1.0
+DEFAULT_MAX_KM = 50.0
+DEFAULT_MAX_HOURS = 2.0
+# Candidate pairs expanded at once by the collocation
+MAX_PAIRS = 2_000_000
+# Histogram edges of the pair differences; 0.05 ppm bins
+BIAS_EDGES = np.linspace(-20.0, 20.0, 801)
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEG = np.pi * EARTH_RADIUS_KM / 180
+
+def open_stores(directory):
+    """Open every sensor store under a directory as {sensor: SoundingStore}."""
+    return {
+        name: SoundingStore(os.path.join(directory, name))
+        for name in sorted(os.listdir(directory))
+        if os.path.exists(os.path.join(directory, name, INDEX_FILE))
+    }
+
+def good_soundings(rows):
+    """Rows with quality flag 0 (good), copied out of the memory map."""
+    keep = rows['xco2_quality_flag'] == 0
+    return {name: np.asarray(values[keep]) for name, values in rows.items()}
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(x, dtype=float)) for x in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+class BandGrid:
+    """Latitude bands of band_deg with longitude cells at least max_km wide in every band."""
+
+    def __init__(self, max_km):
+        self.band_deg = max(max_km / KM_PER_DEG, 1e-3)
+        self.n_bands = int(np.ceil(180 / self.band_deg))
+        # A point within max_km of a sounding at latitude lat is at most
+        # asin(sin(d) / cos(lat)) away in longitude (d in radians). Soundings
+        # of the neighbouring bands reach band_deg further poleward; caps
+        # that contain a pole span every longitude.
+        edges = -90 + self.band_deg * np.arange(self.n_bands + 1)
+        poleward = np.maximum(np.abs(edges[:-1]), np.abs(edges[1:])) + self.band_deg
+        distance = np.radians(self.band_deg)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            ratio = np.sin(distance) / np.cos(np.radians(np.minimum(poleward, 90.0)))
+        width = np.where((poleward + self.band_deg < 90) & (ratio < 1),
+                         np.degrees(np.arcsin(np.minimum(ratio, 1.0))), 360.0)
+        self.n_cols = np.maximum(np.floor(360 / width), 1).astype(np.int64)
+        self.max_cols = int(self.n_cols.max())
+
+    def band(self, lat):
+        return np.clip(np.floor((lat + 90) / self.band_deg), 0, self.n_bands - 1).astype(np.int64)
+
+    def cell(self, band, lon):
+        """Cell id of longitudes in given bands (columns wrap around the antimeridian)."""
+        n_cols = self.n_cols[band]
+        cols = np.floor((lon + 180) / 360 * n_cols).astype(np.int64) % n_cols
+        return band * self.max_cols + cols
+
+    def neighbours(self, lat, lon):
+        """(9, n) cell ids around each point; repeated cells (near the poles) are -1."""
+        band = self.band(lat)
+        cells = []
+        for d_band in (-1, 0, 1):
+            other = np.clip(band + d_band, 0, self.n_bands - 1)
+            n_cols = self.n_cols[other]
+            centre = self.cell(other, lon) - other * self.max_cols
+            for d_col in (-1, 0, 1):
+                cells.append(other * self.max_cols + (centre + d_col) % n_cols)
+        cells = np.array(cells)
+        for k in range(1, len(cells)):
+            cells[k][(cells[:k] == cells[k]).any(axis=0)] = -1
+        return cells
+
+def collocate(a, b, max_km=DEFAULT_MAX_KM, max_hours=DEFAULT_MAX_HOURS, max_pairs=MAX_PAIRS):
+    """Match the soundings of a with those of b within max_km and max_hours.
+
+    a and b are column dicts (time in seconds, latitude, longitude, xco2).
+    Returns (count, mean): the number of b matches of every a sounding and
+    the mean b xco2 of those matches (NaN where there is none).
+    """
+    n = len(a['time'])
+    total = np.zeros(n)
+    count = np.zeros(n, dtype=np.int64)
+    if n == 0 or len(b['time']) == 0:
+        return count, np.full(n, np.nan)
+
+    grid = BandGrid(max_km)
+    window = int(max_hours * 3600)
+    origin = min(a['time'].min(), b['time'].min()) - window
+    span = max(a['time'].max(), b['time'].max()) + window - origin + 1
+
+    b_keys = grid.cell(grid.band(b['latitude']), b['longitude']) * span + (b['time'] - origin)
+    order = np.argsort(b_keys, kind='stable')
+    b_keys = b_keys[order]
+    b_lat, b_lon, b_xco2 = (b[name][order] for name in ('latitude', 'longitude', 'xco2'))
+
+    a_time = a['time'] - origin
+    owners, starts, stops = [], [], []
+    for cells in grid.neighbours(a['latitude'], a['longitude']):
+        lo = np.searchsorted(b_keys, cells * span + a_time - window, side='left')
+        hi = np.searchsorted(b_keys, cells * span + a_time + window, side='right')
+        hit = (cells >= 0) & (hi > lo)
+        owners.append(np.nonzero(hit)[0])
+        starts.append(lo[hit])
+        stops.append(hi[hit])
+    owners, starts, stops = (np.concatenate(x) for x in (owners, starts, stops))
+
+    # Expand the candidate ranges into pairs a block at a time
+    sizes = stops - starts
+    ends = np.cumsum(sizes)
+    first = 0
+    while first < len(sizes):
+        last = max(int(np.searchsorted(ends, ends[first] - sizes[first] + max_pairs, side='right')), first + 1)
+        block_sizes = sizes[first:last]
+        a_index = np.repeat(owners[first:last], block_sizes)
+        offsets = np.arange(block_sizes.sum()) - np.repeat(np.cumsum(block_sizes) - block_sizes, block_sizes)
+        b_index = np.repeat(starts[first:last], block_sizes) + offsets
+        close = haversine_km(a['latitude'][a_index], a['longitude'][a_index],
+                             b_lat[b_index], b_lon[b_index]) <= max_km
+        total += np.bincount(a_index[close], weights=b_xco2[b_index[close]], minlength=n)
+        count += np.bincount(a_index[close], minlength=n)
+        first = last
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return count, np.where(count > 0, total / count, np.nan)
+
+def pair_label(first, second):
+    return f"{first}|{second}"
+
+def day_range(stores):
+    days = np.concatenate([store.days for store in stores.values()])
+    return np.unique(days) if len(days) else days
+
+def pair_statistics(stores, max_km=DEFAULT_MAX_KM, max_hours=DEFAULT_MAX_HOURS, bucket='year'):
+    """Accumulate first - second xco2 differences of collocated soundings for every sensor pair."""
+    sensors = sorted(stores)
+    pairs = list(itertools.combinations(sensors, 2))
+    stats = PartialAggregate([pair_label(*pair) for pair in pairs], bucket, BIAS_EDGES)
+    window = int(max_hours * 3600)
+
+    for day in day_range(stores):
+        start = day * SECONDS_PER_DAY
+        with stage('collocate', chunk=str(np.datetime64(int(day), 'D'))) as record:
+            today = {sensor: good_soundings(store.day(np.datetime64(int(day), 'D')))
+                     for sensor, store in stores.items()}
+            for pair_id, (first, second) in enumerate(pairs):
+                a = today[first]
+                if len(a['time']) == 0 or len(today[second]['time']) == 0:
+                    continue
+                # The second sensor is read with the window on both sides of the day
+                b = good_soundings(stores[second].slice_time(
+                    np.datetime64(int(start - window), 's'),
+                    np.datetime64(int(start + SECONDS_PER_DAY + window), 's')))
+                count, mean = collocate(a, b, max_km, max_hours)
+                matched = count > 0
+                stats.add(a['xco2'][matched] - mean[matched], np.full(matched.sum(), pair_id),
+                          a['time'][matched].astype('datetime64[s]'))
+                record['bytes'] += sum(values.nbytes for values in b.values())
+    return stats
+
+def linked_sensors(pairs, reference):
+    """Sensors connected to the reference through a chain of collocated pairs (BFS)."""
+    neighbours = {}
+    for first, second in pairs:
+        neighbours.setdefault(first, set()).add(second)
+        neighbours.setdefault(second, set()).add(first)
+    linked, queue = {reference}, collections.deque([reference])
+    while queue:
+        for sensor in neighbours.get(queue.popleft(), ()):
+            if sensor not in linked:
+                linked.add(sensor)
+                queue.append(sensor)
+    return linked
+
+def sensor_biases(stats, sensors, reference):
+    """Per-sensor offsets (ppm) relative to the reference, from the mean pair differences.
+
+    Solves bias[first] - bias[second] = mean difference over all pairs by
+    least squares weighted by the number of collocations, with
+    bias[reference] = 0. Only sensors linked to the reference through
+    collocated pairs are solved; the others get a zero offset and a warning.
+    """
+    sensors = list(sensors)
+    pair_ids = stats.keys % MAX_REGIONS
+    pairs = {}
+    for pair_id in np.unique(pair_ids):
+        groups = pair_ids == pair_id
+        n = stats.count[groups].sum()
+        if n > 0:
+            pairs[tuple(stats.region_names[pair_id].split('|'))] = (
+                (stats.mean[groups] * stats.count[groups]).sum() / n, n
+            )
+
+    linked = linked_sensors(pairs, reference)
+    unlinked = [sensor for sensor in sensors if sensor not in linked]
+    if unlinked:
+        warnings.warn(f"No collocations link {unlinked} to {reference}; their offsets are set to 0",
+                      stacklevel=2)
+
+    solved = [sensor for sensor in sensors if sensor in linked]
+    index = {sensor: position for position, sensor in enumerate(solved)}
+    rows, targets, weights = [], [], []
+    for (first, second), (difference, n) in pairs.items():
+        if first in index and second in index:
+            row = np.zeros(len(solved))
+            row[index[first]], row[index[second]] = 1.0, -1.0
+            rows.append(row)
+            targets.append(difference)
+            weights.append(np.sqrt(n))
+
+    anchor = np.zeros(len(solved))
+    anchor[index[reference]] = 1.0
+    scale = max(weights, default=1.0) * 10
+    matrix = np.array(rows + [anchor]) * np.array(weights + [scale])[:, None]
+    target = np.array(targets + [0.0]) * np.array(weights + [scale])
+    biases = np.linalg.lstsq(matrix, target, rcond=None)[0]
+    return {sensor: float(biases[index[sensor]]) if sensor in index else 0.0 for sensor in sensors}
+
+def grid_day(rows, bias, cell_deg):
+    """Inverse-variance sums of one sensor-day of soundings per grid cell."""
+    n_cols = int(round(360 / cell_deg))
+    row = np.clip(np.floor((rows['latitude'] + 90) / cell_deg), 0, round(180 / cell_deg) - 1).astype(np.int64)
+    col = np.clip(np.floor((rows['longitude'] + 180) / cell_deg), 0, n_cols - 1).astype(np.int64)
+    cells, inverse = np.unique(row * n_cols + col, return_inverse=True)
+    weight = 1.0 / np.maximum(rows['xco2_uncertainty'].astype(float), 0.1) ** 2
+    return cells, (
+        np.bincount(inverse, weights=weight),
+        np.bincount(inverse, weights=weight * (rows['xco2'] - bias)),
+        np.bincount(inverse),
+    )
+
+def harmonize_day(stores, biases, day, cell_deg=DEFAULT_CELL_DEG):
+    """Harmonized grid of one day: bias-corrected, inverse-variance weighted cell means."""
+    parts = []
+    for sensor, store in stores.items():
+        rows = good_soundings(store.day(day))
+        if len(rows['time']):
+            cells, (weight, weighted, count) = grid_day(rows, biases.get(sensor, 0.0), cell_deg)
+            parts.append((cells, weight, weighted, count, np.ones(len(cells), dtype=np.int64)))
+    if not parts:
+        return None
+
+    cells, weight, weighted, count, sensors = (np.concatenate(x) for x in zip(*parts))
+    cells, inverse = np.unique(cells, return_inverse=True)
+    weight = np.bincount(inverse, weights=weight)
+    n_cols = int(round(360 / cell_deg))
+    return pd.DataFrame({
+        'time': np.full(len(cells), np.datetime64(day, 'D')).astype('datetime64[ns]'),
+        'lat': -90 + (cells // n_cols + 0.5) * cell_deg,
+        'lon': -180 + (cells % n_cols + 0.5) * cell_deg,
+        'xco2': np.bincount(inverse, weights=weighted) / weight,
+        'xco2_uncertainty': 1 / np.sqrt(weight),
+        'n_soundings': np.bincount(inverse, weights=count).astype(np.int64),
+        'n_sensors': np.bincount(inverse, weights=sensors).astype(np.int64),
+    })
+
+def harmonize(stores, biases, sink, cell_deg=DEFAULT_CELL_DEG):
+    """Write the harmonized daily grid through a sink, one batch per year."""
+    frames, year = [], None
+
+    def flush():
+        if frames:
+            df = pd.concat(frames, ignore_index=True)
+            partition = {'year': year, 'variable': 'xco2', 'sensor': 'merged',
+                         'source': f"xco2_merged_{year}.nc"}
+            with stage('sink_write', chunk=f"merged/{year}", nbytes=int(df.memory_usage(index=False).sum())):
+                sink.write(df, partition)
+            frames.clear()
+
+    for day in day_range(stores):
+        date = np.datetime64(int(day), 'D')
+        if str(date)[:4] != year:
+            flush()
+            year = str(date)[:4]
+        with stage('harmonize', chunk=str(date)):
+            frame = harmonize_day(stores, biases, date, cell_deg)
+        if frame is not None:
+            frames.append(frame)
+    flush()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Collocate and merge per-sensor XCO2 sounding stores.")
+    parser.add_argument('stores', help="Directory of per-sensor sounding stores")
+    parser.add_argument('--output', default='/tmp/xco2_merged.parquet')
+    parser.add_argument('--sink', choices=['parquet', 'zarr', 'csv'], default='parquet')
+    parser.add_argument('--reference', help="Sensor the biases are relative to (default: the first one)")
+    parser.add_argument('--cell-deg', type=float, default=DEFAULT_CELL_DEG)
+    parser.add_argument('--max-km', type=float, default=DEFAULT_MAX_KM)
+    parser.add_argument('--max-hours', type=float, default=DEFAULT_MAX_HOURS)
+    parser.add_argument('--pair-stats', default='/tmp/xco2_pair_bias.csv',
+                        help="CSV of the per-pair, per-year bias statistics")
+    args = parser.parse_args(argv)
+
+    stores = open_stores(args.stores)
+    if not stores:
+        raise ValueError(f"No sounding stores found in {args.stores}")
+    reference = args.reference or next(iter(stores))
+
+    stats = pair_statistics(stores, args.max_km, args.max_hours)
+    stats.to_frame().rename(columns={'region': 'pair'}).to_csv(args.pair_stats, index=False)
+    stats.save(os.path.splitext(args.pair_stats)[0] + '.npz')
+    biases = sensor_biases(stats, stores, reference)
+    for sensor, bias in biases.items():
+        print(f"{sensor}: {bias:+.3f} ppm relative to {reference}")
+
+    with make_sink(args.sink, args.output) as sink:
+        harmonize(stores, biases, sink, args.cell_deg)
+    print(f"Harmonized series written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""Decode many NetCDF files in a process pool and return them through shared memory.
+
+Each worker opens one file (a path, or the bytes of an in-memory NetCDF such
+as a ZIP member, which the parent copies once into a shared memory block so
+only its name is pickled to the worker), decodes the variable and copies the data (and its mask, if
+any) into a new shared memory block; only the block names, shape, dtype and
+fill value are pickled back. The parent maps the blocks as masked arrays in
+the input order without another copy. If any file fails, the blocks of the
+others are unlinked before the error is raised.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+from netCDF4 import Dataset
+
+def _to_shared(array):
+    """Copy an array into a new shared memory block owned by the parent."""
+    shm = SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, array.dtype, buffer=shm.buf)[...] = array
+    # The parent unlinks the block; the worker's tracker must not clean it up
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    name = shm.name
+    shm.close()
+    return name
+
+def _unlink(name):
+    try:
+        shm = SharedMemory(name=name)
+    except FileNotFoundError:
+        return
+    shm.close()
+    shm.unlink()
+
+def release(description):
+    """Unlink the shared memory blocks of a worker result that was never attached."""
+    if description is None:
+        return
+    for key in ('data', 'mask'):
+        if description[key] is not None:
+            _unlink(description[key])
+
+def _open(source):
+    """Open a path, NetCDF bytes or a {'shared': name, 'size': n} input block."""
+    if isinstance(source, (str, os.PathLike)):
+        return Dataset(source, 'r'), source, None
+    if isinstance(source, dict):
+        shm = SharedMemory(name=source['shared'])
+        try:
+            return Dataset('memory.nc', mode='r', memory=shm.buf[:source['size']]), 'memory.nc', shm
+        except BaseException:
+            _close_block(shm)
+            raise
+    return Dataset('memory.nc', mode='r', memory=source), 'memory.nc', None
+
+def _close_block(shm):
+    try:
+        shm.close()
+    except BufferError:
+        # Still referenced (e.g. by a failed Dataset); the mapping goes away with it
+        pass
+
+def _share_input(source):
+    """Copy in-memory NetCDF bytes into a shared memory block the workers can open by name."""
+    view = memoryview(source).cast('B')
+    return {'shared': _to_shared(np.frombuffer(view, np.uint8)), 'size': view.nbytes}
+
+def decode_to_shared(source, variable_name):
+    """Worker: decode one variable of a path or NetCDF bytes into shared memory and describe it."""
+    try:
+        nc, name, input_block = _open(source)
+    except FileNotFoundError:
+        print(f"Archivo {source} no encontrado.")
+        return None
+    try:
+        with nc:
+            if variable_name not in nc.variables:
+                print(f"Advertencia: '{variable_name}' no encontrado en {name}")
+                return None
+            data = np.ma.asarray(nc.variables[variable_name][:])
+    finally:
+        if input_block is not None:
+            _close_block(input_block)
+
+    mask = np.ma.getmask(data)
+    description = {
+        'shape': data.shape,
+        'dtype': data.dtype.str,
+        'fill_value': data.fill_value,
+        'data': _to_shared(np.ma.getdata(data)),
+        'mask': None,
+    }
+    try:
+        if mask is not np.ma.nomask and mask.any():
+            description['mask'] = _to_shared(mask)
+    except BaseException:
+        release(description)
+        raise
+    return description
+
+class SharedArrays:
+    """Masked arrays backed by shared memory; close() releases the blocks.
+
+    arrays[i] is the decoded variable of paths[i], or None when it could not
+    be read. Arrays must not be used after close().
+    """
+
+    def __init__(self, descriptions):
+        self.blocks = []
+        self.arrays = [self._attach(description) for description in descriptions]
+
+    def _attach(self, description):
+        if description is None:
+            return None
+        data = self._view(description['data'], description['shape'], description['dtype'])
+        mask = np.ma.nomask
+        if description['mask'] is not None:
+            mask = self._view(description['mask'], description['shape'], '|b1')
+        return np.ma.MaskedArray(data, mask=mask, fill_value=description['fill_value'], copy=False)
+
+    def _view(self, name, shape, dtype):
+        shm = SharedMemory(name=name)
+        self.blocks.append(shm)
+        return np.ndarray(shape, np.dtype(dtype), buffer=shm.buf)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __iter__(self):
+        return iter(self.arrays)
+
+    def __len__(self):
+        return len(self.arrays)
+
+    def __getitem__(self, i):
+        return self.arrays[i]
+
+    def close(self):
+        self.arrays = []
+        for shm in self.blocks:
+            _close_block(shm)
+            shm.unlink()
+        self.blocks = []
+
+def read_netcdf_parallel(sources, variable_name, max_workers=None):
+    """Decode a variable from every source across processes, in input order.
+
+    sources are paths or NetCDF bytes (any buffer, e.g. a memoryview of a
+    ZIP member); variable_name is one name or a list with the name to read
+    from each source.
+    """
+    names = variable_name if isinstance(variable_name, list) else [variable_name] * len(sources)
+    inputs = []
+    try:
+        for source in sources:
+            inputs.append(source if isinstance(source, (str, os.PathLike)) else _share_input(source))
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            futures = [pool.submit(decode_to_shared, source, name) for source, name in zip(inputs, names)]
+    finally:
+        for source in inputs:
+            if isinstance(source, dict):
+                _unlink(source['shared'])
+    # The pool has waited for every file, so all the blocks that were created are known
+    attached = False
+    try:
+        arrays = SharedArrays([future.result() for future in futures])
+        attached = True
+        return arrays
+    finally:
+        if not attached:
+            for future in futures:
+                if not future.cancelled() and future.exception() is None:
+                    release(future.result())
@@ -0,0 +1,141 @@
+"""Pluggable output sinks for processed DataFrames.
+
+Every sink has write(df, partition) and close(). partition is a dict such as
+{'year': '2019', 'variable': 'total_weight_storage_organs', 'sensor': 'c3s',
+'source': 'file.nc'}; each sink uses the keys it needs.
+
+- ParquetSink writes a hive-partitioned Parquet dataset (year=/variable=/sensor=),
+  so queries read only the partitions and columns they need.
+- ZarrSink appends into one consolidated Zarr store, one group per
+  sensor/variable, along an "obs" dimension.
+- CsvSink keeps the old one-CSV-per-NetCDF output.
+
+Writes are idempotent by default: the first write of a run to a CSV file,
+Parquet partition or Zarr group replaces what a previous run left there, so
+rerunning a job does not duplicate rows. append=True keeps the previous
+content and adds to it.
+"""
+import os
+import uuid
+
+import pandas as pd
+
+PARTITION_COLS = ('year', 'variable', 'sensor')
+
+class CsvSink:
+    """One _processed.csv per source file, as before."""
+
+    def __init__(self, root='/tmp', append=False):
+        self.root = root
+        self.append = append
+        self.written = set()
+
+    def write(self, df, partition):
+        path = os.path.join(self.root, partition['source'].replace('.nc', '_processed.csv'))
+        first = path not in self.written and not (self.append and os.path.exists(path))
+        df.to_csv(path, index=False, mode='w' if first else 'a', header=first)
+        self.written.add(path)
+        return path
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class ParquetSink(CsvSink):
+    """Hive-partitioned Parquet dataset with compression.
+
+    By default the partitions written in this run replace their previous
+    content; with append=True new files are added next to it.
+    """
+
+    def __init__(self, root, partition_cols=PARTITION_COLS, compression='zstd', append=False):
+        super().__init__(root, append)
+        self.partition_cols = list(partition_cols)
+        self.compression = compression
+
+    def write(self, df, partition):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        df = df.assign(**{col: str(partition[col]) for col in self.partition_cols})
+        key = tuple(partition[col] for col in self.partition_cols)
+        replace = not self.append and key not in self.written
+        pq.write_to_dataset(
+            pa.Table.from_pandas(df, preserve_index=False),
+            root_path=self.root,
+            partition_cols=self.partition_cols,
+            compression=self.compression,
+            basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet",
+            existing_data_behavior='delete_matching' if replace else 'overwrite_or_ignore',
+        )
+        self.written.add(key)
+        return self.root
+
+class ZarrSink(CsvSink):
+    """Consolidated Zarr store with one group per sensor/variable."""
+
+    def __init__(self, root, group_cols=('sensor', 'variable'), append=False):
+        super().__init__(root, append)
+        self.group_cols = list(group_cols)
+
+    def _group_exists(self, group):
+        group_path = os.path.join(self.root, group)
+        return any(os.path.exists(os.path.join(group_path, name)) for name in ('.zgroup', 'zarr.json'))
+
+    def write(self, df, partition):
+        import xarray as xr
+
+        group = '/'.join(str(partition[col]) for col in self.group_cols)
+        # Row labels restart in every batch, so obs is left without a coordinate
+        ds = xr.Dataset.from_dataframe(df.reset_index(drop=True)).rename({'index': 'obs'}).drop_vars('obs')
+        if 'year' in partition and 'year' not in ds:
+            ds['year'] = ('obs', [int(partition['year'])] * ds.sizes['obs'])
+
+        if group in self.written or (self.append and self._group_exists(group)):
+            ds.to_zarr(self.root, group=group, mode='a', append_dim='obs', consolidated=False)
+        else:
+            ds.to_zarr(self.root, group=group, mode='w', consolidated=False)
+        self.written.add(group)
+        return self.root
+
+    def close(self):
+        if self.written:
+            import zarr
+            zarr.consolidate_metadata(self.root)
+
+SINKS = {
+    'csv': CsvSink,
+    'parquet': ParquetSink,
+    'zarr': ZarrSink,
+}
+
+def make_sink(kind, root, **kwargs):
+    """Create a sink by name: csv, parquet or zarr."""
+    if kind not in SINKS:
+        raise ValueError(f"Unknown sink '{kind}', expected one of {sorted(SINKS)}")
+    return SINKS[kind](root, **kwargs)
+
+def read_parquet(root, columns=None, partition_cols=PARTITION_COLS, **partition):
+    """Read only the given columns and partitions of a Parquet sink.
+
+    Example: read_parquet(root, ['time', 'TWSO'], year='2019', sensor='c3s')
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    # Partition values are written as strings; without a schema year=2019 is read as int32
+    partitioning = ds.HivePartitioning.discover(schema=pa.schema([(col, pa.string()) for col in partition_cols]))
+    filters = [(col, '=', str(value)) for col, value in partition.items()] or None
+    return pd.read_parquet(root, columns=columns, filters=filters, partitioning=partitioning)
+
+def read_zarr(root, sensor, variable, columns=None):
+    """Open one sensor/variable group of a Zarr sink lazily."""
+    import xarray as xr
+
+    ds = xr.open_zarr(root, group=f"{sensor}/{variable}", consolidated=True)
+    return ds[columns] if columns else ds
@@ -0,0 +1,185 @@
+"""Registry of the satellite-carbon-dioxide products downloaded from CDS.
+
+Importing this module has no side effects: it only describes the sensors and
+builds request dicts from them, so it is safe to use for dry runs.
+"""
+import calendar
+import datetime
+import hashlib
+import json
+
+DATASET = "satellite-carbon-dioxide"
+
+MONTHS = [f"{month:02d}" for month in range(1, 13)]
+DAYS = [f"{day:02d}" for day in range(1, 32)]
+
+MID_TROPOSPHERIC_CO2 = 'mid_tropospheric_columns_of_atmospheric_carbon_dioxide'
+XCO2 = 'column_average_dry_air_mole_fraction_of_atmospheric_carbon_dioxide'
+
+# Level-2 sensors downloaded by the job_* modules.
+# bytes_per_day is a rough size of one day of soundings, used for planning only.
+SENSORS = {
+    'iasi_metop_a_nlis': {
+        'label': 'IASI Metop-A',
+        'years': (2007, 2021),
+        'version': '10.1',
+        'variable': MID_TROPOSPHERIC_CO2,
+        'processing_level': 'level_2',
+        'bytes_per_day': 4_000_000,
+    },
+    'iasi_metop_b_nlis': {
+        'label': 'IASI Metop-B',
+        'years': (2013, 2022),
+        'version': '10.1',
+        'variable': MID_TROPOSPHERIC_CO2,
+        'processing_level': 'level_2',
+        'bytes_per_day': 4_000_000,
+    },
+    'iasi_metop_c_nlis': {
+        'label': 'IASI Metop-C',
+        'years': (2019, 2022),
+        'version': '10.1',
+        'variable': MID_TROPOSPHERIC_CO2,
+        'processing_level': 'level_2',
+        'bytes_per_day': 4_000_000,
+    },
+    'airs_nlis': {
+        'label': 'AIRS',
+        'years': (2003, 2007),
+        'version': '3.0',
+        'variable': MID_TROPOSPHERIC_CO2,
+        'processing_level': 'level_2',
+        'bytes_per_day': 3_000_000,
+    },
+    'tanso2_fts_srfp': {
+        'label': 'TANSO2-FTS',
+        'years': (2019, 2022),
+        'version': '2.0.0',
+        'variable': MID_TROPOSPHERIC_CO2,
+        'processing_level': 'level_2',
+        'bytes_per_day': 1_000_000,
+    },
+}
+
+# Products bundled by XCO2.py into one zip per variable and year
+XCO2_VARIABLES = {
+    MID_TROPOSPHERIC_CO2: 'MidTropospheric_CO2',
+    XCO2: 'XCO2',
+}
+XCO2_SENSORS = [
+    'airs_nlis', 'iasi_metop_a_nlis',
+    'iasi_metop_b_nlis', 'iasi_metop_c_nlis',
+    'sciamachy_wfmd', 'sciamachy_besd',
+    'tanso_fts_ocfp', 'tanso_fts_srmp',
+    'tanso2_fts_srmp', 'merged_emma',
+    'merged_obs4mips',
+]
+XCO2_YEARS = (2002, 2022)
+XCO2_BYTES_PER_YEAR = 150_000_000
+
+def sensor_years(name):
+    """Return the valid years of a sensor as a list of strings."""
+    first, last = SENSORS[name]['years']
+    return [str(year) for year in range(first, last + 1)]
+
+def build_request(name, years=None, months=None, days=None):
+    """Build the CDS request dict for a sensor, optionally restricted in time."""
+    sensor = SENSORS[name]
+    valid_years = sensor_years(name)
+    years = [str(year) for year in years] if years else valid_years
+    invalid = sorted(set(years) - set(valid_years))
+    if invalid:
+        raise ValueError(f"{name} has no data for years {invalid}")
+
+    return {
+        'processing_level': sensor['processing_level'],
+        'variable': sensor['variable'],
+        'sensor_and_algorithm': name,
+        'year': years,
+        'month': list(months) if months else MONTHS,
+        'day': list(days) if days else DAYS,
+        'version': sensor['version'],
+    }
+
+def build_xco2_request(variable, year):
+    """Build the XCO2.py request for one variable and one year."""
+    return {
+        'processing_level': ['level_2', 'level_3'],
+        'variable': [variable],
+        'sensor_and_algorithm': XCO2_SENSORS,
+        'year': [str(year)],
+        'version': ['latest'],
+        'data_format': 'zip',
+    }
+
+def normalize_request(dataset, request):
+    """Canonical JSON form of a request: sorted keys, scalars as lists, all strings."""
+    normalized = {}
+    for key, value in request.items():
+        values = value if isinstance(value, (list, tuple)) else [value]
+        normalized[key] = sorted(str(item) for item in values)
+    return json.dumps({'dataset': dataset, 'request': normalized}, sort_keys=True)
+
+def request_hash(dataset, request):
+    """Stable hash of a request, independent of key and list order."""
+    return hashlib.sha256(normalize_request(dataset, request).encode()).hexdigest()
+
+def request_is_mutable(request, today=None):
+    """True when the request covers a period that is not over yet, so CDS may add data to it.
+
+    Version 'latest' alone does not make a request mutable: the XCO2 requests
+    always ask for it, and the data of closed years does not change under it.
+    """
+    def values(key):
+        value = request.get(key, [])
+        return [str(item) for item in (value if isinstance(value, (list, tuple)) else [value])]
+
+    today = today or datetime.date.today()
+    months = [int(month) for month in values('month')] or [12]
+    for year in map(int, values('year')):
+        if year > today.year or (year == today.year and max(months) >= today.month):
+            return True
+    return False
+
+def count_days(request):
+    """Count the calendar days covered by a request (31 day lists are clipped)."""
+    total = 0
+    for year in request['year']:
+        for month in request['month']:
+            month_days = calendar.monthrange(int(year), int(month))[1]
+            total += sum(1 for day in request['day'] if int(day) <= month_days)
+    return total
+
+def estimate_bytes(name, request):
+    """Rough download size of a sensor request."""
+    return count_days(request) * SENSORS[name]['bytes_per_day']
+
+def plan_requests(names=None):
+    """List the planned requests with their estimated sizes, without contacting CDS."""
+    plan = []
+    for name in names or SENSORS:
+        request = build_request(name)
+        plan.append({
+            'name': name,
+            'dataset': DATASET,
+            'request': request,
+            'days': count_days(request),
+            'est_bytes': estimate_bytes(name, request),
+        })
+    return plan
+
+def print_plan(plan):
+    """Print a dry-run plan as a table."""
+    print(f"{'sensor':<22}{'years':>12}{'version':>10}{'days':>8}{'est_MB':>10}")
+    for item in plan:
+        request = item['request']
+        years = f"{request['year'][0]}-{request['year'][-1]}"
+        print(
+            f"{item['name']:<22}{years:>12}{request['version']:>10}"
+            f"{item['days']:>8}{item['est_bytes'] / 1e6:>10.0f}"
+        )
+    total = sum(item['est_bytes'] for item in plan)
+    print(f"Total estimated download: {total / 1e9:.1f} GB")
+
+if __name__ == "__main__":
+    print_plan(plan_requests())
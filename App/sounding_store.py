@@ -0,0 +1,285 @@
+"""Compact column store for level-2 XCO2 soundings.
+
+Consolidation turns a sensor's daily NetCDF files into one fixed-width .npy
+file per column (time, latitude, longitude, xco2, xco2_uncertainty,
+xco2_quality_flag), sorted by time, plus index.npz with the offset of the
+first sounding of every day. It runs in two passes: the first reads only
+the time variables to size the columns and order the files, the second
+decodes one file at a time straight into the memory-mapped columns, so
+memory stays at one file whatever the number of days. Soundings with a
+missing or NaN time are dropped. If files overlap in time, their sorted
+runs are merged block by block into new columns, again without loading
+whole columns.
+
+SoundingStore memory-maps the columns read-only; time and day slices are
+views into the page cache, without decoding or copying.
+
+    python sounding_store.py store/ --files 'data/*.nc'
+    python sounding_store.py store/ --bucket geltonas.tech --s3-keys 2019/co2.zip 2020/co2.zip
+"""
+import argparse
+import glob
+import os
+import re
+
+import numpy as np
+from netCDF4 import Dataset
+
+from tracing import stage
+
+# Column name -> on-disk dtype; time is stored as int64 seconds since 1970-01-01
+COLUMNS = {
+    'time': np.int64,
+    'latitude': np.float32,
+    'longitude': np.float32,
+    'xco2': np.float32,
+    'xco2_uncertainty': np.float32,
+    'xco2_quality_flag': np.int8,
+}
+NAMES = {
+    'time': ('time',),
+    'latitude': ('latitude', 'lat'),
+    'longitude': ('longitude', 'lon'),
+    'xco2': ('xco2',),
+    'xco2_uncertainty': ('xco2_uncertainty',),
+    'xco2_quality_flag': ('xco2_quality_flag', 'quality_flag'),
+}
+INDEX_FILE = 'index.npz'
+SECONDS = {'seconds': 1, 'minutes': 60, 'hours': 3600, 'days': 86400}
+SECONDS_PER_DAY = 86400
+# Rows held in memory, across all runs, while merging overlapping files
+MERGE_ROWS = 1 << 22
+SENSOR_PATTERN = re.compile(r'GHG_PRODUCTS-(.+?)-v\d')
+
+def sensor_from_name(name):
+    """Sensor/algorithm part of a C3S level-2 file name, e.g. TANSO2-FTS-SRFP."""
+    match = SENSOR_PATTERN.search(os.path.basename(name))
+    return match.group(1) if match else os.path.splitext(os.path.basename(name))[0]
+
+def find_name(nc, column):
+    for name in NAMES[column]:
+        if name in nc.variables:
+            return name
+    raise KeyError(f"None of {NAMES[column]} found in {nc.filepath()}")
+
+def time_seconds(variable):
+    """Decode a CF time variable to int64 seconds since 1970-01-01.
+
+    Returns (seconds, valid): missing or NaN times are False in valid and 0
+    in seconds, instead of whatever casting NaN to int64 gives.
+    """
+    values = np.ma.filled(np.ma.asarray(variable[:], dtype=np.float64), np.nan).ravel()
+    valid = np.isfinite(values)
+    seconds = np.zeros(len(values), dtype=np.int64)
+    unit, _, reference = variable.units.partition(' since ')
+    calendar = getattr(variable, 'calendar', 'standard')
+    if unit.strip() in SECONDS and calendar in ('standard', 'gregorian', 'proleptic_gregorian'):
+        reference = reference.strip().removesuffix('UTC').removesuffix('Z').strip().replace(' ', 'T')
+        epoch = np.datetime64(reference, 's').astype(np.int64)
+        seconds[valid] = np.round(values[valid] * SECONDS[unit.strip()]).astype(np.int64) + epoch
+        return seconds, valid
+
+    from netCDF4 import num2date
+
+    dates = num2date(values[valid], variable.units, calendar,
+                     only_use_cftime_datetimes=False, only_use_python_datetimes=True)
+    seconds[valid] = np.array(dates, dtype='datetime64[s]').astype(np.int64)
+    return seconds, valid
+
+def read_soundings(nc):
+    """Columns of the valid soundings of one file, sorted by time."""
+    time, valid = time_seconds(nc.variables[find_name(nc, 'time')])
+    columns = {'time': time}
+    for column in ('latitude', 'longitude', 'xco2', 'xco2_uncertainty', 'xco2_quality_flag'):
+        values = np.ma.asarray(nc.variables[find_name(nc, column)][:]).ravel()
+        valid &= ~np.ma.getmaskarray(values)
+        columns[column] = np.ma.getdata(values)
+    valid &= np.isfinite(columns['xco2'])
+    order = np.argsort(time[valid], kind='stable')
+    return {name: np.asarray(values)[valid][order].astype(COLUMNS[name]) for name, values in columns.items()}
+
+def source_name(source):
+    return source.filepath() if isinstance(source, Dataset) else source
+
+def _open(source):
+    return source if isinstance(source, Dataset) else Dataset(source, 'r')
+
+def _close(source, nc):
+    if nc is not source:
+        nc.close()
+
+def consolidate(sources, directory, label=None):
+    """Write the soundings of NetCDF paths (or open Datasets) as a column store.
+
+    Returns the number of soundings stored.
+    """
+    os.makedirs(directory, exist_ok=True)
+
+    # Pass 1: sizes and first times only
+    sizes, starts = [], []
+    for source in sources:
+        nc = _open(source)
+        try:
+            time, valid = time_seconds(nc.variables[find_name(nc, 'time')])
+        finally:
+            _close(source, nc)
+        sizes.append(len(time))
+        starts.append(time[valid].min() if valid.any() else 0)
+    order = np.argsort(starts, kind='stable')
+
+    # Pass 2: decode file by file into the memory-mapped columns. Invalid
+    # soundings are dropped, so the columns are sized for the upper bound
+    # and only the first `count` rows are used.
+    capacity = int(sum(sizes))
+    columns = {
+        name: np.lib.format.open_memmap(os.path.join(directory, f"{name}.npy"), mode='w+',
+                                        dtype=dtype, shape=(capacity,))
+        for name, dtype in COLUMNS.items()
+    }
+    count, runs = 0, []
+    with stage('consolidate', chunk=label or directory) as record:
+        for position in order:
+            source = sources[position]
+            nc = _open(source)
+            try:
+                data = read_soundings(nc)
+            finally:
+                _close(source, nc)
+            n = len(data['time'])
+            for name, values in data.items():
+                columns[name][count:count + n] = values
+            runs.append((count, count + n))
+            count += n
+        record['bytes'] = sum(array[:count].nbytes for array in columns.values())
+
+    # Daily files normally do not overlap; if they do, merge their sorted runs.
+    # Each run is sorted, so checking where consecutive runs meet is enough.
+    runs = [(start, stop) for start, stop in runs if stop > start]
+    if any(columns['time'][stop - 1] > columns['time'][start] for (_, stop), (start, _) in zip(runs, runs[1:])):
+        with stage('merge_runs', chunk=label or directory):
+            columns = merge_runs(columns, runs, directory)
+    for array in columns.values():
+        array.flush()
+
+    days = columns['time'][:count] // SECONDS_PER_DAY
+    unique_days = np.unique(days)
+    offsets = np.append(np.searchsorted(days, unique_days), count)
+    np.savez(os.path.join(directory, INDEX_FILE), count=count, days=unique_days, offsets=offsets,
+             sources=np.array([source_name(source) for source in sources], dtype=str))
+    del columns
+    return count
+
+def merge_runs(columns, runs, directory, max_rows=None):
+    """Merge the time-sorted runs [(start, stop), ...] of the columns into new column files.
+
+    Each step reads the next block of every run, writes out, sorted, the rows
+    up to the smallest last time among the blocks (nothing later can come
+    before them), and advances each run past them. Returns the new columns.
+    """
+    runs = [[start, stop] for start, stop in runs if stop > start]
+    max_rows = max_rows or MERGE_ROWS
+    count = sum(stop - start for start, stop in runs)
+    block = max(max_rows // max(len(runs), 1), 1)
+    merged = {
+        name: np.lib.format.open_memmap(os.path.join(directory, f"{name}.merged.npy"), mode='w+',
+                                        dtype=array.dtype, shape=(count,))
+        for name, array in columns.items()
+    }
+    time = columns['time']
+    written = 0
+    while runs:
+        blocks = [time[start:min(start + block, stop)] for start, stop in runs]
+        # A block that reaches the end of its run does not limit the others
+        limits = [values[-1] for values, (start, stop) in zip(blocks, runs) if start + len(values) < stop]
+        takes = [int(np.searchsorted(values, min(limits), side='right')) if limits else len(values)
+                 for values in blocks]
+        rows = np.concatenate([np.arange(start, start + take) for (start, _), take in zip(runs, takes)])
+        rows = rows[np.argsort(time[rows], kind='stable')]
+        for name, array in columns.items():
+            merged[name][written:written + len(rows)] = array[rows]
+        written += len(rows)
+        for run, take in zip(runs, takes):
+            run[0] += take
+        runs = [run for run in runs if run[0] < run[1]]
+
+    for name, array in merged.items():
+        array.flush()
+        os.replace(os.path.join(directory, f"{name}.merged.npy"), os.path.join(directory, f"{name}.npy"))
+    return merged
+
+def consolidate_by_sensor(sources, directory):
+    """Consolidate each sensor's files into directory/<sensor>/; returns {sensor: count}."""
+    groups = {}
+    for source in sources:
+        groups.setdefault(sensor_from_name(source_name(source)), []).append(source)
+    return {sensor: consolidate(group, os.path.join(directory, sensor), label=sensor)
+            for sensor, group in sorted(groups.items())}
+
+class SoundingStore:
+    """Read-only, memory-mapped view of a consolidated sounding store."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        with np.load(os.path.join(directory, INDEX_FILE)) as index:
+            self.count = int(index['count'])
+            self.days = index['days']
+            self.offsets = index['offsets']
+        self.columns = {
+            name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode='r')[:self.count]
+            for name in COLUMNS
+        }
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def _rows(self, start, stop):
+        return {name: array[start:stop] for name, array in self.columns.items()}
+
+    def day(self, day):
+        """Columns of one day (a date string or datetime64)."""
+        number = np.datetime64(day, 'D').astype(np.int64)
+        position = np.searchsorted(self.days, number)
+        if position == len(self.days) or self.days[position] != number:
+            return self._rows(0, 0)
+        return self._rows(self.offsets[position], self.offsets[position + 1])
+
+    def slice_time(self, start, end):
+        """Columns of the soundings with start <= time < end, as zero-copy views."""
+        start = np.datetime64(start, 's').astype(np.int64)
+        end = np.datetime64(end, 's').astype(np.int64)
+        # The day index narrows the binary search to the first and last day
+        first = self.offsets[np.searchsorted(self.days, start // SECONDS_PER_DAY)]
+        last = self.offsets[np.searchsorted(self.days, (end - 1) // SECONDS_PER_DAY, side='right')]
+        time = self.columns['time']
+        stop = first + np.searchsorted(time[first:last], end)
+        begin = first + np.searchsorted(time[first:stop], start)
+        return self._rows(begin, stop)
+
+    def times(self, rows):
+        """datetime64 view of the time column of a slice."""
+        return rows['time'].view('datetime64[s]')
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Consolidate level-2 XCO2 files into per-sensor column stores.")
+    parser.add_argument('output', help="Store directory (one subdirectory per sensor)")
+    parser.add_argument('--files', nargs='*', default=[], help="NetCDF paths or glob patterns")
+    parser.add_argument('--bucket', help="Bucket of the zipped CDS deliveries")
+    parser.add_argument('--s3-keys', nargs='*', default=[], help="ZIP object keys to consolidate")
+    args = parser.parse_args(argv)
+
+    paths = sorted(path for pattern in args.files for path in glob.glob(pattern))
+    if paths:
+        print(consolidate_by_sensor(paths, args.output))
+    if args.s3_keys:
+        from s3_stream import get_s3_client
+        from zip_loader import ZipDatasetLoader
+
+        with ZipDatasetLoader(get_s3_client(), args.bucket) as loader:
+            datasets = loader.load(args.s3_keys)
+            print(consolidate_by_sensor(list(datasets.values()), args.output))
+
+if __name__ == "__main__":
+    main()
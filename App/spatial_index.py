@@ -0,0 +1,155 @@
+"""Grid-hash spatial index for level-2 sounding files.
+
+Soundings are hashed into lat/lon cells of cell_deg degrees and their
+positions are stored sorted by cell with CSR-style offsets. The index is
+built once per NetCDF file and saved next to it as <file>.sidx.npz.
+Bounding-box and polygon queries look up the overlapping cells, coalesce
+the matching positions into contiguous ranges and read only those ranges
+of the NetCDF variables instead of scanning every sounding.
+
+Longitudes are expected in [-180, 180] and boxes must not cross the
+antimeridian.
+"""
+import os
+
+import numpy as np
+from netCDF4 import Dataset
+
+from aggregation import point_in_polygon
+
+DEFAULT_CELL_DEG = 1.0
+INDEX_SUFFIX = '.sidx.npz'
+# Gaps up to this many soundings are read through rather than split into two reads
+DEFAULT_MAX_GAP = 256
+LAT_NAMES = ('latitude', 'lat')
+LON_NAMES = ('longitude', 'lon')
+
+class GridIndex:
+    """Positions of the soundings grouped by lat/lon cell."""
+
+    def __init__(self, cell_deg, order, offsets):
+        self.cell_deg = cell_deg
+        self.order = order
+        self.offsets = offsets
+        self.n_rows = int(np.ceil(180 / cell_deg))
+        self.n_cols = int(np.ceil(360 / cell_deg))
+
+    @classmethod
+    def build(cls, lat, lon, cell_deg=DEFAULT_CELL_DEG):
+        """Build the index from latitude/longitude arrays (NaN or masked points are left out)."""
+        lat = np.ma.filled(np.ma.asarray(lat, dtype=float), np.nan).ravel()
+        lon = np.ma.filled(np.ma.asarray(lon, dtype=float), np.nan).ravel()
+        index = cls(cell_deg, None, None)
+        cells = index.cell_ids(lat, lon)
+        dtype = np.int32 if len(cells) < 2 ** 31 else np.int64
+        index.order = np.argsort(cells, kind='stable').astype(dtype)
+        index.offsets = np.searchsorted(cells[index.order], np.arange(index.n_rows * index.n_cols + 1))
+        return index
+
+    def cell_ids(self, lat, lon):
+        """Cell id of every point, -1 for invalid coordinates."""
+        valid = np.isfinite(lat) & np.isfinite(lon)
+        rows = np.clip(np.floor((np.where(valid, lat, 0) + 90) / self.cell_deg), 0, self.n_rows - 1)
+        cols = np.clip(np.floor((np.where(valid, lon, 0) + 180) / self.cell_deg), 0, self.n_cols - 1)
+        return np.where(valid, rows.astype(np.int64) * self.n_cols + cols.astype(np.int64), -1)
+
+    def candidates(self, lat_min, lat_max, lon_min, lon_max):
+        """Sorted positions of the soundings in the cells overlapping a box."""
+        row_min, col_min = self._cell(lat_min, lon_min)
+        row_max, col_max = self._cell(lat_max, lon_max)
+        rows = np.arange(row_min, row_max + 1)
+        starts = self.offsets[rows * self.n_cols + col_min]
+        stops = self.offsets[rows * self.n_cols + col_max + 1]
+        # Cells of one grid row are contiguous in the order array
+        positions = np.concatenate([self.order[start:stop] for start, stop in zip(starts, stops)] or [[]])
+        return np.sort(positions.astype(np.int64))
+
+    def _cell(self, lat, lon):
+        row = int(np.clip(np.floor((lat + 90) / self.cell_deg), 0, self.n_rows - 1))
+        col = int(np.clip(np.floor((lon + 180) / self.cell_deg), 0, self.n_cols - 1))
+        return row, col
+
+    def save(self, path, source_path=None):
+        """Save the index; source_path stamps it with the file size and mtime."""
+        stamp = source_stamp(source_path) if source_path else np.zeros(2)
+        with open(path, 'wb') as f:
+            np.savez_compressed(f, cell_deg=self.cell_deg, order=self.order,
+                                offsets=self.offsets, source=stamp)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(float(data['cell_deg']), data['order'], data['offsets']), data['source']
+
+def source_stamp(path):
+    stat = os.stat(path)
+    return np.array([stat.st_size, stat.st_mtime])
+
+def coalesce(positions, max_gap=DEFAULT_MAX_GAP):
+    """Turn sorted positions into (start, stop) ranges, bridging small gaps."""
+    if len(positions) == 0:
+        return []
+    breaks = np.nonzero(np.diff(positions) > max_gap + 1)[0]
+    starts = np.concatenate([[positions[0]], positions[breaks + 1]])
+    stops = np.concatenate([positions[breaks], [positions[-1]]]) + 1
+    return list(zip(starts.tolist(), stops.tolist()))
+
+def read_ranges(variable, ranges):
+    """Read only the given ranges of a 1-D (or sounding-first) NetCDF variable."""
+    if not ranges:
+        return np.ma.masked_array(np.empty((0,) + variable.shape[1:], dtype=variable.dtype))
+    return np.ma.concatenate([variable[start:stop] for start, stop in ranges])
+
+def find_name(nc, candidates):
+    for name in candidates:
+        if name in nc.variables:
+            return name
+    raise KeyError(f"None of {candidates} found in {nc.filepath()}")
+
+def build_index(nc_path, cell_deg=DEFAULT_CELL_DEG):
+    """Build the index of a NetCDF file and save it next to it."""
+    with Dataset(nc_path, 'r') as nc:
+        lat = nc.variables[find_name(nc, LAT_NAMES)][:]
+        lon = nc.variables[find_name(nc, LON_NAMES)][:]
+    index = GridIndex.build(lat, lon, cell_deg)
+    index.save(nc_path + INDEX_SUFFIX, nc_path)
+    return index
+
+def load_or_build_index(nc_path, cell_deg=DEFAULT_CELL_DEG):
+    """Load the saved index of a file, rebuilding it if missing or stale."""
+    index_path = nc_path + INDEX_SUFFIX
+    if os.path.exists(index_path):
+        index, stamp = GridIndex.load(index_path)
+        if index.cell_deg == cell_deg and np.array_equal(stamp, source_stamp(nc_path)):
+            return index
+    return build_index(nc_path, cell_deg)
+
+def query_bbox(nc_path, variables, lat_min, lat_max, lon_min, lon_max,
+               cell_deg=DEFAULT_CELL_DEG, max_gap=DEFAULT_MAX_GAP, polygon=None):
+    """Read the soundings of a file inside a box (and polygon, if given).
+
+    Returns {name: array} for latitude, longitude, the requested variables
+    and 'index', the positions of the soundings in the file.
+    """
+    index = load_or_build_index(nc_path, cell_deg)
+    ranges = coalesce(index.candidates(lat_min, lat_max, lon_min, lon_max), max_gap)
+    positions = np.concatenate([np.arange(start, stop) for start, stop in ranges] or [[]]).astype(np.int64)
+
+    with Dataset(nc_path, 'r') as nc:
+        lat_name, lon_name = find_name(nc, LAT_NAMES), find_name(nc, LON_NAMES)
+        lat = np.ma.filled(read_ranges(nc.variables[lat_name], ranges).astype(float), np.nan)
+        lon = np.ma.filled(read_ranges(nc.variables[lon_name], ranges).astype(float), np.nan)
+        inside = (lat >= lat_min) & (lat <= lat_max) & (lon >= lon_min) & (lon <= lon_max)
+        if polygon is not None:
+            inside[inside] = point_in_polygon(lat[inside], lon[inside], polygon)
+
+        result = {'index': positions[inside], lat_name: lat[inside], lon_name: lon[inside]}
+        for name in variables:
+            result[name] = read_ranges(nc.variables[name], ranges)[inside]
+    return result
+
+def query_polygon(nc_path, variables, polygon, **kwargs):
+    """Read the soundings of a file inside a polygon of (lat, lon) vertices."""
+    vertices = np.asarray(polygon, dtype=float)
+    return query_bbox(nc_path, variables, vertices[:, 0].min(), vertices[:, 0].max(),
+                      vertices[:, 1].min(), vertices[:, 1].max(), polygon=polygon, **kwargs)
@@ -0,0 +1,133 @@
+"""Synthetic NetCDF fixtures shaped like the CDS products used by the pipeline.
+
+- Crop indicators: one file per dekad with a (time=1, lat, lon) float32
+  variable (DVS, TAGP or TWSO), NaN outside a fixed "land" mask, named like
+  the C3S files (Maize_<variable>_C3S-glob-agric_<year>_1_<date>_...nc).
+- XCO2 level 2: one file per day of time-sorted soundings along swath-like
+  tracks, with time, latitude, longitude, xco2, xco2_uncertainty and
+  xco2_quality_flag.
+"""
+import io
+import os
+import zipfile
+import zlib
+
+import numpy as np
+from netCDF4 import Dataset, date2num
+
+from crop_cube import VARIABLE_CODES
+
+TIME_UNITS = 'days since 1970-01-01 00:00:00'
+# Gamma scale of the synthetic values: development stage is 0-2, biomass is in kg/ha
+CROP_SCALES = {'DVS': 0.3, 'TAGP': 500.0, 'TWSO': 500.0}
+DEKAD_DAYS = ('01', '11', '21')
+
+def land_mask(n_lat, n_lon, seed=0):
+    """Smooth pseudo-random land mask covering about 30% of the grid."""
+    rng = np.random.default_rng(seed)
+    lat = np.linspace(-1, 1, n_lat)[:, None]
+    lon = np.linspace(-1, 1, n_lon)[None, :]
+    field = sum(
+        np.sin(rng.uniform(1, 6) * np.pi * lat + rng.uniform(0, 6)) *
+        np.cos(rng.uniform(1, 6) * np.pi * lon + rng.uniform(0, 6))
+        for _ in range(4)
+    )
+    return field > np.quantile(field, 0.7)
+
+def write_crop_file(path, variable, date, resolution=0.5, seed=0):
+    """Write one dekadal crop indicator file."""
+    code = VARIABLE_CODES[variable]
+    lats = np.arange(-90 + resolution / 2, 90, resolution)
+    lons = np.arange(-180 + resolution / 2, 180, resolution)
+    rng = np.random.default_rng(seed)
+    data = rng.gamma(2.0, CROP_SCALES[code], (1, len(lats), len(lons))).astype(np.float32)
+    if code == 'DVS':
+        data = np.minimum(data, 2.0)
+    data[:, ~land_mask(len(lats), len(lons))] = np.nan
+
+    with Dataset(path, 'w') as nc:
+        nc.createDimension('time', None)
+        nc.createDimension('lat', len(lats))
+        nc.createDimension('lon', len(lons))
+        time = nc.createVariable('time', 'f8', ('time',))
+        time.units = TIME_UNITS
+        time.calendar = 'standard'
+        time[:] = date2num([date.astype('datetime64[s]').item()], TIME_UNITS, 'standard')
+        nc.createVariable('lat', 'f8', ('lat',))[:] = lats
+        nc.createVariable('lon', 'f8', ('lon',))[:] = lons
+        var = nc.createVariable(code, 'f4', ('time', 'lat', 'lon'), zlib=True, complevel=4,
+                                fill_value=np.float32(-9999.0))
+        var.long_name = variable
+        var[:] = np.ma.masked_invalid(data)
+    return path
+
+def crop_file_name(variable, date):
+    year = str(date.astype('datetime64[Y]'))
+    return f"Maize_{variable}_C3S-glob-agric_{year}_1_{date}_dek_CSSF_hist_v1.nc"
+
+def crop_year_zip(variable, year, n_dekads=36, resolution=0.5, workdir='/tmp'):
+    """Build the bytes of a <variable>_year_<year>.zip with n_dekads files."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as zip_ref:
+        for index in range(n_dekads):
+            month, day = divmod(index, 3)
+            date = np.datetime64(f"{year}-{month % 12 + 1:02d}-{DEKAD_DAYS[day]}")
+            path = os.path.join(workdir, crop_file_name(variable, date))
+            write_crop_file(path, variable, date, resolution, seed=index)
+            zip_ref.write(path, os.path.basename(path))
+            os.remove(path)
+    return buffer.getvalue()
+
+def soundings(day, n, seed=0):
+    """Time-sorted soundings of one day along a sun-synchronous-like track."""
+    rng = np.random.default_rng(seed)
+    seconds = np.sort(rng.uniform(0, 86400, n))
+    orbit = 2 * np.pi * seconds / 6060.0
+    lat = 82 * np.sin(orbit) + rng.normal(0, 0.5, n)
+    lon = ((seconds / 86400 * 360 * 14.5 + rng.normal(0, 1.0, n) + 180) % 360) - 180
+    base = 400 + 2.4 * (day.astype('datetime64[Y]').astype(int) - 33)
+    seasonal = 3 * np.sin(2 * np.pi * (day - day.astype('datetime64[Y]')).astype(int) / 365.25)
+    return {
+        'time': day.astype('datetime64[s]') + seconds.astype('timedelta64[s]'),
+        'latitude': np.clip(lat, -90, 90).astype(np.float32),
+        'longitude': lon.astype(np.float32),
+        'xco2': (base + seasonal + rng.normal(0, 1.5, n)).astype(np.float32),
+        'xco2_uncertainty': rng.uniform(0.5, 2.0, n).astype(np.float32),
+        'xco2_quality_flag': (rng.random(n) < 0.1).astype(np.int8),
+    }
+
+def write_sounding_file(path, day, n=50_000, seed=0, bias=0.0):
+    """Write one day of level-2 XCO2 soundings."""
+    data = soundings(day, n, seed)
+    with Dataset(path, 'w') as nc:
+        nc.createDimension('sounding_dim', n)
+        time = nc.createVariable('time', 'f8', ('sounding_dim',), zlib=True)
+        time.units = 'seconds since 1970-01-01 00:00:00'
+        time[:] = data['time'].astype('datetime64[s]').astype(np.int64)
+        for name in ('latitude', 'longitude', 'xco2', 'xco2_uncertainty'):
+            var = nc.createVariable(name, 'f4', ('sounding_dim',), zlib=True,
+                                    fill_value=np.float32(-999.0))
+            var[:] = data[name] + (bias if name == 'xco2' else 0)
+        nc.createVariable('xco2_quality_flag', 'i1', ('sounding_dim',), zlib=True)[:] = data['xco2_quality_flag']
+    return path
+
+def sounding_files(folder, sensor, first_day, n_days, n=50_000, bias=0.0):
+    """Write n_days daily sounding files for a sensor and return their paths."""
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for offset in range(n_days):
+        day = np.datetime64(first_day) + np.timedelta64(offset, 'D')
+        path = os.path.join(folder, f"{day.astype(object):%Y%m%d}-C3S-L2_GHG-GHG_PRODUCTS-{sensor}-v1.nc")
+        paths.append(write_sounding_file(path, day, n, seed=offset + zlib.crc32(sensor.encode()) % 1000, bias=bias))
+    return paths
+
+def sounding_zip(sensor, first_day, n_days, n=50_000, workdir='/tmp'):
+    """Build the bytes of a CDS level-2 delivery: a ZIP of n_days daily sounding files."""
+    buffer = io.BytesIO()
+    folder = os.path.join(workdir, f"{sensor}_{first_day}")
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as zip_ref:
+        for path in sounding_files(folder, sensor, first_day, n_days, n):
+            zip_ref.write(path, os.path.basename(path))
+            os.remove(path)
+    os.rmdir(folder)
+    return buffer.getvalue()
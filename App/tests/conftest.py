@@ -0,0 +1,23 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture
+def s3_bucket(monkeypatch):
+    """Empty moto bucket; the pooled s3_stream client is reset around the test."""
+    boto3 = pytest.importorskip('boto3')
+    moto = pytest.importorskip('moto')
+    import s3_stream
+
+    for name in ('AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY'):
+        monkeypatch.setenv(name, 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', s3_stream.AWS_REGION)
+    with moto.mock_aws():
+        s3_stream._clients.clear()
+        client = boto3.client('s3', region_name=s3_stream.AWS_REGION)
+        client.create_bucket(Bucket='test-bucket')
+        yield client, 'test-bucket'
+    s3_stream._clients.clear()
@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+
+from aggregation import XCO2_EDGES, PartialAggregate, merge_all, variable_edges
+
+def batch(seed, n=5_000, loc=410.0, scale=3.0):
+    rng = np.random.default_rng(seed)
+    values = rng.normal(loc, scale, n)
+    regions = rng.integers(0, 3, n)
+    times = np.datetime64('2020-01-01') + rng.integers(0, 90, n).astype('timedelta64[D]')
+    return values, regions, times
+
+def test_merged_partials_match_a_single_pass(tmp_path):
+    batches = [batch(seed) for seed in range(4)]
+    single = PartialAggregate(['a', 'b', 'c'], 'month', XCO2_EDGES)
+    single.add(*(np.concatenate(parts) for parts in zip(*batches)))
+
+    partials = [PartialAggregate(['a', 'b', 'c'], 'month', XCO2_EDGES).add(*part) for part in batches]
+    partials[0].save(tmp_path / 'first.npz')
+    partials[0] = PartialAggregate.load(tmp_path / 'first.npz')
+    merged = merge_all(partials).to_frame()
+    expected = single.to_frame()
+
+    assert len(expected) == 9
+    assert (merged['count'] == expected['count']).all()
+    for column in ('mean', 'std', 'q05', 'q50', 'q95'):
+        np.testing.assert_allclose(merged[column], expected[column], rtol=1e-10)
+
+def test_quantiles_are_close_to_exact():
+    values, regions, times = batch(0, n=50_000)
+    frame = PartialAggregate(['a', 'b', 'c'], 'year', XCO2_EDGES).add(values, regions * 0, times).to_frame()
+    for q in (0.05, 0.5, 0.95):
+        assert frame[f"q{int(q * 100):02d}"][0] == pytest.approx(np.quantile(values, q), abs=0.1)
+
+def test_edges_are_required_or_derived():
+    with pytest.raises(ValueError):
+        PartialAggregate(['a'])
+    with pytest.raises(ValueError):
+        variable_edges('dmp')
+
+    values, regions, times = batch(1, loc=1011.0, scale=200.0)
+    edges = variable_edges('dmp', values)
+    frame = PartialAggregate(['a', 'b', 'c'], 'year', edges).add(values, regions * 0, times).to_frame()
+    assert frame['underflow'][0] == frame['overflow'][0] == 0
+    assert frame['q50'][0] == pytest.approx(np.median(values), rel=1e-3)
+    assert frame['q95'][0] == pytest.approx(np.quantile(values, 0.95), rel=1e-3)
+
+def test_out_of_range_values_are_not_clipped():
+    values = np.array([300.0, 400.0, 401.0, 402.0, 500.0, 600.0])
+    times = np.full(len(values), np.datetime64('2020-01-01'))
+    with pytest.warns(UserWarning, match='1 values below and 2 above'):
+        aggregate = PartialAggregate(['a'], 'year', XCO2_EDGES).add(values, np.zeros(6, int), times)
+    frame = aggregate.to_frame(qs=(0.1, 0.5, 0.95))
+    assert (frame['underflow'][0], frame['overflow'][0]) == (1, 2)
+    assert frame['mean'][0] == pytest.approx(values.mean())
+    assert np.isnan(frame['q10'][0]) and np.isnan(frame['q95'][0])
+    assert 400.0 <= frame['q50'][0] <= 402.1
+
+def grid_dataset(first_day, loc, seed):
+    import xarray as xr
+
+    rng = np.random.default_rng(seed)
+    times = np.datetime64(first_day) + np.arange(20).astype('timedelta64[D]')
+    lat, lon = np.arange(8.25, 11.3, 0.5), np.arange(-85.75, -82.5, 0.5)
+    data = rng.normal(loc, 50.0, (len(times), len(lat), len(lon)))
+    return xr.Dataset({'dmp': (('time', 'lat', 'lon'), data)}, coords={'time': times, 'lat': lat, 'lon': lon})
+
+def test_files_aggregated_separately_merge_like_one(tmp_path):
+    xr = pytest.importorskip('xarray')
+    from aggregation import aggregate_dataset, aggregate_files, range_edges
+
+    first, second = grid_dataset('2020-01-20', 500.0, 0), grid_dataset('2020-02-05', 900.0, 1)
+    with pytest.raises(ValueError, match='shared'):
+        aggregate_dataset(first, 'dmp')
+
+    both = xr.concat([first, second], 'time')
+    edges = range_edges(float(both['dmp'].min()), float(both['dmp'].max()))
+    expected = aggregate_dataset(both, 'dmp', edges=edges).to_frame()
+    merged = merge_all([aggregate_dataset(first, 'dmp', edges=edges),
+                        aggregate_dataset(second, 'dmp', edges=edges)]).to_frame()
+
+    paths = [str(tmp_path / 'first.nc'), str(tmp_path / 'second.nc')]
+    first.to_netcdf(paths[0])
+    second.to_netcdf(paths[1])
+    pooled = aggregate_files(paths, 'dmp', max_workers=2).to_frame()
+
+    # February has values from both files
+    assert len(expected) == 2 and (expected['count'] > first['dmp'][0].size * 10).all()
+    for frame in (merged, pooled):
+        assert (frame['count'] == expected['count']).all()
+        assert (frame['underflow'] == 0).all() and (frame['overflow'] == 0).all()
+        for column in ('mean', 'std', 'q05', 'q50', 'q95'):
+            np.testing.assert_allclose(frame[column], expected[column], rtol=1e-10)
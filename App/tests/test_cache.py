@@ -0,0 +1,141 @@
+import datetime
+import io
+import os
+import zipfile
+
+import pytest
+
+from cache import DownloadCache
+from fakes import FakeCDSClient
+from sensors import XCO2_VARIABLES, build_xco2_request, request_is_mutable
+
+DATASET = 'satellite-carbon-dioxide'
+REQUEST = {'processing_level': 'level_2', 'sensor_and_algorithm': 'airs_nlis', 'year': ['2005'], 'version': '3.0'}
+
+def zip_payload(size=200_000):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as zip_ref:
+        zip_ref.writestr('data.nc', os.urandom(size))
+    return buffer.getvalue()
+
+class Response:
+    def __init__(self, body, status_code, fail_after=None):
+        self.body, self.status_code, self.fail_after = body, status_code, fail_after
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, size):
+        for start in range(0, len(self.body), 10_000):
+            if self.fail_after is not None and start >= self.fail_after:
+                raise ConnectionError('connection reset')
+            yield self.body[start:start + 10_000]
+
+class Session:
+    """HTTP session serving one payload, honouring Range and optionally dropping mid-transfer."""
+
+    def __init__(self, payload, fail_after=None):
+        self.payload, self.fail_after, self.ranges = payload, fail_after, []
+
+    def get(self, location, headers, stream, timeout):
+        self.ranges.append(headers.get('Range'))
+        if 'Range' in headers:
+            offset = int(headers['Range'][len('bytes='):-1])
+            return Response(self.payload[offset:], 206)
+        return Response(self.payload, 200, self.fail_after)
+
+class Result:
+    location = 'https://cds.example/results/abc.zip'
+
+    def __init__(self, session):
+        self.session = session
+        self.content_length = len(session.payload)
+
+def test_interrupted_download_is_resumed(tmp_path):
+    payload = zip_payload()
+    cache = DownloadCache(str(tmp_path))
+    with pytest.raises(ConnectionError):
+        cache.store(DATASET, REQUEST, Result(Session(payload, fail_after=100_000)))
+    assert cache.get(DATASET, REQUEST) is None
+
+    session = Session(payload)
+    path = cache.store(DATASET, REQUEST, Result(session))
+    assert session.ranges == ['bytes=100000-']
+    assert cache.resumed == 1
+    with open(path, 'rb') as f:
+        assert f.read() == payload
+
+def test_corrupt_resume_is_discarded(tmp_path):
+    payload = zip_payload()
+    cache = DownloadCache(str(tmp_path))
+    with pytest.raises(ConnectionError):
+        cache.store(DATASET, REQUEST, Result(Session(payload, fail_after=100_000)))
+
+    # The server now hands back different bytes at the same location
+    with pytest.raises(IOError):
+        cache.store(DATASET, REQUEST, Result(Session(zip_payload())))
+    path = cache.store(DATASET, REQUEST, Result(Session(payload)))
+    with open(path, 'rb') as f:
+        assert f.read() == payload
+
+def test_hits_skip_cds_and_corrupt_files_are_misses(tmp_path):
+    cache = DownloadCache(str(tmp_path))
+    clients = []
+
+    def factory():
+        clients.append(FakeCDSClient(zip_payload(1000)))
+        return clients[-1]
+
+    path, stats = cache.fetch(factory, DATASET, REQUEST)
+    assert not stats['cached']
+    _, stats = cache.fetch(factory, DATASET, REQUEST)
+    assert stats['cached'] and len(clients) == 1
+
+    with open(path, 'r+b') as f:
+        f.seek(100)
+        f.write(b'\xff')
+    _, stats = cache.fetch(factory, DATASET, REQUEST)
+    assert not stats['cached'] and len(clients) == 2
+
+def test_open_periods_expire_and_closed_ones_do_not(tmp_path):
+    cache = DownloadCache(str(tmp_path), mutable_ttl_s=0)
+    current = dict(REQUEST, year=[str(datetime.date.today().year)])
+    cache.fetch(lambda: FakeCDSClient(zip_payload(1000)), DATASET, current)
+    assert cache.get(DATASET, current) is None
+
+    # XCO2.py always asks for version 'latest'; a closed year stays a hit past the TTL
+    frozen = build_xco2_request(next(iter(XCO2_VARIABLES)), 2015)
+    cache.fetch(lambda: FakeCDSClient(zip_payload(1000)), DATASET, frozen)
+    assert cache.get(DATASET, frozen) is not None
+
+def test_request_is_mutable():
+    today = datetime.date(2024, 5, 10)
+    assert not request_is_mutable({'year': ['2015'], 'version': ['latest']}, today)
+    assert not request_is_mutable({'year': ['2024'], 'month': ['03', '04']}, today)
+    assert request_is_mutable({'year': ['2024'], 'month': ['05']}, today)
+    assert request_is_mutable({'year': ['2023', '2024']}, today)
+
+def test_retried_job_counts_one_miss(tmp_path):
+    import threading
+
+    import main
+
+    cache = DownloadCache(str(tmp_path / 'cache'))
+    attempts = []
+
+    def factory():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise ConnectionError('CDS unavailable')
+        return FakeCDSClient(zip_payload(1000))
+
+    job = {'name': 'job', 'dataset': DATASET, 'request': REQUEST, 'target': str(tmp_path / 'job.zip')}
+    main.run_job(job, factory, threading.BoundedSemaphore(1), retries=2, cache=cache)
+    assert len(attempts) == 3
+    assert (cache.hits, cache.misses) == (0, 1)
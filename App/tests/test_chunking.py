@@ -0,0 +1,30 @@
+from chunking import S3_PREFIX, pending_chunks, plan_chunks
+from fakes import FakeCDSClient
+from sensors import SENSORS
+
+def test_small_years_are_one_chunk_each():
+    chunks = plan_chunks('airs_nlis', years=[2005, 2006])
+    assert [chunk['key'] for chunk in chunks] == ['airs_nlis/v3.0/2005', 'airs_nlis/v3.0/2006']
+    assert chunks[0]['s3_key'] == f"{S3_PREFIX}/airs_nlis/v3.0/2005.zip"
+
+def test_chunks_fit_the_budget_and_keys_are_unique():
+    budget = SENSORS['tanso2_fts_srfp']['bytes_per_day'] * 10
+    chunks = plan_chunks('tanso2_fts_srfp', budget_bytes=budget, years=[2020])
+    assert all(chunk['est_bytes'] <= budget for chunk in chunks)
+    assert len({chunk['key'] for chunk in chunks}) == len(chunks)
+    assert len({chunk['request_hash'] for chunk in chunks}) == len(chunks)
+    days = [day for chunk in chunks for day in chunk['request']['day']]
+    assert len(days) == 366
+
+def test_uploaded_chunk_is_skipped(s3_bucket, tmp_path):
+    import main
+
+    s3_client, bucket = s3_bucket
+    chunks = plan_chunks('airs_nlis', years=[2005, 2006])
+    assert pending_chunks(chunks, s3_client, bucket) == chunks
+
+    jobs = main.jobs_from_chunks(chunks[:1], str(tmp_path))
+    results = main.schedule_jobs(jobs, client_factory=lambda: FakeCDSClient(b'zip bytes'))
+    main.upload_results(chunks, results, bucket, s3_client)
+
+    assert pending_chunks(chunks, s3_client, bucket) == chunks[1:]
@@ -0,0 +1,41 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+APP = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY = ('boto3', 'cdsapi', 'netCDF4', 'xarray')
+# Budget for the pipeline's own start-up on top of a bare interpreter
+MAX_STARTUP_S = 1.0
+
+def run_cli(argv):
+    """Run cli.main(argv) in a fresh interpreter; returns (heavy modules loaded, seconds)."""
+    script = (f"import sys; import cli; cli.main({argv!r}); "
+              f"print('LOADED=' + ','.join(m for m in {HEAVY!r} if m in sys.modules))")
+    started = time.perf_counter()
+    output = subprocess.run([sys.executable, '-c', script], cwd=APP, capture_output=True, text=True, check=True)
+    elapsed = time.perf_counter() - started
+    loaded = output.stdout.strip().splitlines()[-1][len('LOADED='):]
+    return [name for name in loaded.split(',') if name], elapsed
+
+def bare_start():
+    started = time.perf_counter()
+    subprocess.run([sys.executable, '-c', 'pass'], check=True)
+    return time.perf_counter() - started
+
+def manifest(tmp_path):
+    path = tmp_path / 'manifest.json'
+    path.write_text(json.dumps({'airs_nlis/v3.0/2005': {'status': 'fetched', 'request_hash': 'x'}}))
+    return str(path)
+
+def test_plan_and_report_load_no_heavy_modules(tmp_path):
+    for argv in (['plan'], ['plan', '--manifest', manifest(tmp_path)], ['report', '--manifest', manifest(tmp_path)]):
+        loaded, _ = run_cli(argv)
+        assert loaded == [], f"{argv} imported {loaded}"
+
+def test_cold_start_time(tmp_path):
+    bare = min(bare_start() for _ in range(3))
+    for argv in (['plan'], ['report', '--manifest', manifest(tmp_path)]):
+        elapsed = min(run_cli(argv)[1] for _ in range(3))
+        assert elapsed - bare < MAX_STARTUP_S, f"{argv} took {elapsed:.2f}s ({bare:.2f}s bare interpreter)"
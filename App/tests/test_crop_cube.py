@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('netCDF4')
+from netCDF4 import Dataset
+
+import synthetic
+from crop_cube import build_cube, date_from_name, describe_cube
+
+VARIABLE = 'total_weight_storage_organs'
+DATES = np.array(['2020-01-01', '2020-01-11', '2020-01-21'], dtype='datetime64[D]')
+
+def write_files(directory, with_time=True):
+    paths = []
+    for index, date in enumerate(DATES):
+        path = synthetic.write_crop_file(str(directory / synthetic.crop_file_name(VARIABLE, date)), VARIABLE,
+                                         date, resolution=5.0, seed=index)
+        if not with_time:
+            # Same file without its time variable
+            with Dataset(path) as source, Dataset(path + '.notime', 'w') as target:
+                for name, dimension in source.dimensions.items():
+                    target.createDimension(name, len(dimension))
+                for name, variable in source.variables.items():
+                    if name != 'time':
+                        target.createVariable(name, variable.dtype, variable.dimensions)[:] = variable[:]
+            path += '.notime'
+        paths.append(path)
+    return paths
+
+def cube_of(paths):
+    datasets = [Dataset(path) for path in paths]
+    try:
+        return build_cube({VARIABLE: datasets})
+    finally:
+        for nc in datasets:
+            nc.close()
+
+def test_describe_matches_pandas(tmp_path):
+    cube = cube_of(write_files(tmp_path))
+    expected = cube.to_dataframe().describe()
+    pd.testing.assert_frame_equal(describe_cube(cube), expected, check_dtype=False, rtol=1e-5)
+
+def test_files_without_time_axis_use_the_date_in_their_name(tmp_path):
+    cube = cube_of(write_files(tmp_path, with_time=False))
+    np.testing.assert_array_equal(cube['time'].values, DATES.astype('datetime64[ns]'))
+
+def test_date_from_name():
+    assert date_from_name('Maize_TWSO_C3S-glob-agric_2019_1_20190421_dek.nc')[0] == np.datetime64('2019-04-21')
+    with pytest.raises(ValueError):
+        date_from_name('Maize_TWSO_no_date.nc')
@@ -0,0 +1,49 @@
+import pandas as pd
+import pytest
+
+pytest.importorskip('dotenv')
+pytest.importorskip('netCDF4')
+
+import synthetic
+from crop_cube import VARIABLE_CODES
+import Crop_productivity_indicators_Job1 as crop_job
+
+def upload_year(client, bucket, year, workdir):
+    for variable in VARIABLE_CODES:
+        key = f'crop_productivity_indicators/{year}/{variable}_year_{year}.zip'
+        body = synthetic.crop_year_zip(variable, year, n_dekads=6, resolution=10.0, workdir=str(workdir))
+        client.put_object(Bucket=bucket, Key=key, Body=body)
+
+@pytest.fixture
+def crop_bucket(s3_bucket, monkeypatch):
+    client, bucket = s3_bucket
+    monkeypatch.setattr(crop_job, 'BUCKET_NAME', bucket)
+    monkeypatch.setattr(crop_job, 'report_on_exit', lambda name: None)
+    return client, bucket
+
+def test_saved_aggregates_merge_with_the_delta(crop_bucket, tmp_path, monkeypatch, capsys):
+    client, bucket = crop_bucket
+    monkeypatch.setattr(crop_job, 'MANIFEST_LOCATION', f's3://{bucket}/manifests/incremental.json')
+    upload_year(client, bucket, 2019, tmp_path)
+    first = crop_job.main()
+    assert set(first) == set(VARIABLE_CODES)
+
+    upload_year(client, bucket, 2020, tmp_path)
+    capsys.readouterr()
+    incremental = crop_job.main()
+    assert '3 de 6 archivos ZIP ya procesados' in capsys.readouterr().out
+
+    # A fresh manifest processes both years in one run
+    monkeypatch.setattr(crop_job, 'MANIFEST_LOCATION', f's3://{bucket}/manifests/full.json')
+    full = crop_job.main()
+    for variable, summary in full.items():
+        assert summary['time'].dt.year.unique().tolist() == [2019, 2020]
+        pd.testing.assert_frame_equal(incremental[variable], summary)
+        pd.testing.assert_frame_equal(summary[summary['time'].dt.year == 2019], first[variable])
+
+    # Nothing new: the summary comes from the saved aggregates alone
+    capsys.readouterr()
+    again = crop_job.main()
+    assert 'No hay datos nuevos que procesar.' in capsys.readouterr().out
+    for variable, summary in full.items():
+        pd.testing.assert_frame_equal(again[variable], summary)
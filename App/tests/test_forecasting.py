@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from forecasting import HarmonicFit, fit_cached, fit_series
+
+def monthly(n_series=20, n_months=60, seed=0):
+    rng = np.random.default_rng(seed)
+    times = pd.date_range('2015-01-01', periods=n_months, freq='MS').values.astype('datetime64[D]')
+    t = np.arange(n_months) / 12
+    Y = (400 + 2.3 * t + 3 * np.sin(2 * np.pi * t)[None, :]
+         + rng.normal(0, 0.5, (n_series, n_months)) + rng.normal(0, 5, (n_series, 1)))
+    Y[rng.random(Y.shape) < 0.1] = np.nan
+    return np.array([f"s{i}" for i in range(n_series)]), times, Y
+
+def assert_same_fit(fit, reference):
+    # phi and sigma come from y'y - 2 b'X'y + b'X'Xb, so summation order shows at ~1e-8
+    np.testing.assert_allclose(fit.coef, reference.coef, rtol=1e-8, atol=1e-8)
+    np.testing.assert_allclose(fit.phi, reference.phi, rtol=1e-6, atol=1e-8)
+    np.testing.assert_allclose(fit.sigma, reference.sigma, rtol=1e-6)
+    np.testing.assert_array_equal(fit.count, reference.count)
+    np.testing.assert_allclose(fit.forecast(3)[1], reference.forecast(3)[1], rtol=1e-8)
+
+def test_recovers_trend_and_season():
+    ids, times, Y = monthly()
+    fit = fit_series(ids, times, Y)
+    assert fit.to_frame()['trend_per_year'].median() == pytest.approx(2.3, abs=0.1)
+    assert fit.to_frame()['amplitude1'].median() == pytest.approx(3.0, abs=0.2)
+
+def test_appended_months_match_a_full_refit(tmp_path):
+    ids, times, Y = monthly()
+    path = str(tmp_path / 'fit.npz')
+    for end in (36, 37, 45, 60):
+        fit = fit_cached(path, ids, times[:end], Y[:, :end])
+        assert_same_fit(HarmonicFit.load(path), fit)
+    assert_same_fit(fit, fit_series(ids, times, Y))
+
+def test_revised_last_month_matches_a_full_refit(tmp_path):
+    ids, times, Y = monthly()
+    path = str(tmp_path / 'fit.npz')
+    partial = Y[:, :48].copy()
+    partial[:, -1] = np.nan
+    partial[:5, -1] = 390.0
+    fit_cached(path, ids, times[:48], partial)
+
+    # The open month is completed, and later months are appended
+    assert_same_fit(fit_cached(path, ids, times[:48], Y[:, :48]), fit_series(ids, times[:48], Y[:, :48]))
+    assert_same_fit(fit_cached(path, ids, times, Y), fit_series(ids, times, Y))
+
+def test_revised_closed_month_refits(tmp_path, capsys):
+    ids, times, Y = monthly()
+    path = str(tmp_path / 'fit.npz')
+    fit_cached(path, ids, times[:48], Y[:, :48])
+    revised = Y.copy()
+    revised[:, 10] += 5.0
+    fit = fit_cached(path, ids, times, revised)
+    assert 'revised' in capsys.readouterr().out
+    assert_same_fit(fit, fit_series(ids, times, revised))
@@ -0,0 +1,71 @@
+import threading
+import time
+
+import job_tracker
+from fakes import FakeCDSClient
+
+def jobs(tmp_path, n):
+    return [{'name': f"job{i}", 'dataset': 'd', 'request': {'i': i}, 'target': str(tmp_path / f"job{i}.zip")}
+            for i in range(n)]
+
+class CountingClient(FakeCDSClient):
+    """Records how many earlier requests were still in the CDS queue at each submission."""
+
+    pending = []
+
+    def retrieve(self, dataset, request):
+        now = time.monotonic()
+        self.pending.append(sum(result.ready_at > now for result in self.results))
+        result = super().retrieve(dataset, request)
+        self.results.append(result)
+        return result
+
+def test_max_active_caps_the_queued_jobs(tmp_path):
+    CountingClient.pending, CountingClient.results = [], []
+    results = job_tracker.run_jobs(
+        jobs(tmp_path, 6), client_factory=lambda: CountingClient(b'x', latency=0.05, wait_until_complete=False),
+        max_active=2, base_delay=0.01, max_delay=0.02,
+    )
+    assert sorted(stats['name'] for stats in results) == [f"job{i}" for i in range(6)]
+    assert all('error' not in stats for stats in results)
+    assert max(CountingClient.pending) <= 1
+
+def test_failed_job_is_retried(tmp_path):
+    calls = []
+
+    def payload(dataset, request):
+        calls.append(request['i'])
+        if request['i'] == 1 and calls.count(1) < 3:
+            raise RuntimeError('CDS hiccup')
+        return b'data'
+
+    factory = lambda: FakeCDSClient(payload, wait_until_complete=False)
+    results = job_tracker.run_jobs(jobs(tmp_path, 3), client_factory=factory, retries=2,
+                                   base_delay=0.01, max_delay=0.02)
+    assert all('error' not in stats for stats in results)
+    assert calls.count(1) == 3
+
+    calls.clear()
+    results = job_tracker.run_jobs(jobs(tmp_path, 3), client_factory=factory, retries=1,
+                                   base_delay=0.01, max_delay=0.02)
+    assert [stats['name'] for stats in results if 'error' in stats] == ['job1']
+
+def test_scheduler_bounds_the_active_jobs_by_default(tmp_path):
+    import main
+
+    active, peak, lock = [0], [0], threading.Lock()
+
+    class Client(FakeCDSClient):
+        def retrieve(self, dataset, request):
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            try:
+                return super().retrieve(dataset, request)
+            finally:
+                with lock:
+                    active[0] -= 1
+
+    results = main.schedule_jobs(jobs(tmp_path, 12), client_factory=lambda: Client(b'x', latency=0.05))
+    assert len(results) == 12
+    assert peak[0] == job_tracker.DEFAULT_MAX_ACTIVE
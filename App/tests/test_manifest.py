@@ -0,0 +1,48 @@
+import json
+
+import pytest
+
+from manifest import Manifest
+
+CHUNKS = [{'key': f'oco2/v11/{year}', 'request_hash': f'hash-{year}'} for year in (2019, 2020, 2021)]
+
+def round_trip(location, s3_client=None):
+    manifest = Manifest(location, s3_client)
+    assert manifest.delta(CHUNKS) == CHUNKS
+
+    manifest.record('oco2/v11/2019', 'processed', 'hash-2019', size=10)
+    manifest.record('oco2/v11/2020', 'fetched', 'hash-2020', size=20, checksum='abc')
+    manifest.record('oco2/v11/2021', 'failed', 'hash-2021')
+    manifest.save()
+
+    reloaded = Manifest(location, s3_client)
+    assert reloaded.get('oco2/v11/2020')['checksum'] == 'abc'
+    assert reloaded.is_done('oco2/v11/2019', 'hash-2019', 'processed')
+    assert reloaded.is_done('oco2/v11/2020', 'hash-2020')
+    assert not reloaded.is_done('oco2/v11/2020', 'hash-2020', 'processed')
+    assert not reloaded.is_done('oco2/v11/2019', 'changed')
+    assert reloaded.delta(CHUNKS) == CHUNKS[2:]
+    assert reloaded.delta(CHUNKS, 'processed') == CHUNKS[1:]
+    assert reloaded.summary() == {'failed': 1, 'fetched': 1, 'processed': 1}
+
+    # A new request hash starts the entry over
+    reloaded.record('oco2/v11/2020', 'fetched', 'hash-2020b')
+    assert 'checksum' not in reloaded.get('oco2/v11/2020')
+    return reloaded
+
+def test_local_round_trip(tmp_path):
+    location = str(tmp_path / 'manifests' / 'chunks.json')
+    round_trip(location)
+    with open(location) as f:
+        assert set(json.load(f)) == {chunk['key'] for chunk in CHUNKS}
+    assert not (tmp_path / 'manifests' / 'chunks.json.tmp').exists()
+
+def test_s3_round_trip(s3_bucket):
+    client, bucket = s3_bucket
+    round_trip(f's3://{bucket}/manifests/chunks.json', client)
+    body = client.get_object(Bucket=bucket, Key='manifests/chunks.json')['Body'].read()
+    assert set(json.loads(body)) == {chunk['key'] for chunk in CHUNKS}
+
+def test_unknown_status_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        Manifest(str(tmp_path / 'chunks.json')).record('key', 'done', 'hash')
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from aggregation import PartialAggregate
+from merge_sensors import BIAS_EDGES, collocate, haversine_km, pair_label, sensor_biases
+
+def soundings(n, seed):
+    rng = np.random.default_rng(seed)
+    # Clustered around a few spots, including one near the pole and one on the antimeridian
+    centres = np.array([[10.0, -84.0], [88.5, 30.0], [-5.0, 179.8], [45.0, 0.0]])
+    spot = centres[rng.integers(0, len(centres), n)]
+    return {
+        'time': np.sort(rng.integers(0, 86400, n)).astype(np.int64),
+        'latitude': np.clip(spot[:, 0] + rng.normal(0, 1.0, n), -90, 90),
+        'longitude': (spot[:, 1] + rng.normal(0, 1.5, n) + 180) % 360 - 180,
+        'xco2': rng.normal(410, 2, n),
+    }
+
+def brute_force(a, b, max_km, max_hours):
+    distance = haversine_km(a['latitude'][:, None], a['longitude'][:, None], b['latitude'][None], b['longitude'][None])
+    close = (distance <= max_km) & (np.abs(a['time'][:, None] - b['time'][None]) <= max_hours * 3600)
+    count = close.sum(axis=1)
+    with np.errstate(invalid='ignore'):
+        return count, (close * b['xco2'][None]).sum(axis=1) / count
+
+@pytest.mark.parametrize('max_km, max_pairs', [(50.0, 2_000_000), (300.0, 1_000)])
+def test_collocation_matches_brute_force(max_km, max_pairs):
+    a, b = soundings(1500, 0), soundings(2000, 1)
+    count, mean = collocate(a, b, max_km=max_km, max_hours=2.0, max_pairs=max_pairs)
+    expected_count, expected_mean = brute_force(a, b, max_km, 2.0)
+    assert expected_count.sum() > 0
+    np.testing.assert_array_equal(count, expected_count)
+    np.testing.assert_allclose(mean, expected_mean, rtol=1e-12)
+
+def pair_stats(differences):
+    """Pair statistics with the given {(first, second): mean difference}."""
+    labels = [pair_label(*pair) for pair in differences]
+    stats = PartialAggregate(labels, 'year', BIAS_EDGES)
+    for pair_id, difference in enumerate(differences.values()):
+        values = difference + np.array([-0.1, 0.0, 0.1])
+        stats.add(values, np.full(3, pair_id), np.full(3, np.datetime64('2020-06-01')))
+    return stats
+
+def test_biases_chain_through_a_third_sensor():
+    stats = pair_stats({('A', 'B'): 1.0, ('B', 'C'): -0.5})
+    biases = sensor_biases(stats, ['A', 'B', 'C'], 'A')
+    assert biases == pytest.approx({'A': 0.0, 'B': -1.0, 'C': -0.5}, abs=1e-6)
+
+def test_sensors_not_linked_to_the_reference_get_no_offset():
+    stats = pair_stats({('A', 'B'): 1.0, ('C', 'D'): 3.0})
+    with pytest.warns(UserWarning, match=r"\['C', 'D'\]"):
+        biases = sensor_biases(stats, ['A', 'B', 'C', 'D'], 'A')
+    assert biases == pytest.approx({'A': 0.0, 'B': -1.0, 'C': 0.0, 'D': 0.0}, abs=1e-6)
@@ -0,0 +1,52 @@
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip('netCDF4')
+from netCDF4 import Dataset
+
+import synthetic
+from crop_cube import build_cube
+from netcdf_pool import read_netcdf_parallel
+
+VARIABLE = 'total_above_ground_production'
+
+def shm_blocks():
+    return set(os.listdir('/dev/shm')) if os.path.isdir('/dev/shm') else set()
+
+@pytest.fixture
+def crop_files(tmp_path):
+    return [
+        synthetic.write_crop_file(str(tmp_path / synthetic.crop_file_name(VARIABLE, date)), VARIABLE, date,
+                                  resolution=5.0, seed=index)
+        for index, date in enumerate(np.array(['2020-01-01', '2020-01-11', '2020-01-21'], dtype='datetime64[D]'))
+    ]
+
+def test_reads_paths_and_buffers_in_order(crop_files):
+    before = shm_blocks()
+    sources = [crop_files[0], open(crop_files[1], 'rb').read(), memoryview(bytearray(open(crop_files[2], 'rb').read()))]
+    with read_netcdf_parallel(sources, 'TAGP', max_workers=2) as arrays:
+        # Only the decoded arrays are left in shared memory, not the input bytes
+        assert len(shm_blocks() - before) == len(arrays.blocks)
+        for path, array in zip(crop_files, arrays):
+            with Dataset(path) as nc:
+                np.testing.assert_array_equal(np.ma.filled(array, np.nan), np.ma.filled(nc['TAGP'][:], np.nan))
+    assert shm_blocks() == before
+
+def test_failed_file_releases_the_other_blocks(crop_files):
+    before = shm_blocks()
+    with pytest.raises(OSError):
+        read_netcdf_parallel(crop_files + [b'not a netcdf file'], 'TAGP', max_workers=2)
+    assert shm_blocks() == before
+
+def test_pooled_cube_matches_sequential(crop_files):
+    datasets = [Dataset(path) for path in crop_files]
+    try:
+        sequential = build_cube({VARIABLE: datasets})
+        pooled = build_cube({VARIABLE: datasets}, {VARIABLE: crop_files}, max_workers=2)
+    finally:
+        for nc in datasets:
+            nc.close()
+    assert sequential.sizes['time'] == 3
+    assert pooled.identical(sequential)
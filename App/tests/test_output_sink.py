@@ -0,0 +1,28 @@
+import pandas as pd
+import pytest
+
+from output_sink import make_sink, read_parquet
+
+pytest.importorskip('pyarrow')
+
+def frame(values):
+    return pd.DataFrame({'time': pd.to_datetime(['2019-01-01'] * len(values)), 'TWSO': values})
+
+def run(kind, root, **kwargs):
+    with make_sink(kind, str(root), **kwargs) as sink:
+        for source, values in (('a.nc', [1.0, 2.0]), ('b.nc', [3.0])):
+            sink.write(frame(values), {'year': '2019', 'variable': 'twso', 'sensor': 'c3s', 'source': source})
+
+@pytest.mark.parametrize('kind', ['parquet', 'csv'])
+def test_rerun_replaces_previous_output(kind, tmp_path):
+    run(kind, tmp_path)
+    run(kind, tmp_path)
+    if kind == 'parquet':
+        assert sorted(read_parquet(str(tmp_path), ['TWSO'], year='2019')['TWSO']) == [1.0, 2.0, 3.0]
+    else:
+        assert list(pd.read_csv(tmp_path / 'a_processed.csv')['TWSO']) == [1.0, 2.0]
+
+def test_append_is_opt_in(tmp_path):
+    run('parquet', tmp_path)
+    run('parquet', tmp_path, append=True)
+    assert len(read_parquet(str(tmp_path), ['TWSO'])) == 6
@@ -0,0 +1,25 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('dask')
+pytest.importorskip('dotenv')
+
+import synthetic
+from S3ConnectionML import process_netcdf, process_netcdf_lazy
+
+def sort_rows(df):
+    return df.sort_values(['time', 'lat', 'lon']).reset_index(drop=True)
+
+@pytest.mark.parametrize('chunks, batch_rows', [({'time': 1, 'lat': 7, 'lon': 11}, 100), ({}, 10 ** 6)])
+def test_lazy_output_matches_eager(tmp_path, chunks, batch_rows):
+    path = str(tmp_path / 'twso.nc')
+    synthetic.write_crop_file(path, 'total_weight_storage_organs', np.datetime64('2019-01-01'), resolution=2.0)
+
+    eager = process_netcdf(path)
+    batches = list(process_netcdf_lazy(path, chunks=chunks, batch_rows=batch_rows))
+    assert all(len(batch) <= batch_rows for batch in batches)
+    lazy = pd.concat(batches)[eager.columns]
+
+    assert len(eager) > 1000
+    pd.testing.assert_frame_equal(sort_rows(lazy), sort_rows(eager), check_dtype=False)
@@ -0,0 +1,83 @@
+import hashlib
+import io
+import os
+
+import pytest
+
+from fakes import FakeCDSClient
+from s3_stream import MIN_PART_SIZE, stream_result_to_s3, stream_to_s3
+
+def body(s3_client, bucket, key):
+    return s3_client.get_object(Bucket=bucket, Key=key)['Body'].read()
+
+def test_small_stream_is_a_single_put(s3_bucket):
+    s3_client, bucket = s3_bucket
+    data = os.urandom(1000)
+    stats = stream_to_s3(io.BytesIO(data), bucket, 'small.zip', s3_client)
+    assert (stats['bytes'], stats['parts']) == (1000, 1)
+    assert stats['sha256'] == hashlib.sha256(data).hexdigest()
+    assert body(s3_client, bucket, 'small.zip') == data
+
+def test_exact_multiple_of_the_part_size(s3_bucket):
+    s3_client, bucket = s3_bucket
+    data = os.urandom(2 * MIN_PART_SIZE)
+    stats = stream_to_s3(io.BytesIO(data), bucket, 'big.zip', s3_client, part_size=MIN_PART_SIZE, max_workers=2)
+    assert (stats['bytes'], stats['parts']) == (len(data), 2)
+    assert stats['sha256'] == hashlib.sha256(data).hexdigest()
+    assert body(s3_client, bucket, 'big.zip') == data
+
+class BrokenStream(io.BytesIO):
+    """Fails once more than limit bytes have been read."""
+
+    def __init__(self, data, limit):
+        super().__init__(data)
+        self.limit = limit
+
+    def read(self, size=-1):
+        if self.tell() >= self.limit:
+            raise ConnectionError('connection reset')
+        return super().read(size)
+
+def test_failed_stream_aborts_the_multipart_upload(s3_bucket):
+    s3_client, bucket = s3_bucket
+    stream = BrokenStream(os.urandom(3 * MIN_PART_SIZE), MIN_PART_SIZE + 1)
+    with pytest.raises(ConnectionError):
+        stream_to_s3(stream, bucket, 'broken.zip', s3_client, part_size=MIN_PART_SIZE)
+    assert s3_client.list_multipart_uploads(Bucket=bucket).get('Uploads', []) == []
+    assert s3_client.list_objects_v2(Bucket=bucket).get('KeyCount') == 0
+
+class Response:
+    def __init__(self, data):
+        self.raw = io.BytesIO(data)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def raise_for_status(self):
+        pass
+
+class Result:
+    location = 'https://cds.example/results/abc.zip'
+
+    def __init__(self, data):
+        self.session = self
+        self.data = data
+
+    def get(self, location, stream, timeout):
+        return Response(self.data)
+
+def test_result_is_streamed_from_its_location(s3_bucket):
+    s3_client, bucket = s3_bucket
+    data = os.urandom(MIN_PART_SIZE + 1234)
+    stats = stream_result_to_s3(Result(data), bucket, 'result.zip', s3_client, part_size=MIN_PART_SIZE)
+    assert stats['parts'] == 2
+    assert body(s3_client, bucket, 'result.zip') == data
+
+def test_result_without_location_goes_through_a_file(s3_bucket):
+    s3_client, bucket = s3_bucket
+    result = FakeCDSClient(b'PK\x05\x06' + b'\0' * 18).retrieve('dataset', {})
+    stream_result_to_s3(result, bucket, 'fake.zip', s3_client)
+    assert body(s3_client, bucket, 'fake.zip') == b'PK\x05\x06' + b'\0' * 18
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('netCDF4')
+from netCDF4 import Dataset
+
+import sounding_store
+import synthetic
+from sounding_store import SoundingStore, consolidate
+
+def expected_rows(paths):
+    """Valid soundings of all files, sorted by time, read without the store."""
+    columns = {name: [] for name in sounding_store.COLUMNS}
+    for path in paths:
+        with Dataset(path) as nc:
+            data = sounding_store.read_soundings(nc)
+        for name, values in data.items():
+            columns[name].append(values)
+    columns = {name: np.concatenate(parts) for name, parts in columns.items()}
+    order = np.argsort(columns['time'], kind='stable')
+    return {name: values[order] for name, values in columns.items()}
+
+def assert_rows_equal(rows, expected, mask=None):
+    for name, values in expected.items():
+        np.testing.assert_array_equal(rows[name], values if mask is None else values[mask])
+
+def test_day_and_time_slices_match_a_brute_force_mask(tmp_path):
+    paths = synthetic.sounding_files(str(tmp_path / 'files'), 'TANSO-FTS-OCFP', '2020-02-28', 3, n=2_000)
+    assert consolidate(paths[::-1], str(tmp_path / 'store')) == 6_000
+    store = SoundingStore(str(tmp_path / 'store'))
+    expected = expected_rows(paths)
+    assert_rows_equal(store.columns, expected)
+    times = expected['time'].view('datetime64[s]')
+
+    for day in ('2020-02-28', '2020-02-29', '2020-03-01', '2020-03-02'):
+        days = times.astype('datetime64[D]')
+        assert_rows_equal(store.day(day), expected, days == np.datetime64(day))
+
+    for start, end in [('2020-02-28T06:00', '2020-02-29T18:30'), ('2020-02-29', '2020-03-01'),
+                       ('2020-02-01', '2020-02-28T00:00:01'), ('2020-03-01T23:59', '2020-04-01')]:
+        start, end = np.datetime64(start, 's'), np.datetime64(end, 's')
+        rows = store.slice_time(start, end)
+        assert_rows_equal(rows, expected, (times >= start) & (times < end))
+        assert len(rows['xco2']) == 0 or isinstance(rows['xco2'], np.memmap)
+
+def test_overlapping_files_are_merged_in_blocks(tmp_path, monkeypatch):
+    day = np.datetime64('2021-06-01')
+    paths = [synthetic.write_sounding_file(str(tmp_path / f'{index}.nc'), day + offset, n=3_000, seed=index)
+             for index, offset in enumerate([0, 0, 1, 0])]
+    monkeypatch.setattr(sounding_store, 'MERGE_ROWS', 500)
+    assert consolidate(paths, str(tmp_path / 'store')) == 12_000
+    store = SoundingStore(str(tmp_path / 'store'))
+
+    expected = expected_rows(paths)
+    assert np.all(np.diff(store['time']) >= 0)
+    assert_rows_equal({'time': store['time']}, {'time': expected['time']})
+    # Rows stay together: sort both by every column before comparing
+    keys = ('time', 'latitude', 'longitude', 'xco2')
+    got, want = np.lexsort([store[name] for name in keys]), np.lexsort([expected[name] for name in keys])
+    for name in sounding_store.COLUMNS:
+        np.testing.assert_array_equal(store[name][got], expected[name][want])
+    assert len(store.day('2021-06-01')['time']) == 9_000
+    assert len(store.day('2021-06-02')['time']) == 3_000
+    assert not list(tmp_path.joinpath('store').glob('*.merged.npy'))
+
+def test_missing_and_nan_times_are_dropped(tmp_path):
+    path = synthetic.write_sounding_file(str(tmp_path / 'day.nc'), np.datetime64('2022-01-01'), n=1_000)
+    with Dataset(path, 'a') as nc:
+        nc['time'][5] = np.nan
+        nc['time'][7] = np.ma.masked
+    with Dataset(path) as nc:
+        seconds, valid = sounding_store.time_seconds(nc['time'])
+        assert valid.sum() == 998 and not valid[5] and not valid[7]
+        assert seconds[valid].min() >= np.datetime64('2022-01-01', 's').astype(np.int64)
+
+    assert consolidate([path], str(tmp_path / 'store')) == 998
+    store = SoundingStore(str(tmp_path / 'store'))
+    assert store.days.tolist() == [np.datetime64('2022-01-01', 'D').astype(np.int64)]
+    assert len(store.day('2022-01-01')['time']) == 998
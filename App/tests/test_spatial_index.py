@@ -0,0 +1,87 @@
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip('netCDF4')
+from netCDF4 import Dataset
+
+import spatial_index
+import synthetic
+from aggregation import point_in_polygon
+from spatial_index import GridIndex, load_or_build_index, query_bbox, query_polygon
+
+BOXES = [(8.0, 11.3, -86.0, -82.5), (-10.0, 10.0, -180.0, -150.0), (60.0, 90.0, 100.0, 180.0),
+         (-90.0, 90.0, -180.0, 180.0), (0.25, 0.75, 0.25, 0.75)]
+TRIANGLE = [(-40.0, -60.0), (50.0, -10.0), (-20.0, 70.0)]
+
+@pytest.fixture
+def sounding_file(tmp_path):
+    return synthetic.write_sounding_file(str(tmp_path / 'day.nc'), np.datetime64('2020-06-01'), n=20_000)
+
+def read_all(path):
+    with Dataset(path) as nc:
+        return nc['latitude'][:].astype(float), nc['longitude'][:].astype(float), nc['xco2'][:]
+
+def in_box(lat, lon, box):
+    lat_min, lat_max, lon_min, lon_max = box
+    return (lat >= lat_min) & (lat <= lat_max) & (lon >= lon_min) & (lon <= lon_max)
+
+def test_candidates_cover_the_box_and_survive_save_load(tmp_path):
+    rng = np.random.default_rng(0)
+    lat, lon = rng.uniform(-90, 90, 5_000), rng.uniform(-180, 180, 5_000)
+    lat[:10] = np.nan
+    index = GridIndex.build(lat, lon, cell_deg=2.5)
+    assert index.offsets[0] == 10 and index.offsets[-1] == len(lat)
+
+    index.save(str(tmp_path / 'points.sidx.npz'))
+    loaded, stamp = GridIndex.load(str(tmp_path / 'points.sidx.npz'))
+    assert loaded.cell_deg == 2.5 and not stamp.any()
+    np.testing.assert_array_equal(loaded.order, index.order)
+    np.testing.assert_array_equal(loaded.offsets, index.offsets)
+
+    for box in BOXES:
+        candidates = loaded.candidates(*box)
+        assert np.all(np.diff(candidates) > 0)
+        assert set(np.nonzero(in_box(lat, lon, box))[0]) <= set(candidates)
+
+def test_queries_match_a_brute_force_mask(sounding_file):
+    lat, lon, xco2 = read_all(sounding_file)
+    for max_gap in (0, spatial_index.DEFAULT_MAX_GAP):
+        for box in BOXES:
+            result = query_bbox(sounding_file, ['xco2'], *box, max_gap=max_gap)
+            expected = np.nonzero(in_box(lat, lon, box))[0]
+            np.testing.assert_array_equal(result['index'], expected)
+            np.testing.assert_array_equal(result['xco2'], xco2[expected])
+            np.testing.assert_array_equal(result['latitude'], lat[expected])
+
+    result = query_polygon(sounding_file, ['xco2'], TRIANGLE, cell_deg=5.0)
+    expected = np.nonzero(point_in_polygon(lat, lon, TRIANGLE))[0]
+    assert len(expected) > 100
+    np.testing.assert_array_equal(result['index'], expected)
+    np.testing.assert_array_equal(result['xco2'], xco2[expected])
+
+def test_stale_index_is_rebuilt(sounding_file, monkeypatch):
+    index = load_or_build_index(sounding_file)
+    assert os.path.exists(sounding_file + spatial_index.INDEX_SUFFIX)
+
+    # Same file and cell size: loaded from disk, not rebuilt
+    builds = []
+    build_index = spatial_index.build_index
+    monkeypatch.setattr(spatial_index, 'build_index', lambda *args: builds.append(args) or build_index(*args))
+    np.testing.assert_array_equal(load_or_build_index(sounding_file).order, index.order)
+    assert builds == []
+
+    load_or_build_index(sounding_file, cell_deg=2.0)
+    assert len(builds) == 1
+
+    # The file is rewritten with other soundings: the saved stamp no longer matches
+    synthetic.write_sounding_file(sounding_file, np.datetime64('2020-06-02'), n=15_000, seed=3)
+    stat = os.stat(sounding_file)
+    os.utime(sounding_file, (stat.st_atime, stat.st_mtime + 10))
+    rebuilt = load_or_build_index(sounding_file, cell_deg=2.0)
+    assert len(builds) == 2 and rebuilt.offsets[-1] == 15_000
+
+    lat, lon, _ = read_all(sounding_file)
+    result = query_bbox(sounding_file, [], *BOXES[1], cell_deg=2.0)
+    np.testing.assert_array_equal(result['index'], np.nonzero(in_box(lat, lon, BOXES[1]))[0])
@@ -0,0 +1,53 @@
+import os
+import subprocess
+import sys
+import textwrap
+import threading
+import time
+
+import tracing
+
+def test_concurrent_profiled_stages(tmp_path, monkeypatch):
+    monkeypatch.setattr(tracing, 'PROFILE_STAGES', {'hot'})
+    monkeypatch.setattr(tracing, 'TRACE_DIR', str(tmp_path))
+    errors = []
+    barrier = threading.Barrier(4)
+
+    def work():
+        try:
+            barrier.wait()
+            with tracing.stage('hot'):
+                time.sleep(0.05)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert 1 <= len(list(tmp_path.glob('profile_hot_*.prof'))) < 4
+
+def test_sigterm_writes_report_while_workers_are_busy(tmp_path):
+    script = textwrap.dedent(f"""
+        import os, signal, sys, time
+        from concurrent.futures import ThreadPoolExecutor
+        sys.path.insert(0, {os.path.dirname(os.path.abspath(tracing.__file__))!r})
+        from tracing import report_on_exit, stage
+
+        report_on_exit('run', {str(tmp_path)!r})
+        with ThreadPoolExecutor(2) as pool:
+            pool.submit(time.sleep, 60)
+            with stage('setup'):
+                pass
+            os.kill(os.getpid(), signal.SIGTERM)
+    """)
+    process = subprocess.Popen([sys.executable, '-c', script], stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + 20
+    while not (tmp_path / 'run.json').exists() and time.monotonic() < deadline:
+        time.sleep(0.1)
+    process.kill()
+    process.wait()
+    assert (tmp_path / 'run.json').exists()
+    assert 'setup' in (tmp_path / 'run.txt').read_text()
@@ -0,0 +1,53 @@
+import io
+import mmap
+import zipfile
+
+import numpy as np
+import pytest
+
+pytest.importorskip('netCDF4')
+
+import synthetic
+from zip_loader import ZipDatasetLoader, member_buffer
+
+VARIABLE = 'total_weight_storage_organs'
+
+@pytest.fixture(scope='module')
+def nc_bytes(tmp_path_factory):
+    path = tmp_path_factory.mktemp('nc') / 'file.nc'
+    synthetic.write_crop_file(str(path), VARIABLE, np.datetime64('2020-01-01'), resolution=5.0)
+    return path.read_bytes()
+
+def archive(nc_bytes):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as zip_ref:
+        zip_ref.writestr(zipfile.ZipInfo('stored.nc'), nc_bytes, compress_type=zipfile.ZIP_STORED)
+        zip_ref.writestr(zipfile.ZipInfo('deflated.nc'), nc_bytes, compress_type=zipfile.ZIP_DEFLATED)
+        zip_ref.writestr('readme.txt', b'not netcdf')
+    return buffer.getvalue()
+
+def test_member_buffer_is_zero_copy_only_for_stored_members(nc_bytes):
+    data = archive(nc_bytes)
+    with zipfile.ZipFile(io.BytesIO(data)) as zip_ref:
+        stored = member_buffer(zip_ref, zip_ref.getinfo('stored.nc'), data)
+        deflated = member_buffer(zip_ref, zip_ref.getinfo('deflated.nc'), data)
+    assert isinstance(stored, memoryview) and stored.obj is data
+    assert isinstance(deflated, bytes)
+    assert bytes(stored) == deflated == nc_bytes
+
+@pytest.mark.parametrize('spill_threshold', [10 ** 9, 1])
+def test_loader_opens_members_and_cleans_up(s3_bucket, nc_bytes, spill_threshold, tmp_path):
+    s3_client, bucket = s3_bucket
+    s3_client.put_object(Bucket=bucket, Key='year.zip', Body=archive(nc_bytes))
+
+    with ZipDatasetLoader(s3_client, bucket, spill_threshold=spill_threshold, spill_dir=str(tmp_path)) as loader:
+        datasets = loader.load(['year.zip', 'missing.zip'])
+        assert sorted(datasets) == [('year.zip', 'deflated.nc'), ('year.zip', 'stored.nc')]
+        first, second = (nc['TWSO'][:] for nc in datasets.values())
+        np.testing.assert_array_equal(first, second)
+        stored = loader.buffers[('year.zip', 'stored.nc')]
+        assert isinstance(stored.obj, mmap.mmap if spill_threshold == 1 else bytes)
+        # The spill file is unlinked as soon as it is mapped
+        assert list(tmp_path.iterdir()) == []
+    assert all(not nc.isopen() for nc in datasets.values())
+    assert loader.buffers == {}
@@ -0,0 +1,186 @@
+"""Lightweight per-stage tracing for the pipeline scripts.
+
+Wrap work in `with stage('name', chunk=key) as record:` and optionally set
+record['bytes']. Every stage records wall time, bytes, the current RSS and
+the process peak RSS at its end. write_report() writes a JSON file with
+all records plus a per-stage summary, and a text table next to it.
+
+Hot stages can be profiled by listing them in TRACE_PROFILE (comma
+separated). TRACE_PROFILER selects cprofile (default, .prof files) or
+pyinstrument (.html files). Profiles and reports go to TRACE_DIR (default:
+the current directory). Only one profiler can be active in a process, so a
+profiled stage that starts while another one is being profiled (e.g. in
+another thread) runs unprofiled.
+
+Scripts call report_on_exit() at start-up so the report is also written
+when the run is interrupted, e.g. by the workflow timeout.
+"""
+import atexit
+import json
+import os
+import resource
+import signal
+import threading
+import time
+from contextlib import contextmanager
+
+TRACE_DIR = os.getenv("TRACE_DIR", ".")
+PROFILE_STAGES = {name for name in os.getenv("TRACE_PROFILE", "").split(",") if name}
+PROFILER = os.getenv("TRACE_PROFILER", "cprofile")
+
+_records = []
+# Reentrant so the SIGTERM handler can write the report while the main thread holds it
+_lock = threading.RLock()
+_profile_lock = threading.Lock()
+_reports_written = set()
+_page_size = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+def current_rss_mb():
+    """Resident set size of the process right now (Linux), else the peak."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _page_size / 1e6
+    except (OSError, IndexError, ValueError):
+        return peak_rss_mb()
+
+def peak_rss_mb():
+    """Peak resident set size of the process so far."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    return peak / 1e6 if os.uname().sysname == 'Darwin' else peak / 1e3
+
+@contextmanager
+def _profiled(name):
+    if name not in PROFILE_STAGES or not _profile_lock.acquire(blocking=False):
+        yield
+        return
+    try:
+        with _profiler(name):
+            yield
+    finally:
+        _profile_lock.release()
+
+@contextmanager
+def _profiler(name):
+    os.makedirs(TRACE_DIR, exist_ok=True)
+    stamp = f"{name}_{os.getpid()}_{time.time_ns()}"
+    if PROFILER == 'pyinstrument':
+        from pyinstrument import Profiler
+        profiler = Profiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            with open(os.path.join(TRACE_DIR, f"profile_{stamp}.html"), 'w') as f:
+                f.write(profiler.output_html())
+    else:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(os.path.join(TRACE_DIR, f"profile_{stamp}.prof"))
+
+@contextmanager
+def stage(name, chunk=None, nbytes=0):
+    """Trace one stage; the yielded record can be updated (e.g. record['bytes'])."""
+    record = {
+        'stage': name,
+        'chunk': chunk,
+        'bytes': nbytes,
+        'thread': threading.current_thread().name,
+        'started_at': time.time(),
+    }
+    started = time.perf_counter()
+    peak_before = peak_rss_mb()
+    try:
+        with _profiled(name):
+            yield record
+    except BaseException as e:
+        record['error'] = repr(e)
+        raise
+    finally:
+        record['wall_s'] = time.perf_counter() - started
+        record['rss_mb'] = current_rss_mb()
+        record['peak_rss_mb'] = peak_rss_mb()
+        record['peak_rss_growth_mb'] = record['peak_rss_mb'] - peak_before
+        with _lock:
+            _records.append(record)
+
+def records():
+    with _lock:
+        return list(_records)
+
+def summary():
+    """Totals per stage: calls, errors, wall time, bytes, throughput and peak RSS."""
+    stages = {}
+    for record in records():
+        total = stages.setdefault(record['stage'], {
+            'calls': 0, 'errors': 0, 'wall_s': 0.0, 'max_wall_s': 0.0, 'bytes': 0, 'peak_rss_mb': 0.0,
+        })
+        total['calls'] += 1
+        total['errors'] += 'error' in record
+        total['wall_s'] += record['wall_s']
+        total['max_wall_s'] = max(total['max_wall_s'], record['wall_s'])
+        total['bytes'] += record['bytes'] or 0
+        total['peak_rss_mb'] = max(total['peak_rss_mb'], record['peak_rss_mb'])
+    for total in stages.values():
+        total['mb_per_s'] = total['bytes'] / 1e6 / total['wall_s'] if total['wall_s'] else 0.0
+    return stages
+
+def format_summary(stages):
+    lines = [f"{'stage':<28}{'calls':>6}{'errors':>7}{'wall_s':>10}{'max_s':>9}{'MB':>10}{'MB/s':>8}{'peak_MB':>9}"]
+    for name, total in sorted(stages.items(), key=lambda item: -item[1]['wall_s']):
+        lines.append(
+            f"{name:<28}{total['calls']:>6}{total['errors']:>7}{total['wall_s']:>10.1f}"
+            f"{total['max_wall_s']:>9.1f}{total['bytes'] / 1e6:>10.1f}{total['mb_per_s']:>8.1f}"
+            f"{total['peak_rss_mb']:>9.0f}"
+        )
+    return "\n".join(lines)
+
+def write_report(name='run_report', directory=None):
+    """Write <name>.json (records and summary) and <name>.txt, and print the summary."""
+    directory = directory or TRACE_DIR
+    os.makedirs(directory, exist_ok=True)
+    stages = summary()
+    report = {
+        'pid': os.getpid(),
+        'written_at': time.time(),
+        'peak_rss_mb': peak_rss_mb(),
+        'summary': stages,
+        'records': records(),
+    }
+    json_path = os.path.join(directory, name + '.json')
+    with open(json_path, 'w') as f:
+        json.dump(report, f, indent=1, default=str)
+    text = format_summary(stages)
+    with open(os.path.join(directory, name + '.txt'), 'w') as f:
+        f.write(text + "\n")
+    print(text)
+    print(f"Run report written to {json_path}")
+    return json_path
+
+def _write_report_once(name, directory):
+    with _lock:
+        if name in _reports_written:
+            return
+        _reports_written.add(name)
+    write_report(name, directory)
+
+def report_on_exit(name='run_report', directory=None):
+    """Write the report when the process exits, including on SIGTERM or Ctrl-C.
+
+    On SIGTERM the report is written in the handler itself: the SystemExit
+    raised afterwards can still be held up by thread pools waiting for their
+    workers, and the runner kills the process soon after the signal.
+    """
+    def handle_sigterm(signum, frame):
+        _write_report_once(name, directory)
+        raise SystemExit(128 + signum)
+
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, handle_sigterm)
+    atexit.register(_write_report_once, name, directory)
@@ -0,0 +1,158 @@
+"""Load the NetCDF files packed in S3 ZIP objects without extracting them.
+
+ZIP objects are fetched concurrently by a thread pool. Small archives stay in
+memory; large ones are spilled to a temporary file that is memory-mapped and
+unlinked right away, so nothing is left on disk even if the process dies.
+Each .nc member is opened with netCDF4 straight from the archive buffer:
+stored members are sliced from it without copying, deflated ones are
+decompressed in memory.
+"""
+import mmap
+import os
+import struct
+import tempfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+
+from netCDF4 import Dataset
+
+from tracing import stage
+
+DEFAULT_MAX_WORKERS = 8
+SPILL_THRESHOLD = 256 * 1024 * 1024
+LOCAL_HEADER = struct.Struct('<4s5H3L2H')
+
+def member_buffer(zip_ref, info, buffer):
+    """Return the bytes of a ZIP member, as a zero-copy slice when it is stored."""
+    if info.compress_type != zipfile.ZIP_STORED:
+        return zip_ref.read(info)
+    header = LOCAL_HEADER.unpack_from(buffer, info.header_offset)
+    name_length, extra_length = header[-2], header[-1]
+    start = info.header_offset + LOCAL_HEADER.size + name_length + extra_length
+    return memoryview(buffer)[start:start + info.file_size]
+
+class ZipDatasetLoader:
+    """Fetch ZIP objects from S3 and open their .nc members in memory.
+
+    Use as a context manager: on exit every dataset is closed and every
+    memory map is released. buffers holds the bytes of every opened member,
+    by the same key as the datasets, for decoding in other processes.
+    """
+
+    def __init__(self, s3_client, bucket_name, max_workers=DEFAULT_MAX_WORKERS,
+                 spill_threshold=SPILL_THRESHOLD, spill_dir=None):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.max_workers = max_workers
+        self.spill_threshold = spill_threshold
+        self.spill_dir = spill_dir
+        self.stack = ExitStack()
+        self.buffers = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.buffers = {}
+        self.stack.close()
+
+    def fetch(self, s3_key):
+        """Download one ZIP object into memory, or into an unlinked memory-mapped file."""
+        with stage('s3_zip_fetch', chunk=s3_key) as record:
+            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=s3_key)
+            record['bytes'] = response.get('ContentLength', 0)
+            if record['bytes'] <= self.spill_threshold:
+                return response['Body'].read()
+            return self._spill(response)
+
+    def _spill(self, response):
+        with tempfile.TemporaryFile(dir=self.spill_dir) as spill:
+            for block in iter(lambda: response['Body'].read(1024 * 1024), b''):
+                spill.write(block)
+            spill.flush()
+            return mmap.mmap(spill.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def open_members(self, s3_key, buffer):
+        """Open every .nc member of an archive buffer as a netCDF4 Dataset."""
+        datasets = {}
+        if isinstance(buffer, mmap.mmap):
+            self.stack.callback(_close_mmap, buffer)
+        reader = _BufferReader(buffer)
+        with zipfile.ZipFile(reader) as zip_ref:
+            for info in sorted(zip_ref.infolist(), key=lambda info: info.filename):
+                if not info.filename.endswith('.nc'):
+                    continue
+                memory = member_buffer(zip_ref, info, buffer)
+                nc = Dataset(os.path.basename(info.filename), mode='r', memory=memory)
+                self.stack.callback(nc.close)
+                datasets[(s3_key, os.path.basename(info.filename))] = nc
+                self.buffers[(s3_key, os.path.basename(info.filename))] = memory
+        reader.close()
+        return datasets
+
+    def load(self, s3_keys):
+        """Fetch the ZIP objects concurrently and return {(s3_key, member): Dataset}.
+
+        The result is ordered by key and member name; missing keys are skipped.
+        """
+        datasets = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = [(s3_key, pool.submit(self.fetch, s3_key)) for s3_key in s3_keys]
+            for s3_key, future in futures:
+                try:
+                    buffer = future.result()
+                except self.s3_client.exceptions.NoSuchKey:
+                    print(f"No se encontró el objeto {s3_key}")
+                    continue
+                with stage('unzip_open', chunk=s3_key):
+                    datasets.update(self.open_members(s3_key, buffer))
+                print(f"Archivo {s3_key} cargado en memoria")
+        return datasets
+
+class _BufferReader:
+    """Seekable file interface over bytes or an mmap, without copying it."""
+
+    def __init__(self, buffer):
+        self.view = memoryview(buffer)
+        self.position = 0
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_SET:
+            self.position = offset
+        elif whence == os.SEEK_CUR:
+            self.position += offset
+        else:
+            self.position = len(self.view) + offset
+        return self.position
+
+    def read(self, size=-1):
+        end = len(self.view) if size is None or size < 0 else min(len(self.view), self.position + size)
+        data = self.view[self.position:end].tobytes()
+        self.position = end
+        return data
+
+    def close(self):
+        self.view.release()
+
+def _close_mmap(buffer):
+    try:
+        buffer.close()
+    except BufferError:
+        # Member slices are still referenced; the map is released with them.
+        # The spill file is already unlinked, so nothing is left on disk.
+        pass
+
+def open_xarray(nc):
+    """Wrap an open netCDF4 Dataset as an xarray Dataset without reopening it."""
+    import xarray as xr
+    return xr.open_dataset(xr.backends.NetCDF4DataStore(nc))